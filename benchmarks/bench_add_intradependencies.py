@@ -0,0 +1,132 @@
+"""
+Benchmark add_intradependencies on a synthetic graph.
+
+The graph has one node per (package, python variant), with every package depending on a few
+packages that come before it.  Node metadata is faked with just the parts of MetaData that
+add_intradependencies uses, so no recipes need to be rendered.
+
+    python benchmarks/bench_add_intradependencies.py --nodes 5000
+
+The previous implementation, which scanned every node of the graph for every dependency, is
+included for comparison.  It takes minutes at 5000 nodes; use --skip-reference to leave it out.
+"""
+import argparse
+import random
+import time
+
+from conda_build import conda_interface
+import networkx as nx
+
+from conda_concourse_ci import compute_build_graph
+from conda_concourse_ci.compute_build_graph import match_peer_job
+from conda_concourse_ci.utils import ensure_list
+
+PYTHONS = ('2.7', '3.6', '3.7', '3.8')
+
+
+class FakeConfig(object):
+    hash_length = 7
+
+    def __init__(self, variant):
+        self.variant = variant
+
+
+class FakeMetaData(object):
+    """The subset of conda-build's MetaData that add_intradependencies uses"""
+
+    def __init__(self, name, version, python, depends):
+        self._name = name
+        self._version = version
+        self.config = FakeConfig({'python': python, 'target_platform': 'linux-64'})
+        self.meta = {'test': {'requires': []}}
+        self._depends = depends
+
+    def name(self):
+        return self._name
+
+    def version(self):
+        return self._version
+
+    def build_id(self):
+        return 'py{}_0'.format(self.config.variant['python'].replace('.', ''))
+
+    def build_number(self):
+        return 0
+
+    def get_used_vars(self):
+        return {'python', 'target_platform'}
+
+    def get_used_loop_vars(self):
+        return {'python'}
+
+    def ms_depends(self, typ='run'):
+        if typ == 'build':
+            return []
+        return [conda_interface.MatchSpec(dep) for dep in self._depends]
+
+
+def synthetic_graph(n_nodes, deps_per_package=3, seed=0):
+    rng = random.Random(seed)
+    graph = nx.DiGraph()
+    n_packages = n_nodes // len(PYTHONS)
+    for i in range(n_packages):
+        name = 'pkg{}'.format(i)
+        depends = ['pkg{} >=1.0'.format(j)
+                   for j in rng.sample(range(i), min(i, deps_per_package))]
+        for python in PYTHONS:
+            graph.add_node('{}-1.0-python_{}-on-linux'.format(name, python),
+                           meta=FakeMetaData(name, '1.0', python, depends))
+    return graph
+
+
+def reference_add_intradependencies(graph):
+    """add_intradependencies as it was before building a name index"""
+    for node in graph.nodes():
+        m = graph.nodes[node]['meta']
+        internal_deps = ()
+        deps = set(m.ms_depends('build') + m.ms_depends('host') + m.ms_depends('run') +
+                   [conda_interface.MatchSpec(dep) for dep in
+                    ensure_list((m.meta.get('test') or {}).get('requires'))])
+        for dep in deps:
+            if dep.name in internal_deps:
+                continue
+            name_matches = (n for n in graph.nodes() if graph.nodes[n]['meta'].name() == dep.name)
+            for matching_node in name_matches:
+                match_meta = graph.nodes[matching_node]['meta']
+                if (match_peer_job(conda_interface.MatchSpec(dep), match_meta, m) and
+                         (node, matching_node) not in graph.edges()):
+                    shared_vars = set(match_meta.get_used_vars()) & set(m.get_used_vars())
+                    if all(match_meta.config.variant[v] == m.config.variant[v]
+                            for v in shared_vars):
+                        graph.add_edge(node, matching_node)
+
+
+def _time(func, graph):
+    start = time.perf_counter()
+    func(graph)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--deps', type=int, default=3, help="dependencies per package")
+    parser.add_argument('--skip-reference', action='store_true')
+    args = parser.parse_args()
+
+    graph = synthetic_graph(args.nodes, args.deps)
+    elapsed = _time(compute_build_graph.add_intradependencies, graph)
+    print("add_intradependencies: {} nodes, {} edges in {:.2f}s".format(
+        graph.number_of_nodes(), graph.number_of_edges(), elapsed))
+
+    if not args.skip_reference:
+        reference = synthetic_graph(args.nodes, args.deps)
+        reference_elapsed = _time(reference_add_intradependencies, reference)
+        print("reference implementation: {} edges in {:.2f}s".format(
+            reference.number_of_edges(), reference_elapsed))
+        assert set(reference.edges()) == set(graph.edges()), "edges differ from reference"
+        print("speedup: {:.1f}x".format(reference_elapsed / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Tracking the number of active builds on a Concourse server.
+
+submit_batch starts a one-off pipeline whenever fewer than max_builds builds are active.
+Rather than reading the most recent builds from the server over and over, BuildWatcher keeps
+count incrementally: it reads the list of builds once, after that only the builds created
+since the newest one it has seen (the since parameter of /api/v1/builds), and it follows the
+event stream of each active build, so that it knows as soon as one ends.  Builds whose events
+can't be followed (too many of them, or the stream isn't readable) are checked one by one when
+the watcher refreshes.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+log = logging.getLogger(__file__)
+
+# builds that use a worker, or are waiting for one
+ACTIVE_STATUSES = ('pending', 'started')
+# event streams that are followed at the same time
+MAX_FOLLOWERS = 64
+# seconds an event stream can be silent before it is given up on
+EVENT_TIMEOUT = 600
+
+
+class BuildWatcher(object):
+    """
+    The active builds of a Concourse server
+
+    Parameters
+    ----------
+    concourse_url : str
+        The URL of the Concourse CI server
+    lookback : int, optional
+        Number of builds to read at a time
+    token : str, optional
+        Bearer token, for seeing the builds of private pipelines
+    max_followers : int, optional
+        Number of event streams to follow at the same time
+    """
+
+    def __init__(self, concourse_url, lookback=500, token=None, max_followers=MAX_FOLLOWERS):
+        self.concourse_url = concourse_url.rstrip('/') + '/'
+        self.lookback = lookback
+        self.max_followers = max_followers
+        self.session = requests.Session()
+        # a connection for each event stream, and one for reading builds
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=max_followers + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers['Authorization'] = 'Bearer ' + token
+        # the newest build seen so far
+        self.last_id = None
+        # the active builds, by id
+        self.active = {}
+        # builds whose events are being followed, and builds whose events can't be
+        self._followed = set()
+        self._unfollowable = set()
+        self._changed = threading.Condition()
+        self._closed = False
+
+    def _get(self, path, **params):
+        response = self.session.get(self.concourse_url + path, params=params, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    @property
+    def running(self):
+        with self._changed:
+            return len(self.active)
+
+    def _new_builds(self):
+        if self.last_id is None:
+            builds = self._get('api/v1/builds', limit=self.lookback)
+            if not builds:
+                raise ValueError("Unable to read the builds of {}".format(self.concourse_url))
+            return builds
+        builds = []
+        since = self.last_id
+        while True:
+            page = self._get('api/v1/builds', since=since, limit=self.lookback)
+            builds.extend(page)
+            if len(page) < self.lookback:
+                return builds
+            since = max(build['id'] for build in page)
+
+    def refresh(self):
+        """Read the builds created since the last refresh, and the status of the active builds
+        whose events aren't followed.  Returns the number of active builds."""
+        self._refresh()
+        return self.running
+
+    def _refresh(self):
+        """refresh, returning the builds created since the last one"""
+        builds = self._new_builds()
+        if builds:
+            self.last_id = max([build['id'] for build in builds] + [self.last_id or 0])
+        with self._changed:
+            for build in builds:
+                if build['status'] in ACTIVE_STATUSES:
+                    self.active[build['id']] = build
+            unfollowed = sorted(set(self.active) - self._followed)
+        for build_id in unfollowed:
+            if (build_id not in self._unfollowable and
+                    len(self._followed) < self.max_followers):
+                self._follow(build_id)
+            else:
+                self._check(build_id)
+        return builds
+
+    def _check(self, build_id):
+        try:
+            build = self._get('api/v1/builds/{}'.format(build_id))
+        except (requests.RequestException, ValueError) as e:
+            log.warn("Unable to read build %s. Error was: %s", build_id, e)
+            return
+        with self._changed:
+            if build['status'] in ACTIVE_STATUSES:
+                self.active[build_id] = build
+            else:
+                self.active.pop(build_id, None)
+                self._changed.notify_all()
+
+    def _follow(self, build_id):
+        with self._changed:
+            self._followed.add(build_id)
+        thread = threading.Thread(target=self._watch, args=(build_id, ),
+                                  name='build-{}'.format(build_id), daemon=True)
+        thread.start()
+
+    def _watch(self, build_id):
+        """Read the events of a build until it ends"""
+        ended = False
+        try:
+            response = self.session.get(
+                self.concourse_url + 'api/v1/builds/{}/events'.format(build_id),
+                stream=True, timeout=(30, EVENT_TIMEOUT))
+            with response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if self._closed:
+                        break
+                    if line == 'event: end':
+                        ended = True
+                        break
+        except (requests.RequestException, ValueError) as e:
+            log.debug("stopped following build %s: %s", build_id, e)
+        with self._changed:
+            self._followed.discard(build_id)
+            if ended:
+                self.active.pop(build_id, None)
+            elif not self._closed:
+                # the next refresh finds out what happened to it
+                self._unfollowable.add(build_id)
+            self._changed.notify_all()
+
+    def wait_for_slot(self, max_builds, timeout):
+        """Wait until fewer than max_builds builds are active, for up to timeout seconds.
+        Returns whether there is a free slot."""
+        with self._changed:
+            return self._changed.wait_for(
+                lambda: len(self.active) < max_builds or self._closed, timeout)
+
+    def wait_for_new_builds(self, timeout, interval=2, pipeline_name=None):
+        """Refresh every interval seconds until there are builds of pipeline_name (of any
+        pipeline, if None) newer than the ones seen so far, for up to timeout seconds.  Returns
+        whether there are."""
+        if self.last_id is None:
+            self.refresh()
+        deadline = time.time() + timeout
+        while True:
+            if any(pipeline_name is None or build.get('pipeline_name') == pipeline_name
+                   for build in self._refresh()):
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
+    def close(self):
+        """Stop following events"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self.session.close()
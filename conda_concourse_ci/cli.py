@@ -1,10 +1,71 @@
 import argparse
 import logging
 import os
+import sys
 
 from conda_build.conda_interface import cc_conda_build
 
 from conda_concourse_ci import __version__, execute
+from conda_concourse_ci.recipe_log import DEFAULT_MAX_COUNT
+from conda_concourse_ci.stats import SORT_KEYS
+
+
+def _add_graph_args(parser):
+    """Options controlling how the build graph is computed, shared by examine, one-off and
+    batch."""
+    parser.add_argument(
+        '--render-jobs', default=1, type=int,
+        help=("number of processes used to render recipes while computing the build graph. "
+              "The resulting plan does not depend on this value.  Default is 1."))
+    parser.add_argument(
+        '--platform-jobs', default=1, type=int,
+        help=("number of platforms whose build graphs are computed concurrently, each in its "
+              "own process.  The resulting plan does not depend on this value.  Default is 1."))
+    parser.add_argument(
+        '--render-cache-dir',
+        help=("folder for a persistent cache of rendered recipes.  Recipes whose files, "
+              "variants, platform and channels have not changed since a previous run are "
+              "not rendered again."))
+    parser.add_argument(
+        '--render-cache-max-size', type=int,
+        help="maximum size of the render cache in MB.  Default is 2048.")
+    parser.add_argument(
+        '--recipe-log-max-count', type=int, default=DEFAULT_MAX_COUNT,
+        help=("maximum number of commits in the git log that is included with each package "
+              "(recipe_log.txt).  The default, 0, includes the complete history."))
+    parser.add_argument(
+        '--recipe-log-since',
+        help=("only include commits more recent than this date in recipe logs, for example "
+              "2018-01-01 or '1 year ago'.  Relative dates are relative to the start of the "
+              "run."))
+    parser.add_argument(
+        '--recipe-log-cache-dir',
+        help=("folder in which to keep generated recipe logs, so that recipes whose git "
+              "commit has not changed don't need a new log in later runs"))
+    parser.add_argument(
+        '--index-snapshot',
+        help=("read the channel index from this snapshot (see 'c3i index-snapshot') instead of "
+              "downloading it"))
+    parser.add_argument(
+        '--lazy-render', action='store_true',
+        help=("read each recipe's meta.yaml first, and only render the recipes that can end up "
+              "in the build graph.  The resulting plan is the same."))
+    parser.add_argument(
+        '--dependency-index',
+        help=("SQLite file (for example, next to your recipes) in which to keep track of what "
+              "each recipe produces and depends on.  Following the graph downstream (--steps) "
+              "then only renders the recipes that changed since the previous run, instead of "
+              "all of them."))
+    parser.add_argument(
+        '--build-order', choices=('topological', 'critical-path'), default='topological',
+        help=("order of the jobs in the plan and in the output_order files.  critical-path "
+              "starts the longest chains of builds first, using the durations of earlier builds "
+              "(see --build-stats).  Default is %(default)s."))
+    parser.add_argument(
+        '--build-stats', nargs='+',
+        help=("conda-build stats files (stats/<node>_<time>.json, as written by the jobs of "
+              "earlier plans), or folders containing them.  Used by --build-order "
+              "critical-path."))
 
 
 def parse_args(parse_this=None):
@@ -30,6 +91,19 @@ def parse_args(parse_this=None):
     examine_parser.add_argument('--max-downstream', default=5, type=int,
                         help=("Limit the total number of downstream packages built.  Only applies "
                               "if steps != 0.  Set to -1 for unlimited."))
+    examine_parser.add_argument('--save-graph', action='store_true',
+                        help=("Write the computed graph to graph.json next to plan.yml, for "
+                              "--previous-graph of a later examination."))
+    examine_parser.add_argument('--previous-graph',
+                        help=("graph.json written next to plan.yml by a previous examination "
+                              "(see --save-graph).  Only the parts of the graph whose recipes "
+                              "(or settings, or packages in the channels) changed since are "
+                              "computed again.  The new graph is written to graph.json as "
+                              "well."))
+    examine_parser.add_argument('--upstream', action='store_true',
+                        help=("Make sure that every upstream dependency that can't be installed "
+                              "from the channels is built, and report how many recipes that "
+                              "avoids compared with rebuilding everything upstream."))
     examine_parser.add_argument('--git-rev',
                         default='HEAD',
                         help=('start revision to examine.  If stop not '
@@ -66,6 +140,7 @@ def parse_args(parse_this=None):
         '--no-skip-existing', help="Do not skip existing builds",
         dest="skip_existing", action="store_false"
     )
+    _add_graph_args(examine_parser)
     submit_parser = sp.add_parser('submit', help="submit plan director to configured server")
     submit_parser.add_argument('base_name',
                                help="name of your project, to distinguish it from other projects")
@@ -209,6 +284,7 @@ def parse_args(parse_this=None):
             "Best used with the --output-dir option so the output can be inspected"
         ),
     )
+    _add_graph_args(one_off_parser)
 
     batch_parser = sp.add_parser('batch', help="submit a batch of one-off jobs.")
     batch_parser.add_argument(
@@ -228,11 +304,15 @@ def parse_args(parse_this=None):
               "job, default is 6"))
     batch_parser.add_argument(
         '--poll-time', default=120, type=int,
-        help=("time in seconds between checking concourse server for active "
-              "builds, default is 120 seconds."))
+        help=("longest time in seconds to wait for a build to end, or for the builds of a "
+              "submitted pipeline to start, default is 120 seconds."))
     batch_parser.add_argument(
         '--build-lookback', default=500, type=int,
-        help="number of builds to examine for active builds, default is 500")
+        help="number of builds to read from the server at a time, default is 500")
+    batch_parser.add_argument(
+        '--prepare-ahead', default=0, type=int, metavar='N',
+        help=("compute the plans of the next N one-off jobs in N background processes while "
+              "waiting for the server, default is 0 (compute each one when it is submitted)"))
     batch_parser.add_argument(
         '--label-prefix', default='autobot_',
         help="prefix for pipeline labels, default is autobot_")
@@ -291,6 +371,94 @@ def parse_args(parse_this=None):
         help="Uploads built packages to staging channel",
         action="store_true",
     )
+    _add_graph_args(batch_parser)
+    snapshot_parser = sp.add_parser(
+        'index-snapshot',
+        help="save the channel index locally, for use with --index-snapshot")
+    snapshot_parser.add_argument('snapshot_dir', help="folder to write the snapshot to")
+    snapshot_parser.add_argument('--channel', '-c', action='append',
+                                 help="Additional channel to use when building packages")
+    snapshot_parser.add_argument('--subdir', action='append', dest='subdirs',
+                                 help=("subdir (for example, linux-64) to save the index of.  "
+                                       "Defaults to the subdirs of the build platforms in "
+                                       "--config-root-dir"))
+    snapshot_parser.add_argument('--config-root-dir',
+                                 help="path containing config.yml and matrix definitions",
+                                 default=cc_conda_build.get('matrix_base_dir'))
+    snapshot_parser.add_argument('--platform-filter', '-p', action='append',
+                                 help="glob pattern(s) to filter build platforms.  For example, "
+                                 "linux* will use all platform files whose filenames start with "
+                                 "linux", dest='platform_filters')
+    stats_parser = sp.add_parser('stats', help="collect and report build statistics")
+    stats_sp = stats_parser.add_subparsers(title='stats commands', dest='stats_command')
+    stats_sp.required = True
+    stats_ingest_parser = stats_sp.add_parser(
+        'ingest', help="add conda-build stats files (stats/<node>_<time>.json) to a database")
+    stats_ingest_parser.add_argument('paths', nargs='+',
+                                     help=("stats files, or folders containing them (for "
+                                           "example, a copy of "
+                                           "<intermediate-base-folder>/stats)"))
+    stats_query_parser = stats_sp.add_parser(
+        'query', help="report the slowest and most memory-hungry recipes")
+    stats_query_parser.add_argument('--sort', choices=sorted(SORT_KEYS),
+                                    help=("only report the recipes that are highest in this.  "
+                                          "Default is both elapsed and rss."))
+    stats_query_parser.add_argument('--limit', type=int, default=20,
+                                    help="number of recipes to report.  Default is %(default)s.")
+    stats_query_parser.add_argument('--platform',
+                                    help="only report builds on this platform (worker label)")
+    stats_query_parser.add_argument('--package', help="only report builds of this package")
+    stats_query_parser.add_argument('--include-tests', action='store_true',
+                                    help="include test-only jobs")
+    for stats_command_parser in (stats_ingest_parser, stats_query_parser):
+        stats_command_parser.add_argument('--db', default='c3i_stats.sqlite',
+                             help="build stats database.  Default is %(default)s.")
+    simulate_parser = sp.add_parser(
+        'simulate', help="estimate how long a plan takes on the available workers")
+    simulate_parser.add_argument('path',
+                                 help=("graph.json or plan.yml written by c3i examine, or the "
+                                       "folder containing them"))
+    simulate_parser.add_argument('--config-root-dir',
+                                 help=("path containing build_platforms.d.  The \"workers\" key "
+                                       "of each platform is its number of workers."),
+                                 default=cc_conda_build.get('matrix_base_dir'))
+    simulate_parser.add_argument('--platform-filter', '-p', action='append',
+                                 help="glob pattern(s) to filter build platforms",
+                                 dest='platform_filters')
+    simulate_parser.add_argument('--workers', nargs='+',
+                                 help=("LABEL=N: number of workers for the platform labeled "
+                                       "LABEL, instead of the one in build_platforms.d"))
+    simulate_parser.add_argument('--build-stats', nargs='+',
+                                 help=("stats files, folders containing them or build stats "
+                                       "databases (see c3i stats) to take job durations from"))
+    simulate_parser.add_argument('--job-overhead', type=float, default=0,
+                                 help=("seconds added to every job for getting resources, "
+                                       "consolidating artifacts and so on.  Default is "
+                                       "%(default)s."))
+    simulate_parser.add_argument('--build-order', choices=('topological', 'critical-path'),
+                                 default='topological',
+                                 help=("order in which jobs that are ready at the same time "
+                                       "start.  Default is %(default)s."))
+    local_run_parser = sp.add_parser(
+        'local-run', help="build a plan written by examine on this machine, without Concourse")
+    local_run_parser.add_argument('output_dir',
+                                  help=("output folder of c3i examine (with the recipes, "
+                                        "output_order files and graph.json or plan.yml)"))
+    local_run_parser.add_argument('--jobs', '-j', type=int, default=1,
+                                  help=("number of conda-build processes to run at the same "
+                                        "time.  Default is %(default)s."))
+    local_run_parser.add_argument('--label', action='append', dest='labels',
+                                  help=("glob pattern(s) of the worker labels whose nodes to "
+                                        "build.  Default is all of them."))
+    local_run_parser.add_argument('--work-dir',
+                                  help=("folder for the logs, packages and stats of each node.  "
+                                        "Default is <output_dir>/local-run."))
+    local_run_parser.add_argument('--channel', '-c', action='append',
+                                  help="Additional channel to use when building packages")
+    local_run_parser.add_argument('--stop-on-failure', action='store_false', dest='keep_going',
+                                  help="don't start any more builds once one has failed")
+    local_run_parser.add_argument('--dry-run', action='store_true',
+                                  help="print the conda-build commands instead of running them")
     rm_parser = sp.add_parser('rm', help='remove pipelines from server')
     rm_parser.add_argument('pipeline_names', nargs="+",
                            help=("Specify pipeline names on server to remove"))
@@ -331,6 +499,12 @@ def parse_args(parse_this=None):
                            help="path containing config.yml and matrix definitions",
                            default=cc_conda_build.get('matrix_base_dir'))
 
+    for bulk_parser in (rm_parser, pause_parser, unpause_parser, trigger_parser, abort_parser):
+        bulk_parser.add_argument(
+            '--parallel', type=int, default=1,
+            help=("number of pipelines to work on at the same time.  Default is "
+                  "%(default)s."))
+
     return parser.parse_known_args(parse_this)
 
 
@@ -358,16 +532,36 @@ def main(args=None):
         execute.submit_one_off(pass_throughs=pass_throughs, **args.__dict__)
     elif args.subparser_name == 'batch':
         execute.submit_batch(pass_throughs=pass_throughs, **args.__dict__)
+    elif args.subparser_name == 'index-snapshot':
+        execute.index_snapshot(pass_throughs=pass_throughs, **args.__dict__)
+    elif args.subparser_name == 'stats':
+        if args.stats_command == 'ingest':
+            execute.stats_ingest(pass_throughs=pass_throughs, **args.__dict__)
+        elif args.stats_command == 'query':
+            execute.stats_query(pass_throughs=pass_throughs, **args.__dict__)
+        else:
+            raise NotImplementedError("Command stats {} is not implemented".format(
+                args.stats_command))
+    elif args.subparser_name == 'simulate':
+        execute.simulate(pass_throughs=pass_throughs, **args.__dict__)
+    elif args.subparser_name == 'local-run':
+        if not execute.local_run(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     elif args.subparser_name == 'rm':
-        execute.rm_pipeline(pass_throughs=pass_throughs, **args.__dict__)
+        if execute.rm_pipeline(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     elif args.subparser_name == 'pause':
-        execute.pause_pipeline(pass_throughs=pass_throughs, **args.__dict__)
+        if execute.pause_pipeline(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     elif args.subparser_name == 'unpause':
-        execute.unpause_pipeline(pass_throughs=pass_throughs, **args.__dict__)
+        if execute.unpause_pipeline(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     elif args.subparser_name == 'trigger':
-        execute.trigger_pipeline(pass_throughs=pass_throughs, **args.__dict__)
+        if execute.trigger_pipeline(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     elif args.subparser_name == 'abort':
-        execute.abort_pipeline(pass_throughs=pass_throughs, **args.__dict__)
+        if execute.abort_pipeline(pass_throughs=pass_throughs, **args.__dict__):
+            sys.exit(1)
     else:
         # this is here so that if future subcommands are added, you don't forget to add a bit
         #     here to enable them.
@@ -1,19 +1,29 @@
 #!/usr/bin/env python
 from __future__ import division, print_function
 
+import heapq
+import json
 import logging
 import os
 import re
 import subprocess
+import weakref
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import conda_build
 from conda_build import api, conda_interface
 from conda_build.build import is_package_built
 from conda_build.metadata import MetaData, find_recipe
 
 import networkx as nx
 
-import pkg_resources
-
+from .dependency_index import DependencyIndex, folder_states
+from .installability import InstallabilityIndex, normalize_spec
+from .node_record import NodeRecord, node_record
+from .recipe_index import RecipeIndex
+from .recipe_log import write_recipe_log, write_recipe_logs
+from .render_cache import RenderCache
 from .utils import HashableDict, ensure_list
 
 
@@ -23,17 +33,23 @@ hash_length = api.Config().hash_length
 
 
 def package_key(metadata, worker_label, run='build'):
+    """metadata is either a MetaData or a NodeRecord"""
     # get the build string from whatever conda-build makes of the configuration
-
-    used_loop_vars = metadata.get_used_loop_vars()
-    build_vars = '-'.join([k + '_' + str(metadata.config.variant[k]) for k in used_loop_vars
+    if isinstance(metadata, NodeRecord):
+        used_loop_vars, variant, subdir = metadata.used_vars, metadata.variant, metadata.subdir
+        name, version = metadata.name, metadata.version
+    else:
+        used_loop_vars = metadata.get_used_loop_vars()
+        variant, subdir = metadata.config.variant, metadata.config.subdir
+        name, version = metadata.name(), metadata.version()
+    build_vars = '-'.join([k + '_' + str(variant[k]) for k in used_loop_vars
                           if k != 'target_platform'])
     # kind of a special case.  Target platform determines a lot of output behavior, but may not be
     #    explicitly listed in the recipe.
-    tp = metadata.config.variant.get('target_platform')
-    if tp and tp != metadata.config.subdir:
+    tp = variant.get('target_platform')
+    if tp and tp != subdir:
         build_vars += '-target_' + tp
-    key = [metadata.name(), metadata.version()]
+    key = [name, version]
     if build_vars:
         key.append(build_vars)
     key.extend(['on', worker_label])
@@ -44,75 +60,151 @@ def package_key(metadata, worker_label, run='build'):
     return key
 
 
-def _git_changed_files(git_rev, stop_rev=None, git_root=''):
-    if not git_root:
-        git_root = os.getcwd()
-    if stop_rev:
-        git_rev = "{0}..{1}".format(git_rev, stop_rev)
-    output = subprocess.check_output(['git', 'diff-tree', '--no-commit-id',
-                                      '--name-only', '-r', git_rev],
-                                     cwd=git_root)
-    files = output.decode().splitlines()
-    return files
+# git's empty tree.  The "parent" of a root commit.
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+GITLINK_MODE = '160000'
 
+# One changed top-level folder.  kind is one of 'modified', 'renamed', 'new submodule' and
+#    'submodule' (a submodule checked out at a different commit).  files are the changed files,
+#    relative to folder.
+RecipeChange = namedtuple('RecipeChange', ('folder', 'kind', 'files'))
 
-def _get_base_folders(base_dir, changed_files):
-    recipe_dirs = []
-    for f in changed_files:
-        # only consider files that come from folders
-        if '/' in f:
-            f = f.split('/')[0]
-        try:
-            find_recipe(os.path.join(base_dir, f))
-            recipe_dirs.append(f)
-        except IOError:
-            pass
-    return recipe_dirs
-
+# find_recipe results (None if there is no recipe), by folder
+_recipe_paths = {}
 
-def git_changed_submodules(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
-    if stop_rev is not None:
-        git_rev = "{0}..{1}".format(git_rev, stop_rev)
-    diff_script = pkg_resources.resource_filename('conda_concourse_ci', 'diff-script.sh')
 
-    diff = subprocess.check_output(['bash', diff_script, git_rev],
-                                    cwd=git_root, universal_newlines=True)
-
-    submodule_changed_files = [line.split() for line in diff.splitlines()]
+def _find_recipe(path):
+    path = os.path.abspath(path)
+    if path not in _recipe_paths:
+        try:
+            _recipe_paths[path] = find_recipe(path)
+        except IOError:
+            _recipe_paths[path] = None
+    return _recipe_paths[path]
 
-    submodules_with_recipe_changes = []
-    for submodule in submodule_changed_files:
-        for file in submodule:
-            if 'recipe/' in file and submodule[0] not in submodules_with_recipe_changes:
-                submodules_with_recipe_changes.append(submodule[0])
 
-    return submodules_with_recipe_changes
+def _git_raw_diff(git_rev, stop_rev=None, git_root=''):
+    """Parse ``git diff --raw`` into a list of (status, old mode, new mode, old sha, new sha,
+    old path, new path).  The shas are full object names, since those of submodules are
+    resolved in the submodules, where an abbreviation may not be unique.
 
+    Without stop_rev, this compares the parent of git_rev with the working tree.  That covers
+    both the changes of git_rev itself and any submodules (or recipes) changed since."""
+    if stop_rev:
+        revs = [git_rev, stop_rev]
+    else:
+        revs = [git_rev + '^']
+    cmd = ['git', 'diff', '--raw', '--no-abbrev', '-z', '-M', '--no-color', '--no-ext-diff']
+    try:
+        output = subprocess.check_output(cmd + revs + ['--'], cwd=git_root,
+                                         stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError:
+        if stop_rev:
+            raise
+        # git_rev is a root commit, so compare with nothing at all
+        output = subprocess.check_output(cmd + [EMPTY_TREE, '--'], cwd=git_root)
+    fields = output.decode('utf-8', errors='surrogateescape').split('\0')
+    entries = []
+    i = 0
+    while i < len(fields) - 1:
+        old_mode, new_mode, old_sha, new_sha, status = fields[i].lstrip(':').split(' ')
+        if status[0] in 'RC':
+            old_path, new_path = fields[i + 1], fields[i + 2]
+            i += 3
+        else:
+            old_path = new_path = fields[i + 1]
+            i += 2
+        entries.append((status[0], old_mode, new_mode, old_sha, new_sha, old_path, new_path))
+    return entries
 
-def git_new_submodules(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
-    if stop_rev is not None:
-        git_rev = "{0}..{1}".format(git_rev, stop_rev)
 
-    new_submodule_script = pkg_resources.resource_filename('conda_concourse_ci',
-                                                           'new-submodule-script.sh')
+def _submodule_changed_files(git_root, submodule, old_sha, new_sha):
+    """Files changed in a submodule between old_sha and new_sha (or the submodule's working
+    tree, if new_sha is None).  None if that can't be determined, e.g. because the old commit
+    was never fetched."""
+    revs = [old_sha] if new_sha is None else [old_sha, new_sha]
+    try:
+        output = subprocess.check_output(['git', 'diff', '--name-only', '-z'] + revs + ['--'],
+                                         cwd=os.path.join(git_root, submodule),
+                                         stderr=subprocess.PIPE)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return [f for f in output.decode('utf-8', errors='surrogateescape').split('\0') if f]
 
-    diff = subprocess.check_output(['bash', new_submodule_script, git_rev],
-                                    cwd=git_root, universal_newlines=True)
 
-    return diff.splitlines()
+def _touches_recipe(git_root, folder, files):
+    """Do any of files (relative to folder) belong to the folder's recipe?"""
+    recipe_dir = os.path.relpath(os.path.dirname(_find_recipe(os.path.join(git_root, folder))),
+                                 os.path.join(git_root, folder))
+    if recipe_dir == '.':
+        return bool(files)
+    return any(f.startswith(recipe_dir + '/') for f in files)
 
 
-def git_renamed_folders(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
-    if stop_rev is not None:
-        git_rev = "{0}..{1}".format(git_rev, stop_rev)
+def git_changeset(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
+    """
+    The top-level folders with recipes that changed in a git revision (or range of revisions),
+    as a list of RecipeChange.  See git_changed_recipes for the meaning of git_rev and stop_rev.
 
-    rename_script = pkg_resources.resource_filename('conda_concourse_ci',
-                                                    'rename-script.sh')
+    This reads a single ``git diff --raw``.  Submodules that are checked out at a different
+    commit additionally need a ``git diff`` in the submodule itself, to see whether their recipe
+    changed; those run concurrently.
+    """
+    git_root = git_root or os.getcwd()
+    changes = OrderedDict()
+    not_recipes = set()
+    submodules = []
+    for (status, old_mode, new_mode, old_sha, new_sha,
+            old_path, new_path) in _git_raw_diff(git_rev, stop_rev, git_root):
+        path = old_path if status == 'D' else new_path
+        parts = path.split('/', 1)
+        folder = parts[0]
+        if folder in not_recipes:
+            continue
+        if folder not in changes:
+            if not _find_recipe(os.path.join(git_root, folder)):
+                not_recipes.add(folder)
+                continue
+            if new_mode == GITLINK_MODE and status in 'AR':
+                kind = 'renamed' if status == 'R' else 'new submodule'
+            elif status == 'R' and old_path.split('/', 1)[0] != folder:
+                kind = 'renamed'
+            elif status == 'M' and old_mode == new_mode == GITLINK_MODE:
+                kind = 'submodule'
+                # without stop_rev, the new side is the submodule's working tree
+                submodules.append((folder, old_sha, new_sha if stop_rev else None))
+            else:
+                kind = 'modified'
+            changes[folder] = RecipeChange(folder, kind, [])
+        if len(parts) > 1:
+            changes[folder].files.append(parts[1])
+
+    if submodules:
+        with ThreadPoolExecutor(max_workers=min(8, len(submodules))) as pool:
+            futures = [pool.submit(_submodule_changed_files, git_root, *args)
+                       for args in submodules]
+            for (folder, _, _), future in zip(submodules, futures):
+                files = future.result()
+                if files is None:
+                    # can't tell.  Better to build too much than too little.
+                    continue
+                if _touches_recipe(git_root, folder, files):
+                    changes[folder].files.extend(files)
+                else:
+                    log.info('submodule %s changed, but not its recipe; skipping it', folder)
+                    del changes[folder]
+    return list(changes.values())
 
-    renamed_files = subprocess.check_output(['bash', rename_script], cwd=git_root,
-                                             universal_newlines=True).splitlines()
 
-    return renamed_files
+def _get_base_folders(base_dir, changed_files):
+    recipe_dirs = []
+    for f in changed_files:
+        # only consider files that come from folders
+        if '/' in f:
+            f = f.split('/')[0]
+        if _find_recipe(os.path.join(base_dir, f)):
+            recipe_dirs.append(f)
+    return recipe_dirs
 
 
 def git_changed_recipes(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
@@ -121,8 +213,9 @@ def git_changed_recipes(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
     package directories that have been modified.
 
     git_rev: if stop_rev is not provided, this represents the changes
-             introduced by the given git rev.  It is equivalent to
-             git_rev=SOME_REV@{1} and stop_rev=SOME_REV
+             introduced by the given git rev, plus any changes in the working
+             tree.  It is equivalent to git_rev=SOME_REV@{1} and
+             stop_rev=SOME_REV for a clean working tree
 
     stop_rev: when provided, this is the end of a range of revisions to
              consider.  git_rev becomes the start revision.  Note that the
@@ -132,13 +225,11 @@ def git_changed_recipes(git_rev='HEAD@{1}', stop_rev=None, git_root='.'):
              git_rev=SOME_REV@{1} and stop_rev=SOME_REV   => only SOME_REV
              git_rev=SOME_REV@{2} and stop_rev=SOME_REV   => two commits, SOME_REV and the
                                                              one before it
+
+    Submodules count as changed if they are new, renamed, or checked out at a
+    commit that changes their recipe.  See git_changeset for more detail.
     """
-    changed_files = _git_changed_files(git_rev, stop_rev, git_root)
-    recipe_dirs = _get_base_folders(git_root, changed_files)
-    changed_submodules = git_changed_submodules(git_rev, stop_rev, git_root)
-    new_submodules = git_new_submodules(git_rev, stop_rev, git_root)
-    renamed_folders = git_renamed_folders(git_rev, stop_rev, git_root)
-    return recipe_dirs + changed_submodules + new_submodules + renamed_folders
+    return [change.folder for change in git_changeset(git_rev, stop_rev, git_root)]
 
 
 def _deps_to_version_dict(deps):
@@ -172,21 +263,98 @@ def get_run_test_deps(meta):
 
 
 _rendered_recipes = {}
+# persistent, on-disk cache of renders.  See set_render_cache.
+_render_cache = None
+
+
+def set_render_cache(cache_dir, max_size=None):
+    """Use (or, with cache_dir=None, stop using) a persistent render cache in cache_dir.
+
+    Returns the RenderCache instance, if any."""
+    global _render_cache
+    if not cache_dir:
+        _render_cache = None
+    elif max_size:
+        _render_cache = RenderCache(cache_dir, max_size=max_size)
+    else:
+        _render_cache = RenderCache(cache_dir)
+    return _render_cache
+
+
+def _render_key(meta_file_or_recipe_dir, worker):
+    return (meta_file_or_recipe_dir, worker['label'], worker['platform'], str(worker['arch']))
+
+
+def _render_recipe(meta_file_or_recipe_dir, worker, finalize, config=None):
+    """Render a recipe for one worker.  Module level so that it can run in a process pool."""
+    print("rendering {0} for {1}".format(meta_file_or_recipe_dir, worker['label']))
+    return api.render(meta_file_or_recipe_dir, platform=worker['platform'],
+                      arch=str(worker['arch']), verbose=False, permit_undefined_jinja=True,
+                      bypass_env_check=True, config=config, finalize=finalize)
+
+
+def _get_cached_render(meta_file_or_recipe_dir, worker, finalize, config=None):
+    """Look up a render in the persistent cache.  Returns (cache key, rendered or None)"""
+    if _render_cache is None:
+        return None, None
+    cache_key = _render_cache.key(meta_file_or_recipe_dir, worker, config=config,
+                                  finalize=finalize)
+    return cache_key, _render_cache.get(cache_key)
 
 
 @conda_interface.memoized
 def _get_or_render_metadata(meta_file_or_recipe_dir, worker, finalize, config=None):
     global _rendered_recipes
-    label = worker['label']
-    platform = worker['platform']
-    arch = str(worker['arch'])
-    if (meta_file_or_recipe_dir, label, platform, arch) not in _rendered_recipes:
-        print("rendering {0} for {1}".format(meta_file_or_recipe_dir, worker['label']))
-        _rendered_recipes[(meta_file_or_recipe_dir, label, platform, arch)] = \
-                            api.render(meta_file_or_recipe_dir, platform=platform, arch=arch,
-                                       verbose=False, permit_undefined_jinja=True,
-                                       bypass_env_check=True, config=config, finalize=finalize)
-    return _rendered_recipes[(meta_file_or_recipe_dir, label, platform, arch)]
+    key = _render_key(meta_file_or_recipe_dir, worker)
+    if key not in _rendered_recipes:
+        cache_key, rendered = _get_cached_render(meta_file_or_recipe_dir, worker,
+                                                 finalize=finalize, config=config)
+        if rendered is None:
+            rendered = _render_recipe(meta_file_or_recipe_dir, worker,
+                                      finalize=finalize, config=config)
+            if cache_key:
+                _render_cache.put(cache_key, rendered)
+        _rendered_recipes[key] = rendered
+    return _rendered_recipes[key]
+
+
+def prerender_recipes(recipe_dirs, worker, config=None, finalize=False, jobs=1):
+    """Render recipes ahead of graph construction using a pool of ``jobs`` processes.
+
+    Results are stored in the same cache that _get_or_render_metadata reads from.  The graph
+    is still assembled serially afterwards, in the order of recipe_dirs, so it comes out
+    identical to the one built without a pool.  Recipes that fail to render here are left
+    for the serial pass, which reports (or skips) them exactly as before.
+    """
+    todo = [recipe_dir for recipe_dir in dict.fromkeys(recipe_dirs)
+            if _render_key(recipe_dir, worker) not in _rendered_recipes]
+    if jobs <= 1 or len(todo) < 2:
+        return
+    cache_keys = {}
+    if _render_cache is not None:
+        # anything in the persistent cache does not need to go to the pool at all
+        for recipe_dir in list(todo):
+            cache_key, rendered = _get_cached_render(recipe_dir, worker, finalize, config)
+            if rendered is None:
+                cache_keys[recipe_dir] = cache_key
+            else:
+                _rendered_recipes[_render_key(recipe_dir, worker)] = rendered
+                todo.remove(recipe_dir)
+        if len(todo) < 2:
+            return
+    print(f'rendering {len(todo)} folders with {min(jobs, len(todo))} processes')
+    with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as pool:
+        futures = [pool.submit(_render_recipe, recipe_dir, worker, finalize, config)
+                   for recipe_dir in todo]
+        for recipe_dir, future in zip(todo, futures):
+            try:
+                rendered = future.result()
+                _rendered_recipes[_render_key(recipe_dir, worker)] = rendered
+                if recipe_dir in cache_keys:
+                    _render_cache.put(cache_keys[recipe_dir], rendered)
+            except (Exception, SystemExit) as e:
+                log.debug('parallel render of %s failed (%s); deferring to serial render',
+                          recipe_dir, e)
 
 
 def add_recipe_to_graph(recipe_dir, graph, run, worker, conda_resolve,
@@ -228,13 +396,11 @@ def add_recipe_to_graph(recipe_dir, graph, run, worker, conda_resolve,
     return name
 
 
-def match_peer_job(target_matchspec, other_m, this_m=None):
-    """target_matchspec comes from the recipe.  target_variant is the variant from the recipe whose
-    deps we are matching.  m is the peer job, which must satisfy conda and also have matching keys
-    for any keys that are shared between target_variant and m.config.variant"""
-    match_dict = {'name': other_m.name(),
-                'version': other_m.version(),
-                'build': _fix_any(other_m.build_id(), other_m.config), }
+def _match_target(name, version, build, build_number):
+    """The package record that a MatchSpec is checked against"""
+    match_dict = {'name': name,
+                'version': version,
+                'build': build, }
     if conda_interface.conda_43:
         match_dict = conda_interface.Dist(name=match_dict['name'],
                                             dist_name='-'.join((match_dict['name'],
@@ -242,23 +408,77 @@ def match_peer_job(target_matchspec, other_m, this_m=None):
                                                                 match_dict['build'])),
                                             version=match_dict['version'],
                                             build_string=match_dict['build'],
-                                            build_number=int(other_m.build_number() or 0),
+                                            build_number=build_number,
                                             channel=None)
-    matchspec_matches = target_matchspec.match(match_dict)
+    return match_dict
+
+
+def _peer_match_target(other_m):
+    """The package record that a MatchSpec is checked against for the peer job other_m"""
+    return _match_target(other_m.name(), other_m.version(),
+                         _fix_any(other_m.build_id(), other_m.config),
+                         int(other_m.build_number() or 0))
+
+
+def _variants_match(this_m, this_loop_vars, other_m, other_loop_vars):
+    variant_matches = True
+    for v in this_loop_vars:
+        if v in other_loop_vars:
+            variant_matches &= this_m.config.variant[v] == other_m.config.variant[v]
+    return variant_matches
+
+
+def match_peer_job(target_matchspec, other_m, this_m=None):
+    """target_matchspec comes from the recipe.  target_variant is the variant from the recipe whose
+    deps we are matching.  m is the peer job, which must satisfy conda and also have matching keys
+    for any keys that are shared between target_variant and m.config.variant"""
+    matchspec_matches = target_matchspec.match(_peer_match_target(other_m))
 
     variant_matches = True
     if this_m:
-        other_m_used_vars = other_m.get_used_loop_vars()
-        for v in this_m.get_used_loop_vars():
-            if v in other_m_used_vars:
-                variant_matches &= this_m.config.variant[v] == other_m.config.variant[v]
+        variant_matches = _variants_match(this_m, this_m.get_used_loop_vars(),
+                                          other_m, other_m.get_used_loop_vars())
     return matchspec_matches and variant_matches
 
 
+def _ms_deps(m):
+    """All of the dependencies of m (build, host, run and test) as MatchSpecs"""
+    # this is pretty hard. Realistically, we would want to know
+    # what the build and host platforms are on the build machine.
+    # However, all we know right now is what machine we're actually
+    # on (the one calculating the graph).
+    return set(m.ms_depends('build') + m.ms_depends('host') + m.ms_depends('run') +
+               [conda_interface.MatchSpec(dep) for dep in
+                ensure_list((m.meta.get('test') or {}).get('requires'))])
+
+
 def add_intradependencies(graph):
     """ensure that downstream packages wait for upstream build/test (not use existing
     available packages)"""
-    for node in graph.nodes():
+    # index nodes by package name once, instead of scanning every node for every dependency
+    nodes_by_name = defaultdict(list)
+    for node, data in graph.nodes(data=True):
+        if 'meta' in data:
+            nodes_by_name[data['meta'].name()].append(node)
+
+    # getting used vars and match targets is expensive.  Compute each of them once per node.
+    peer_info = {}
+
+    def _peer_info(node):
+        if node not in peer_info:
+            m = graph.nodes[node]['meta']
+            peer_info[node] = {'target': _peer_match_target(m),
+                               'loop_vars': frozenset(m.get_used_loop_vars())}
+        return peer_info[node]
+
+    used_vars = {}
+
+    def _used_vars(node):
+        if node not in used_vars:
+            used_vars[node] = frozenset(graph.nodes[node]['meta'].get_used_vars())
+        return used_vars[node]
+
+    for node in list(graph.nodes()):
         if 'meta' not in graph.nodes[node]:
             continue
         # get build dependencies
@@ -268,29 +488,24 @@ def add_intradependencies(graph):
             internal_deps = tuple(i[0] for i in m.other_outputs)
         else:
             internal_deps = ()
-        # this is pretty hard. Realistically, we would want to know
-        # what the build and host platforms are on the build machine.
-        # However, all we know right now is what machine we're actually
-        # on (the one calculating the graph).
-        deps = set(m.ms_depends('build') + m.ms_depends('host') + m.ms_depends('run') +
-                   [conda_interface.MatchSpec(dep) for dep in
-                    ensure_list((m.meta.get('test') or {}).get('requires'))])
-
-        for dep in deps:
+        for dep in _ms_deps(m):
             # Ignore all dependecies that are outputs of the current recipe.
             # These may not always match because of version differents but
             # without this recipe with outputs which depend on each other
             # cannot be submitted
             if dep.name in internal_deps:
                 continue
-            name_matches = (n for n in graph.nodes() if graph.nodes[n]['meta'].name() == dep.name)
-            for matching_node in name_matches:
+            dep_spec = conda_interface.MatchSpec(dep)
+            for matching_node in nodes_by_name.get(dep.name, ()):
+                if graph.has_edge(node, matching_node):
+                    continue
                 # are any of these build dependencies also nodes in our graph?
                 match_meta = graph.nodes[matching_node]['meta']
-                if (match_peer_job(conda_interface.MatchSpec(dep), match_meta, m) and
-                         (node, matching_node) not in graph.edges()):
-                    # inside if statement because getting used vars is expensive
-                    shared_vars = set(match_meta.get_used_vars()) & set(m.get_used_vars())
+                match_info = _peer_info(matching_node)
+                if (dep_spec.match(match_info['target']) and
+                        _variants_match(m, _peer_info(node)['loop_vars'],
+                                        match_meta, match_info['loop_vars'])):
+                    shared_vars = _used_vars(matching_node) & _used_vars(node)
                     # all vars in variant that they both use must line up
                     if all(match_meta.config.variant[v] == m.config.variant[v]
                             for v in shared_vars):
@@ -298,6 +513,45 @@ def add_intradependencies(graph):
                         graph.add_edge(node, matching_node)
 
 
+def compact_graph(graph):
+    """Replace the MetaData of each node of graph by a NodeRecord, in place"""
+    for node, data in graph.nodes(data=True):
+        if 'meta' in data:
+            m = data.pop('meta')
+            data['record'] = NodeRecord.from_metadata(
+                m, build=_fix_any(m.build_id(), m.config),
+                deps=sorted(str(dep) for dep in _ms_deps(m)))
+    return graph
+
+
+def splice_intradependencies(graph, nodes):
+    """add_intradependencies for a compacted graph, but only between nodes and the others.
+
+    Used when nodes were computed separately from the rest of graph (see
+    execute.collect_tasks with a previous graph)."""
+    nodes = set(nodes)
+    nodes_by_output = defaultdict(list)
+    for node, data in graph.nodes(data=True):
+        for name in data['record'].outputs:
+            nodes_by_output[name].append(node)
+    for node, data in graph.nodes(data=True):
+        record = data['record']
+        for dep in record.deps:
+            dep_spec = conda_interface.MatchSpec(dep)
+            if dep_spec.name in record.outputs:
+                continue
+            for matching_node in nodes_by_output.get(dep_spec.name, ()):
+                if ((node in nodes) == (matching_node in nodes) or
+                        graph.has_edge(node, matching_node)):
+                    continue
+                other = graph.nodes[matching_node]['record']
+                shared_vars = set(record.used_vars) & set(other.used_vars)
+                if (dep_spec.match(_match_target(dep_spec.name, other.version, other.build or '',
+                                                 other.build_number)) and
+                        all(record.variant.get(v) == other.variant.get(v) for v in shared_vars)):
+                    graph.add_edge(node, matching_node)
+
+
 def collapse_subpackage_nodes(graph):
     """Collapse all subpackage nodes into their parent recipe node
 
@@ -307,18 +561,23 @@ def collapse_subpackage_nodes(graph):
     top-level recipe."""
     # group nodes by their recipe path first, then within those groups by their variant
     node_groups = {}
+    # the name of the top-level package, per recipe path and variant.  Parsing the recipe is
+    #    expensive, so do it once for all of the outputs that share them.
+    master_names = {}
 
     for node in graph.nodes():
         if 'meta' in graph.nodes[node]:
             meta = graph.nodes[node]['meta']
             meta_path = meta.meta_path or meta.meta['extra']['parent_recipe']['path']
+            variant = HashableDict(meta.config.variant)
             master = False
 
-            master_meta = MetaData(meta_path, config=meta.config)
-            if master_meta.name() == meta.name():
+            if (meta_path, variant) not in master_names:
+                master_names[(meta_path, variant)] = MetaData(meta_path, config=meta.config).name()
+            if master_names[(meta_path, variant)] == meta.name():
                 master = True
             group = node_groups.get(meta_path, {})
-            subgroup = group.get(HashableDict(meta.config.variant), {})
+            subgroup = group.get(variant, {})
             if master:
                 if 'master' in subgroup:
                     print(f'tried to set {node} as master but {subgroup.get("master")} already is master.')
@@ -329,7 +588,7 @@ def collapse_subpackage_nodes(graph):
                 sps = subgroup.get('subpackages', [])
                 sps.append(node)
                 subgroup['subpackages'] = sps
-            group[HashableDict(meta.config.variant)] = subgroup
+            group[variant] = subgroup
             node_groups[meta_path] = group
 
     for recipe_path, group in node_groups.items():
@@ -343,7 +602,6 @@ def collapse_subpackage_nodes(graph):
                 worker = sp0['worker']
                 master_key = package_key(master_meta, worker['label'])
                 graph.add_node(master_key, meta=master_meta, worker=worker)
-                master = graph.nodes[master_key]
             else:
                 master = subgroup['master']
                 master_key = package_key(graph.nodes[master]['meta'],
@@ -351,59 +609,95 @@ def collapse_subpackage_nodes(graph):
             # fold in dependencies for all of the other subpackages within a group.  This is just
             #     the intersection of the edges between all nodes.  Store this on the "master" node.
             if subpackages:
-                # reassign any external dependencies on our subpackages to the top-level package
-                for edge in [edge for edge in graph.edges() if edge[1] in subpackages]:
-                    new_edge = edge[0], master_key
-                    if new_edge not in graph.edges():
-                        graph.add_edge(*new_edge)
-                    graph.remove_edge(*edge)
+                # reassign any external dependencies on our subpackages to the top-level package.
+                #    Only the edges of the subpackages themselves need to be visited.
+                for subnode in subpackages:
+                    for edge in list(graph.in_edges(subnode)):
+                        if edge[0] != master_key:
+                            graph.add_edge(edge[0], master_key)
+                        graph.remove_edge(*edge)
 
                 # reassign our subpackages' deps to the top-level package
-                for edge in [edge for edge in graph.edges() if edge[0] in subpackages]:
-                    new_edge = master_key, edge[1]
-                    if new_edge not in graph.edges():
-                        graph.add_edge(*new_edge)
-                    graph.remove_edge(*edge)
+                for subnode in subpackages:
+                    for edge in list(graph.out_edges(subnode)):
+                        if edge[1] != master_key:
+                            graph.add_edge(master_key, edge[1])
+                        graph.remove_edge(*edge)
 
                 # remove nodes that have been folded into master nodes
-                for subnode in subpackages:
-                    graph.remove_node(subnode)
+                graph.remove_nodes_from(subpackages)
 
-    # the reassignment can end up with a top-level package depending on itself.  Clean it up.
-    to_remove = set()
-    for edge in graph.edges():
-        if graph.nodes[edge[0]]['meta'].name() == graph.nodes[edge[1]]['meta'].name():
-            to_remove.add(edge)
+    # the reassignment can end up with a top-level package depending on another build of itself.
+    #    Clean it up.
+    names = {node: data['meta'].name() for node, data in graph.nodes(data=True)}
+    graph.remove_edges_from([edge for edge in graph.edges()
+                             if names[edge[0]] == names[edge[1]]])
 
-    for edge in to_remove:
-        graph.remove_edge(*edge)
 
+def collapse_noarch_python_nodes(graph):
+    """ Collapse nodes for noarch python packages into a single node
 
-def _write_recipe_log(path):
-    if not os.path.exists(os.path.join(path, "meta.yaml")):
-        path = os.path.join(path, "recipe")
-    try:
-        output = subprocess.check_output(['git', 'log'], cwd=path)
-        with open(os.path.join(path, "recipe_log.txt"), "wb") as f:
-            f.write(output)
-    except subprocess.CalledProcessError as e:
-        log.warn("Unable to produce recipe git log for %s. Error was: %s",
-                 path, e)
-        pass
-    except FileNotFoundError as e:
-        log.warn(f"File {path} does not exist. Error was {e}. Skipping.")
-        pass
+    Collapse nodes corresponding to any noarch python packages so that each package
+    in built on a single platform and test on the remaining platforms.  Edges are
+    reassinged or removed as needed.
+    """
+    # TODO make build_subdir configurable
+    build_subdir = 'linux-64'
+
+    # find all noarch python builds, group by package name
+    noarch_groups = defaultdict(list)
+    for node in graph.nodes():
+        if graph.nodes[node].get('noarch_pkg', False):
+            pkg_name = node_record(graph, node).name
+            noarch_groups[pkg_name].append(node)
+
+    for pkg_name, nodes in noarch_groups.items():
+        # split into build and test nodes
+        build_nodes = []
+        test_nodes = []
+        for node in nodes:
+            if node_record(graph, node).subdir == build_subdir:
+                build_nodes.append(node)
+            else:
+                test_nodes.append(node)
+        if len(build_nodes) > 1:
+            log.warn('more than one noarch python build for %s' % (pkg_name))
+        if len(build_nodes) == 0:
+            raise ValueError(
+                'The %s platform has no noarch python build for %s' % (build_subdir, pkg_name))
+        build_node = build_nodes[0]
+
+        for test_node in test_nodes:
+            # reassign any dependencies on the test_only node to the build node
+            for edge in tuple(graph.in_edges(test_node)):
+                new_edge = edge[0], build_node
+                graph.add_edge(*new_edge)
+                graph.remove_edge(*edge)
+            # remove all test_only node dependencies
+            for edge in tuple(graph.out_edges(test_node)):
+                graph.remove_edge(*edge)
+            # add a test only node
+            data = graph.nodes[test_node]
+            name = 'test-' + test_node
+            graph.add_node(name, worker=data['worker'], test_only=True,
+                           **{key: data[key] for key in ('meta', 'record') if key in data})
+            graph.add_edge(name, build_node)
+            # remove the test_only node
+            graph.remove_node(test_node)
+    return
 
 
 def construct_graph(recipes_dir, worker, run, conda_resolve, folders=(),
                     git_rev=None, stop_rev=None, matrix_base_dir=None,
-                    config=None, finalize=False):
+                    config=None, finalize=False, render_jobs=1):
     '''
     Construct a directed graph of dependencies from a directory of recipes
 
     run: whether to use build or run/test requirements for the graph.  Avoids cycles.
           values: 'build' or 'test'.  Actually, only 'build' matters - otherwise, it's
                    run/test for any other value.
+    render_jobs: number of processes used to render the folders.  The graph is the same
+                 regardless of this value.
     '''
     matrix_base_dir = matrix_base_dir or recipes_dir
     if not os.path.isabs(recipes_dir):
@@ -414,22 +708,28 @@ def construct_graph(recipes_dir, worker, run, conda_resolve, folders=(),
         if not git_rev:
             git_rev = 'HEAD'
 
-        folders = git_changed_recipes(git_rev, stop_rev=stop_rev,
-                                      git_root=recipes_dir)
+        changeset = git_changeset(git_rev, stop_rev=stop_rev, git_root=recipes_dir)
+        for change in changeset:
+            print(f'{change.folder}: {change.kind}')
+        folders = [change.folder for change in changeset]
 
     graph = nx.DiGraph()
     print('starting to render the recipes')
     folders_len = len(folders)
     count = 0
     print(f'need to render {folders_len} folders')
+    recipe_dirs = []
     for folder in folders:
         recipe_dir = os.path.join(recipes_dir, folder)
-
-        # update the recipe log.  Conda-build will find this and include it with the package.
-        _write_recipe_log(recipe_dir)
-
         if not os.path.isdir(recipe_dir):
             raise ValueError("Specified folder {} does not exist".format(recipe_dir))
+        recipe_dirs.append(recipe_dir)
+
+    # update the recipe logs.  Conda-build will find these and include them with the packages.
+    write_recipe_logs(recipe_dirs)
+
+    prerender_recipes(recipe_dirs, worker, config=config, finalize=finalize, jobs=render_jobs)
+    for recipe_dir in recipe_dirs:
         add_recipe_to_graph(recipe_dir, graph, run, worker, conda_resolve,
                             recipes_dir, config=config, finalize=finalize)
         count += 1
@@ -449,13 +749,29 @@ def _fix_any(value, config):
     return value
 
 
-@conda_interface.memoized
+# one InstallabilityIndex per channel index, for as long as the index is in use.  See
+#    installability.
+_installability = weakref.WeakKeyDictionary()
+
+
+def installability(conda_resolve):
+    """The InstallabilityIndex answering for conda_resolve"""
+    if conda_resolve not in _installability:
+        _installability[conda_resolve] = InstallabilityIndex(conda_resolve)
+    return _installability[conda_resolve]
+
+
+def _installable_spec(name, version, build_string, config):
+    return " ".join([name, _fix_any(version, config), _fix_any(build_string, config)])
+
+
 def _installable(name, version, build_string, config, conda_resolve):
     """Can Conda install the package we need?"""
-    ms = conda_interface.MatchSpec(" ".join([name, _fix_any(version, config),
-                                             _fix_any(build_string, config)]))
-    installable = conda_resolve.find_matches(ms)
-    if not installable:
+    index = installability(conda_resolve)
+    spec = normalize_spec(_installable_spec(name, version, build_string, config))
+    installable = index.find_matches(spec)
+    if not installable and spec not in index.warned:
+        index.warned.add(spec)
         log.warn("Dependency {name}, version {ver} is not installable from your "
                  "channels: {channels} with subdir {subdir}.  Seeing if we can build it..."
                  .format(name=name, ver=version, channels=config.channel_urls,
@@ -463,25 +779,44 @@ def _installable(name, version, build_string, config, conda_resolve):
     return installable
 
 
+_recipe_indexes = {}
+# see set_lazy_render
+_lazy_render = False
+
+
+def set_lazy_render(enabled=True):
+    """Use the static skeleton of the recipes (see recipe_index.RecipeIndex) to decide which
+    recipes are worth rendering.  Recipes whose meta.yaml rules them out are not rendered at
+    all: those that can't be downstream of the graph when expanding it, and those that can't
+    produce the version of a dependency that needs building.  The resulting graph is the
+    same."""
+    global _lazy_render
+    _lazy_render = enabled
+
+
+def _recipe_index(recipes_dir):
+    """The RecipeIndex of recipes_dir.  Built once, the first time it is needed."""
+    if recipes_dir not in _recipe_indexes:
+        _recipe_indexes[recipes_dir] = RecipeIndex(recipes_dir)
+    return _recipe_indexes[recipes_dir]
+
+
 def _buildable(name, version, recipes_dir, worker, config, finalize):
     """Does the recipe that we have available produce the package we need?"""
-    possible_dirs = os.listdir(recipes_dir)
-    packagename_re = re.compile(r'%s(?:\-[0-9]+[\.0-9\_\-a-zA-Z]*)?$' % name)
-    likely_dirs = (dirname for dirname in possible_dirs if
-                    (os.path.isdir(os.path.join(recipes_dir, dirname)) and
-                    packagename_re.match(dirname)))
-    metadata_tuples = [m for path in likely_dirs
-                        for (m, _, _) in _get_or_render_metadata(os.path.join(recipes_dir,
-                                                                 path), worker, finalize=finalize)]
-
     # this is our target match
     ms = conda_interface.MatchSpec(" ".join([name, _fix_any(version, config)]))
-    available = False
-    for m in metadata_tuples:
-        available = match_peer_job(ms, m)
-        if available:
-            break
-    return m.meta_path if available else False
+    index = _recipe_index(recipes_dir)
+    # only render the folders that can produce this package, and stop at the first match
+    for path in index.recipe_dirs(name):
+        static_version = index.versions.get(path, {}).get(name)
+        if (_lazy_render and static_version is not None and
+                not ms.match(_match_target(name, static_version, '', 0))):
+            continue
+        for (m, _, _) in _get_or_render_metadata(os.path.join(recipes_dir, path), worker,
+                                                 finalize=finalize):
+            if match_peer_job(ms, m):
+                return m.meta_path
+    return False
 
 
 def add_dependency_nodes_and_edges(node, graph, run, worker, conda_resolve, recipes_dir=None,
@@ -499,6 +834,11 @@ def add_dependency_nodes_and_edges(node, graph, run, worker, conda_resolve, reci
     if run == 'build':
         deps.update(get_build_deps(metadata))
 
+    # evaluate all of the specs in one batch.  The lookups below are then cheap.
+    installability(conda_resolve).prime(
+        _installable_spec(dep, version, build_str, metadata.config)
+        for dep, (version, build_str) in deps.items())
+
     for dep, (version, build_str) in deps.items():
         # we don't need worker info in _installable because it is already part of conda_resolve
         if not _installable(dep, version, build_str, metadata.config, conda_resolve):
@@ -517,13 +857,202 @@ def add_dependency_nodes_and_edges(node, graph, run, worker, conda_resolve, reci
             graph.add_edge(node, dep_name)
 
 
+def _static_upstream_folders(recipes_dir, folders):
+    """Every recipe folder in recipes_dir that folders depend on, directly or not, going by
+    the statically parsed requirements of the recipes.  This is what rebuilding all upstream
+    recipes, whether or not their packages are available, would build."""
+    index = _recipe_index(recipes_dir)
+    folders = set(folders)
+    upstream = set()
+    frontier = list(folders)
+    while frontier:
+        next_frontier = []
+        for folder in frontier:
+            for name in index.requirements.get(folder) or ():
+                for dep_folder in index.recipe_dirs(name):
+                    if dep_folder not in folders and dep_folder not in upstream:
+                        upstream.add(dep_folder)
+                        next_frontier.append(dep_folder)
+        frontier = next_frontier
+    return upstream
+
+
 def expand_run_upstream(graph, conda_resolve, worker, run, steps=0, max_downstream=5,
-                        recipes_dir=None, matrix_base_dir=None):
-    pass
+                        recipes_dir=None, matrix_base_dir=None, finalize=False):
+    """Add the recipes of upstream dependencies that need building, and only those.
+
+    A dependency needs building if no package in the channel index matches it for this
+    platform (see _installable); it is then built from the recipe in recipes_dir that produces
+    a matching package.  Dependencies that can be installed are left out, along with everything
+    upstream of them.  Packages can't be built without their dependencies, so any steps other
+    than 0 follow the dependencies all the way up.  max_downstream is not used.
+
+    Prints how many recipes this adds and how many more rebuilding everything upstream would
+    have added.  Returns the number of nodes added.
+    """
+    if steps == 0:
+        return 0
+    if not recipes_dir:
+        raise ValueError("recipes_dir is necessary if steps != 0.  "
+                         "Please pass it as an argument.")
+    recipes_dir = os.path.normpath(os.path.join(os.getcwd(), recipes_dir))
+    initial_nodes = set(graph.nodes())
+    visited = set()
+    frontier = list(graph.nodes())
+    while frontier:
+        previous_nodes = set(graph.nodes())
+        for node in frontier:
+            if node in visited or 'meta' not in graph.nodes[node]:
+                continue
+            visited.add(node)
+            # add_recipe_to_graph already did this for the nodes it added, so for those, this
+            #    only finds what is in the graph already
+            add_dependency_nodes_and_edges(node, graph, run, worker, conda_resolve,
+                                           recipes_dir=recipes_dir, finalize=finalize)
+        frontier = [node for node in graph.nodes() if node not in previous_nodes]
+
+    # compare with what rebuilding everything upstream of the top of the graph would build
+    def folders_of(nodes):
+        return set(_recipe_folder(graph.nodes[node]['meta'], recipes_dir)
+                   for node in nodes if 'meta' in graph.nodes[node])
+    top_folders = folders_of(node for node in graph.nodes() if not graph.in_degree(node))
+    upstream = folders_of(graph.nodes()) - top_folders
+    naive = _static_upstream_folders(recipes_dir, top_folders) | upstream
+    added = len(graph) - len(initial_nodes)
+    print(f'upstream: {len(upstream)} recipes need building ({added} added by this pass); '
+          f'rebuilding everything upstream would build {len(naive)}, '
+          f'so {len(naive - upstream)} are avoided')
+    return added
+
+
+# what each recipe folder produces and depends on, used to expand runs downstream.
+#    See set_dependency_index.
+_dependency_index = None
+
+
+def set_dependency_index(path=None):
+    """Keep the dependency index in the SQLite file at path, or in memory if path is None.
+
+    Returns the DependencyIndex instance."""
+    global _dependency_index
+    if _dependency_index is not None:
+        _dependency_index.close()
+    _dependency_index = DependencyIndex(path) if path else DependencyIndex()
+    return _dependency_index
+
+
+def _get_dependency_index():
+    if _dependency_index is None:
+        set_dependency_index()
+    return _dependency_index
+
+
+def _dependency_index_context(worker):
+    """Renders for one worker (or conda-build version) say nothing about another"""
+    return json.dumps({'label': worker['label'], 'platform': worker['platform'],
+                       'arch': str(worker['arch']), 'conda-build': conda_build.__version__},
+                      sort_keys=True)
+
+
+def _dependency_index_records(rendered):
+    """The outputs and dependencies of a rendered recipe, in the form the dependency index
+    stores them"""
+    outputs, deps = [], []
+    metas = [m for (m, _, _) in rendered if not m.skip()]
+    own_names = set(m.name() for m in metas)
+    for m in metas:
+        own_names.update(i[0] for i in getattr(m, 'other_outputs', ()))
+    for m in metas:
+        variant = {k: str(m.config.variant[k]) for k in m.get_used_vars()
+                   if k in m.config.variant}
+        outputs.append({'name': m.name(), 'version': m.version(),
+                        'build': _fix_any(m.build_id(), m.config),
+                        'build_number': int(m.build_number() or 0),
+                        'variant': variant})
+        # same as add_intradependencies: outputs of the same recipe don't count
+        deps.extend({'name': dep.name, 'spec': str(dep), 'variant': variant}
+                    for dep in _ms_deps(m) if dep.name not in own_names)
+    return outputs, deps
+
+
+def update_dependency_index(index, recipes_dir, worker, render_jobs=1, only=None):
+    """Bring the dependency index up to date with the recipe folders in recipes_dir.
+
+    Only the folders that changed since they were last indexed are rendered.  If only (a
+    collection of folders) is given, other folders that changed are dropped from the index
+    instead of being rendered.  Returns the context under which the folders are indexed for
+    worker."""
+    folders = []
+    for folder in sorted(os.listdir(recipes_dir)):
+        path = os.path.join(recipes_dir, folder)
+        if folder.startswith('.') or not os.path.isdir(path):
+            continue
+        try:
+            find_recipe(path)
+            folders.append(folder)
+        except IOError:
+            pass
+    context = _dependency_index_context(worker)
+    states = folder_states(recipes_dir, folders)
+    stale = index.stale_folders(context, states)
+    print(f'dependency index: {len(folders) - len(stale)} of {len(folders)} folders up to date')
+    if only is not None:
+        skipped = [folder for folder in stale if folder not in only]
+        # what is stored for these is out of date, and must not be used
+        index.remove(context, skipped)
+        stale = [folder for folder in stale if folder in only]
+        print(f'dependency index: not rendering {len(skipped)} folders that can not be '
+              'downstream')
+    recipe_dirs = [os.path.join(recipes_dir, folder) for folder in stale]
+    prerender_recipes(recipe_dirs, worker, jobs=render_jobs)
+    for folder, recipe_dir in zip(stale, recipe_dirs):
+        try:
+            rendered = _get_or_render_metadata(recipe_dir, worker, finalize=False)
+        except (IOError, SystemExit, RuntimeError) as e:
+            log.warn('invalid recipe dir or other recipe issue: %s - not indexing it.  '
+                     'Error was %s', recipe_dir, e)
+            rendered = []
+        outputs, deps = _dependency_index_records(rendered)
+        index.store(context, folder, states[folder], outputs, deps)
+    return context
+
+
+def _variants_compatible(variant, other_variant):
+    return all(variant[k] == other_variant[k] for k in variant if k in other_variant)
+
+
+def _recipe_folder(metadata, recipes_dir):
+    """The top-level folder of recipes_dir that metadata's recipe is in.  '..' if it is not in
+    recipes_dir at all."""
+    meta_path = metadata.meta_path or metadata.meta['extra']['parent_recipe']['path']
+    return os.path.relpath(meta_path, recipes_dir).split(os.sep)[0]
+
+
+def dependent_folders(index, context, metadata, recipes_dir):
+    """Recipe folders with an output that depends on one of the outputs of the recipe that
+    metadata belongs to (for the same variant)"""
+    variant = {k: str(v) for k, v in metadata.config.variant.items()}
+    folder = _recipe_folder(metadata, recipes_dir)
+    outputs = index.outputs(context, folder=folder) if folder != '..' else []
+    if not outputs:
+        outputs = index.outputs(context, name=metadata.name())
+    folders = []
+    for output in outputs:
+        if not _variants_compatible(output['variant'], variant):
+            continue
+        target = _match_target(output['name'], output['version'], output['build'],
+                               output['build_number'])
+        for dep in index.dependents(context, output['name']):
+            if dep['folder'] in folders or dep['folder'] == output['folder']:
+                continue
+            if (_variants_compatible(dep['variant'], output['variant']) and
+                    conda_interface.MatchSpec(dep['spec']).match(target)):
+                folders.append(dep['folder'])
+    return folders
 
 
 def expand_run(graph, config, conda_resolve, worker, run, steps=0, max_downstream=5,
-               recipes_dir=None, matrix_base_dir=None, finalize=False):
+               recipes_dir=None, matrix_base_dir=None, finalize=False, render_jobs=1):
     """Apply the build label to any nodes that need (re)building or testing.
 
     "need rebuilding" means both packages that our target package depends on,
@@ -532,73 +1061,87 @@ def expand_run(graph, config, conda_resolve, worker, run, steps=0, max_downstrea
     to follow that chain, since it can be quite large.
 
     If steps is -1, all downstream dependencies are rebuilt or retested
-    """
-    downstream = 0
-    initial_nodes = len(graph.nodes())
 
-    # for build, we get test automatically.  Give people the max_downstream in terms
-    #   of packages, not tasks
-    # if run == 'build':
-    #     max_downstream *= 2
-
-    def expand_step(task_graph, full_graph, downstream):
-        nodes = list(task_graph.nodes())
-        for node in nodes:
-            for predecessor in full_graph.predecessors(node):
-                if max_downstream < 0 or (downstream - initial_nodes) < max_downstream:
-                    add_recipe_to_graph(
-                        os.path.dirname(full_graph.nodes[predecessor]['meta'].meta_path),
-                        task_graph, config=config, run=run, worker=worker,
-                        conda_resolve=conda_resolve,
-                        recipes_dir=recipes_dir, finalize=finalize)
-                    downstream += 1
-        return len(task_graph.nodes())
+    max_downstream limits the number of downstream packages (recipe folders) that are added.
+    Set it to -1 for no limit.
 
+    Packages that depend on our target package are looked up in the dependency index (see
+    set_dependency_index), so only the recipes that are actually added get rendered, along with
+    any recipes that changed since the index was last updated.  With set_lazy_render, changed
+    recipes are only rendered if their meta.yaml says they may be downstream.
+    """
     # starting from our initial collection of dirty nodes, trace the tree down to packages
     #   that depend on the dirty nodes.  These packages may need to be rebuilt, or perhaps
     #   just tested.  The 'run' argument determines which.
-
-    if steps != 0:
-        if not recipes_dir:
-            raise ValueError("recipes_dir is necessary if steps != 0.  "
-                             "Please pass it as an argument.")
-        # here we need to fully populate a graph that has the right build or run/test deps.
-        #    We don't create this elsewhere because it is unnecessary and costly.
-
-        # get all immediate subdirectories
-        other_top_dirs = [d for d in os.listdir(recipes_dir)
-                        if os.path.isdir(os.path.join(recipes_dir, d)) and
-                        not d.startswith('.')]
-        recipe_dirs = []
-        for recipe_dir in other_top_dirs:
-            try:
-                find_recipe(os.path.join(recipes_dir, recipe_dir))
-                recipe_dirs.append(recipe_dir)
-            except IOError:
-                pass
-
-        # constructing the graph for build will automatically also include the test deps
-        full_graph = construct_graph(recipes_dir, worker, 'build', folders=recipe_dirs,
-                                     matrix_base_dir=matrix_base_dir, conda_resolve=conda_resolve)
-
-        if steps >= 0:
-            for step in range(steps):
-                downstream = expand_step(graph, full_graph, downstream)
-        else:
-            while True:
-                nodes = list(graph.nodes())
-                downstream = expand_step(graph, full_graph, downstream)
-                if nodes == list(graph.nodes()):
-                    break
+    if steps == 0:
+        return
+    if not recipes_dir:
+        raise ValueError("recipes_dir is necessary if steps != 0.  "
+                         "Please pass it as an argument.")
+    recipes_dir = os.path.normpath(os.path.join(os.getcwd(), recipes_dir))
+    index = _get_dependency_index()
+
+    def folders_of(nodes):
+        return set(_recipe_folder(graph.nodes[node]['meta'], recipes_dir)
+                   for node in nodes if 'meta' in graph.nodes[node])
+
+    # the folders that the index is up to date for.  None is all of them.
+    candidates = None
+    if _lazy_render:
+        candidates = _recipe_index(recipes_dir).downstream(folders_of(graph.nodes()), steps)
+    context = update_dependency_index(index, recipes_dir, worker, render_jobs=render_jobs,
+                                      only=candidates)
+
+    # breadth first.  Each step only looks at the nodes that the previous step added, and each
+    #    recipe folder is only considered once.
+    seen_folders = folders_of(graph.nodes())
+    frontier = list(graph.nodes())
+    added = 0
+    step = 0
+    while frontier and (steps < 0 or step < steps):
+        if candidates is not None:
+            # upstream dependencies added by the previous step have downstream folders of their
+            #    own, which the index has to be brought up to date for as well
+            new_folders = folders_of(frontier) - candidates
+            if new_folders:
+                more = _recipe_index(recipes_dir).downstream(
+                    new_folders, steps - step if steps >= 0 else -1)
+                candidates = None if more is None else candidates | more
+                update_dependency_index(index, recipes_dir, worker, render_jobs=render_jobs,
+                                        only=more)
+        step += 1
+        previous_nodes = set(graph.nodes())
+        for node in frontier:
+            if 'meta' not in graph.nodes[node]:
+                continue
+            for folder in dependent_folders(index, context, graph.nodes[node]['meta'],
+                                            recipes_dir):
+                if folder in seen_folders:
+                    continue
+                if 0 <= max_downstream <= added:
+                    print(f'reached the limit of {max_downstream} downstream packages')
+                    return
+                seen_folders.add(folder)
+                recipe_dir = os.path.join(recipes_dir, folder)
+                write_recipe_log(recipe_dir)
+                add_recipe_to_graph(recipe_dir, graph, config=config, run=run, worker=worker,
+                                    conda_resolve=conda_resolve, recipes_dir=recipes_dir,
+                                    finalize=finalize)
+                added += 1
+        frontier = [node for node in graph.nodes() if node not in previous_nodes]
 
 
-def order_build(graph):
+def order_build(graph, durations=None):
     '''
     Assumes that packages are in graph.
     Builds a temporary graph of relevant nodes and returns it topological sort.
 
     Relevant nodes selected in a breadth first traversal sourced at each pkg
     in packages.
+
+    If durations (expected seconds, by node) are given, the order is critical path first
+    instead: of the nodes whose dependencies come earlier, the one that starts the longest
+    chain of builds comes first.
     '''
     reorder_cyclical_test_dependencies(graph)
     try:
@@ -607,9 +1150,34 @@ def order_build(graph):
     except nx.exception.NetworkXUnfeasible:
         raise ValueError("Cycles detected in graph: %s", nx.find_cycle(graph))
 
+    if durations is not None:
+        order = _critical_path_order(graph, order, durations)
     return order
 
 
+def _critical_path_order(graph, order, durations):
+    # the duration of the longest chain of builds that starts with each node.  Dependents come
+    #    first in the reversed order.
+    remaining = {}
+    for node in reversed(order):
+        remaining[node] = durations.get(node, 0) + max(
+            [remaining[dependent] for dependent in graph.predecessors(node)] or [0])
+    # ties keep the topological order
+    position = {node: i for i, node in enumerate(order)}
+    waiting = {node: graph.out_degree(node) for node in order}
+    ready = [(-remaining[node], position[node], node) for node in order if not waiting[node]]
+    heapq.heapify(ready)
+    result = []
+    while ready:
+        node = heapq.heappop(ready)[2]
+        result.append(node)
+        for dependent in graph.predecessors(node):
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                heapq.heappush(ready, (-remaining[dependent], position[dependent], dependent))
+    return result
+
+
 def reorder_cyclical_test_dependencies(graph):
     """By default, we make things that depend on earlier outputs for build wait for tests of
     the earlier thing to pass.  However, circular dependencies spread across run/test and
@@ -1,8 +1,29 @@
+import base64
 import json
 import logging
+import os
 import subprocess
+import tempfile
+import time
 from contextlib import AbstractContextManager
 
+import requests
+import yaml
+
+# tokens that expire within this many seconds are not reused
+TOKEN_MARGIN = 300
+
+
+def token_expiry(token):
+    """When the JSON web token token expires, in seconds since the epoch.  None if that can't
+    be read from it."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload.encode('ascii')))['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
 
 class Concourse(AbstractContextManager):
     """
@@ -11,6 +32,9 @@ class Concourse(AbstractContextManager):
     Uses fly for interactions, a compatible version must be installed and on
     path.
 
+    login reuses the token that fly has for the target, unless it has expired, and sync only
+    downloads fly when its version differs from the server's.
+
     This can be used as a context manager with login/logout. For example:
 
     with Concourse(url, username, password) as con:
@@ -29,6 +53,8 @@ class Concourse(AbstractContextManager):
         Team to autheticate with.
     target : str, optional
         Concourse target name
+    flyrc : str, optional
+        fly's configuration file, by default ~/.flyrc
 
     """
 
@@ -38,13 +64,22 @@ class Concourse(AbstractContextManager):
             username=None,
             password=None,
             team_name=None,
-            target='conda-concourse-server'
+            target='conda-concourse-server',
+            flyrc=None,
             ):
         self.concourse_url = concourse_url
         self.username = username
         self.password = password
         self.team_name = team_name
         self.target = target
+        self.flyrc = flyrc or os.path.expanduser(os.path.join('~', '.flyrc'))
+
+    @property
+    def team(self):
+        return self.team_name or 'main'
+
+    def _url(self, path):
+        return self.concourse_url.rstrip('/') + '/' + path.lstrip('/')
 
     def __enter__(self):
         self.login()
@@ -70,7 +105,32 @@ class Concourse(AbstractContextManager):
         complete = self._fly(fly_args=fly_args + ['--json'], check=check)
         return json.loads(complete.stdout)
 
-    def login(self):
+    def _fly_token(self):
+        """The token fly has for the target, if the target is this server and team"""
+        try:
+            with open(self.flyrc) as f:
+                targets = (yaml.safe_load(f) or {}).get('targets') or {}
+        except (IOError, OSError, yaml.YAMLError):
+            return None
+        target = targets.get(self.target) or {}
+        if (str(target.get('api', '')).rstrip('/') != self.concourse_url.rstrip('/') or
+                target.get('team', 'main') != self.team):
+            return None
+        return (target.get('token') or {}).get('value')
+
+    def logged_in(self):
+        """Whether fly has a token for the target that won't expire soon"""
+        expiry = token_expiry(self._fly_token())
+        return expiry is not None and expiry > time.time() + TOKEN_MARGIN
+
+    def bearer_token(self):
+        """The token of the login, for requests to the Concourse API"""
+        return self._fly_token()
+
+    def login(self, force=False):
+        if not force and self.logged_in():
+            logging.debug('fly target %s is logged in', self.target)
+            return
         fly_args = ['login', '--concourse-url', self.concourse_url]
         if self.team_name is not None:
             fly_args.extend(['--team-name', self.team_name])
@@ -83,7 +143,26 @@ class Concourse(AbstractContextManager):
     def logout(self):
         self._fly(["logout"])
 
-    def sync(self):
+    def server_version(self):
+        response = requests.get(self._url('api/v1/info'), timeout=30)
+        response.raise_for_status()
+        return response.json()['version']
+
+    def fly_version(self):
+        complete = subprocess.run(['fly', '--version'], capture_output=True)
+        complete.check_returncode()
+        return complete.stdout.decode('utf-8').strip()
+
+    def sync(self, force=False):
+        """Download the fly that matches the server, unless the installed one does"""
+        if not force:
+            try:
+                if self.fly_version() == self.server_version():
+                    logging.debug('fly is up to date')
+                    return
+            except (requests.RequestException, OSError, subprocess.CalledProcessError,
+                    KeyError, ValueError) as e:
+                logging.debug('unable to compare fly and server versions: %s', e)
         self._fly(['sync'])
 
     def set_pipeline(self, pipeline, config_file, vars_path):
@@ -150,3 +229,194 @@ class Concourse(AbstractContextManager):
             '--job', f'{pipeline}/{job}',
             '--build', name
         ])
+
+
+class ConcourseAPI(Concourse):
+    """
+    A Concourse that talks to the Concourse REST API directly, instead of running fly
+
+    Every fly command is a new process that reads ~/.flyrc and opens a new connection to the
+    server.  This backend logs in once and then sends all requests through one
+    requests.Session, which keeps connections to the server open and reuses the bearer token.
+    Setting pipelines still uses fly (it interpolates the vars files), which is logged in the
+    first time that is needed.
+
+    The token is kept, with when it expires, in token_cache (~/.c3i/concourse_tokens.json by
+    default, readable only by the user), so later runs reuse it until it is about to expire.
+
+    Select it with "concourse-backend: api" in config.yml.  The parameters are those of
+    Concourse; team_name defaults to main.
+    """
+
+    # what fly uses to get a token for a user and password
+    CLIENT_ID = 'fly'
+    CLIENT_SECRET = 'Zmx5'
+    SCOPE = 'openid profile email federated:id groups'
+
+    def __init__(self, *args, pool_size=16, token_cache=None, **kwargs):
+        super(ConcourseAPI, self).__init__(*args, **kwargs)
+        self.token_cache = token_cache or os.path.expanduser(
+            os.path.join('~', '.c3i', 'concourse_tokens.json'))
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.token = None
+        self._fly_logged_in = False
+        # build ids, by (pipeline, job, build name), from get_builds.  See abort_build.
+        self._build_ids = {}
+
+    def _team_url(self, path):
+        return self._url('api/v1/teams/{}/{}'.format(self.team, path.lstrip('/')))
+
+    def _cache_key(self):
+        return '{} {} {}'.format(self.concourse_url.rstrip('/'), self.team, self.username or '')
+
+    def _read_token_cache(self):
+        try:
+            with open(self.token_cache) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_token_cache(self, tokens):
+        folder = os.path.dirname(self.token_cache)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=folder)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.token_cache)
+        except (IOError, OSError) as e:
+            logging.warn('Unable to save the Concourse token in %s: %s', self.token_cache, e)
+
+    def _use_token(self, token):
+        self.token = token
+        self.session.headers['Authorization'] = 'Bearer ' + token
+
+    def bearer_token(self):
+        return self.token
+
+    def login(self, force=False):
+        """Get a bearer token for the user, unless there is a cached one that won't expire
+        soon"""
+        if not force:
+            cached = self._read_token_cache().get(self._cache_key()) or {}
+            if cached.get('token') and cached.get('expiry', 0) > time.time() + TOKEN_MARGIN:
+                logging.debug('reusing the cached token for %s', self.concourse_url)
+                self._use_token(cached['token'])
+                return
+        response = self.session.post(
+            self._url('sky/issuer/token'),
+            auth=(self.CLIENT_ID, self.CLIENT_SECRET),
+            data={'grant_type': 'password', 'username': self.username or '',
+                  'password': self.password or '', 'scope': self.SCOPE})
+        response.raise_for_status()
+        token = response.json()
+        # newer versions of Concourse want the id token
+        self._use_token(token.get('id_token') or token['access_token'])
+        expiry = token_expiry(self.token)
+        if expiry is None and token.get('expires_in'):
+            expiry = time.time() + float(token['expires_in'])
+        if expiry is not None:
+            tokens = self._read_token_cache()
+            tokens[self._cache_key()] = {'token': self.token, 'expiry': expiry}
+            self._write_token_cache(tokens)
+
+    def logout(self):
+        tokens = self._read_token_cache()
+        if tokens.pop(self._cache_key(), None):
+            self._write_token_cache(tokens)
+        self.token = None
+        self.session.headers.pop('Authorization', None)
+        self.session.close()
+        if self._fly_logged_in:
+            super(ConcourseAPI, self).logout()
+            self._fly_logged_in = False
+
+    def sync(self, force=False):
+        # only needed before fly is used, see _ensure_fly
+        pass
+
+    def _ensure_fly(self):
+        if not self._fly_logged_in:
+            super(ConcourseAPI, self).login()
+            super(ConcourseAPI, self).sync()
+            self._fly_logged_in = True
+
+    def _request(self, method, url, **kwargs):
+        """Send a request, logging in (again) if the token is missing or has expired"""
+        if self.token is None:
+            self.login()
+        logging.debug('%s %s', method, url)
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 401:
+            self.login(force=True)
+            response = self.session.request(method, url, **kwargs)
+        logging.debug('status: %s', response.status_code)
+        response.raise_for_status()
+        return response
+
+    def _json(self, method, url, **kwargs):
+        response = self._request(method, url, **kwargs)
+        return response.json() if response.content else None
+
+    def set_pipeline(self, pipeline, config_file, vars_path):
+        self._ensure_fly()
+        super(ConcourseAPI, self).set_pipeline(pipeline, config_file, vars_path)
+
+    def expose_pipeline(self, pipeline):
+        self._request('PUT', self._team_url('pipelines/{}/expose'.format(pipeline)))
+
+    def destroy_pipeline(self, pipeline):
+        self._request('DELETE', self._team_url('pipelines/{}'.format(pipeline)))
+
+    def pause_pipeline(self, pipeline):
+        self._request('PUT', self._team_url('pipelines/{}/pause'.format(pipeline)))
+
+    def unpause_pipeline(self, pipeline):
+        self._request('PUT', self._team_url('pipelines/{}/unpause'.format(pipeline)))
+
+    @property
+    def pipelines(self):
+        """ A list of pipelines names """
+        return [i['name'] for i in self._json('GET', self._team_url('pipelines')) or []]
+
+    def get_jobs(self, pipeline):
+        return self._json('GET', self._team_url('pipelines/{}/jobs'.format(pipeline))) or []
+
+    def get_builds(self, pipeline):
+        builds = self._json('GET', self._team_url('pipelines/{}/builds'.format(pipeline))) or []
+        for build in builds:
+            if 'id' in build and 'job_name' in build:
+                self._build_ids[(pipeline, build['job_name'], str(build['name']))] = build['id']
+        return builds
+
+    def trigger_job(self, pipeline, job):
+        self._request('POST', self._team_url('pipelines/{}/jobs/{}/builds'.format(pipeline, job)))
+
+    def abort_build(self, pipeline, job, name):
+        build_id = self._build_ids.get((pipeline, job, str(name)))
+        if build_id is None:
+            build_id = self._json('GET', self._team_url(
+                'pipelines/{}/jobs/{}/builds/{}'.format(pipeline, job, name)))['id']
+        self._request('PUT', self._url('api/v1/builds/{}/abort'.format(build_id)))
+
+
+def concourse_from_config(config_vars, **kwargs):
+    """A Concourse for the server in config_vars (the contents of config.yml).  Its
+    concourse-backend key selects the class: fly (the default) or api (ConcourseAPI)."""
+    backend = config_vars.get('concourse-backend') or 'fly'
+    if backend not in BACKENDS:
+        raise ValueError("concourse-backend must be one of {}, not {}".format(
+            ', '.join(sorted(BACKENDS)), backend))
+    return BACKENDS[backend](
+        concourse_url=config_vars['concourse-url'],
+        username=config_vars.get('concourse-username'),
+        password=config_vars.get('concourse-password'),
+        team_name=config_vars.get('concourse-team'),
+        **kwargs)
+
+
+BACKENDS = {'fly': Concourse, 'api': ConcourseAPI}
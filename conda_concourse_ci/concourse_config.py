@@ -20,11 +20,13 @@ CONDA_SUBDIR_TO_CONCOURSE_PLATFORM = {
 class PipelineConfig:
     """ configuration for a concourse pipeline. """
     # https://concourse-ci.org/pipelines.html
-    jobs = []
-    resources = []
-    resource_types = []
-    var_sources = []
-    groups = []
+
+    def __init__(self):
+        self.jobs = []
+        self.resources = []
+        self.resource_types = []
+        self.var_sources = []
+        self.groups = []
 
     def add_job(self, name, plan=None, **kwargs):
         if plan is None:
@@ -0,0 +1,211 @@
+"""
+A persistent index of what every recipe in a recipes folder produces and depends on.
+
+Expanding a run downstream (``--steps``) needs to know which recipes depend on the packages
+being built.  Answering that by rendering every recipe in the repository on every run is very
+slow.  This index stores, per recipe folder, the outputs the folder produces and the dependency
+specs of those outputs, in a SQLite database.  Each folder is stored along with a hash of its
+state (its git tree hash, or a hash of its contents for dirty or untracked folders), so only
+folders that changed since the last run need to be rendered again.
+
+The index knows nothing about rendering itself; compute_build_graph fills it in.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+
+from .render_cache import IGNORED_FILES, recipe_content_hash
+
+log = logging.getLogger(__file__)
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS folders (
+    context TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (context, folder)
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    context TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    build TEXT NOT NULL,
+    build_number INTEGER NOT NULL,
+    variant TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outputs_folder ON outputs (context, folder);
+CREATE INDEX IF NOT EXISTS outputs_name ON outputs (context, name);
+CREATE TABLE IF NOT EXISTS deps (
+    context TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    variant TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deps_folder ON deps (context, folder);
+CREATE INDEX IF NOT EXISTS deps_name ON deps (context, name);
+"""
+
+
+def _git_lines(args, cwd):
+    try:
+        output = subprocess.check_output(['git'] + args, cwd=cwd, stderr=subprocess.DEVNULL,
+                                         universal_newlines=True)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return output.splitlines()
+
+
+def folder_states(recipes_dir, folders):
+    """Return a dict of folder: state hash for the given top-level folders of recipes_dir.
+
+    For folders that are committed and clean, the state is the git tree (or, for submodules,
+    commit) hash, which costs a single ``git ls-tree`` for all folders.  Folders that are dirty,
+    untracked, or not in a git repository at all are hashed by content.  Recipe logs written by
+    c3i don't make a folder dirty.
+    """
+    states = {}
+    tree = _git_lines(['ls-tree', 'HEAD', '.'], recipes_dir)
+    if tree is not None:
+        dirty = set()
+        for args in (['diff', 'HEAD', '--name-only', '--relative'],
+                     ['ls-files', '--others', '--exclude-standard']):
+            for path in _git_lines(args, recipes_dir) or []:
+                # recipe logs are written by c3i itself
+                if os.path.basename(path) not in IGNORED_FILES:
+                    dirty.add(path.split('/')[0])
+        for line in tree:
+            info, _, path = line.partition('\t')
+            mode, obj_type, sha = info.split()
+            if obj_type in ('tree', 'commit') and path not in dirty:
+                states[path] = 'git:' + sha
+    for folder in folders:
+        if folder not in states:
+            states[folder] = 'content:' + recipe_content_hash(os.path.join(recipes_dir, folder))
+    return {folder: states[folder] for folder in folders}
+
+
+class DependencyIndex(object):
+    """
+    Outputs and dependencies of recipe folders, stored in SQLite
+
+    Everything is stored per "context", a string identifying what the recipes were rendered
+    for (worker, conda-build version, ...).  Renders for one platform say nothing about what a
+    recipe depends on for another.
+
+    Parameters
+    ----------
+    path : str, optional
+        SQLite database file.  Created if necessary.  The default keeps the index in memory,
+        which is only useful within a single run.
+    """
+
+    def __init__(self, path=':memory:'):
+        if path != ':memory:':
+            path = os.path.abspath(os.path.expanduser(path))
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        # several processes can update the same file (one per platform), so wait for locks
+        self.connection = sqlite3.connect(path, timeout=60)
+        self._pid = os.getpid()
+        self._check_schema()
+
+    def _check_schema(self):
+        c = self.connection
+        c.executescript(_SCHEMA)
+        row = c.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None or int(row[0]) != SCHEMA_VERSION:
+            if row is not None:
+                log.warn('dependency index %s has an old format; starting from scratch',
+                         self.path)
+            with c:
+                for table in ('folders', 'outputs', 'deps'):
+                    c.execute('DELETE FROM {}'.format(table))
+                c.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)",
+                          (str(SCHEMA_VERSION), ))
+
+    def close(self):
+        # a connection inherited by a forked process belongs to the parent.  Leave it alone.
+        if os.getpid() == self._pid:
+            self.connection.close()
+
+    def stale_folders(self, context, states):
+        """Folders (keys of states, a dict of folder: state) whose stored state does not match.
+        Folders that are stored but not in states are removed from the index."""
+        stored = dict(self.connection.execute(
+            'SELECT folder, state FROM folders WHERE context = ?', (context, )))
+        removed = [folder for folder in stored if folder not in states]
+        if removed:
+            with self.connection:
+                for folder in removed:
+                    self._delete(context, folder)
+        return [folder for folder, state in states.items() if stored.get(folder) != state]
+
+    def _delete(self, context, folder):
+        for table in ('folders', 'outputs', 'deps'):
+            self.connection.execute(
+                'DELETE FROM {} WHERE context = ? AND folder = ?'.format(table),
+                (context, folder))
+
+    def remove(self, context, folders):
+        """Forget what is known about folders"""
+        with self.connection:
+            for folder in folders:
+                self._delete(context, folder)
+
+    def store(self, context, folder, state, outputs, deps):
+        """Replace what is known about folder.
+
+        outputs: list of dicts with name, version, build, build_number and variant keys
+        deps: list of dicts with name, spec and variant keys
+
+        variant is a dict of the variables used by the output (or the output having the
+        dependency) and their values.
+        """
+        c = self.connection
+        with c:
+            self._delete(context, folder)
+            c.execute('INSERT INTO folders VALUES (?, ?, ?)', (context, folder, state))
+            c.executemany('INSERT INTO outputs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                          [(context, folder, o['name'], o['version'], o['build'],
+                            o['build_number'], json.dumps(o['variant'], sort_keys=True))
+                           for o in outputs])
+            c.executemany('INSERT INTO deps VALUES (?, ?, ?, ?, ?)',
+                          [(context, folder, d['name'], d['spec'],
+                            json.dumps(d['variant'], sort_keys=True))
+                           for d in deps])
+
+    def outputs(self, context, folder=None, name=None):
+        """Outputs produced by folder, or outputs called name, as a list of dicts"""
+        query = ('SELECT folder, name, version, build, build_number, variant FROM outputs '
+                 'WHERE context = ?')
+        args = [context]
+        if folder is not None:
+            query += ' AND folder = ?'
+            args.append(folder)
+        if name is not None:
+            query += ' AND name = ?'
+            args.append(name)
+        return [{'folder': row[0], 'name': row[1], 'version': row[2], 'build': row[3],
+                 'build_number': row[4], 'variant': json.loads(row[5])}
+                for row in self.connection.execute(query + ' ORDER BY rowid', args)]
+
+    def dependents(self, context, name):
+        """Dependencies on the package called name, as a list of dicts with the depending
+        folder, the spec and the variant of the depending output"""
+        rows = self.connection.execute(
+            'SELECT folder, spec, variant FROM deps WHERE context = ? AND name = ? '
+            'ORDER BY rowid', (context, name))
+        return [{'folder': row[0], 'spec': row[1], 'variant': json.loads(row[2])}
+                for row in rows]
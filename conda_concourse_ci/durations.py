@@ -0,0 +1,106 @@
+"""
+Build durations, read from the stats files of earlier builds.
+
+Every build and test job passes --stats-file=stats/<node>_<time>.json to conda-build, and the
+stats folder is synced to the stats resource (see PipelineConfig.add_rsync_stats).  With a copy
+of that folder (or a database that it was ingested into, see the stats module), the durations
+of earlier builds let compute_build_graph.order_build start the longest chains of builds (llvm,
+tensorflow, ...) first.
+"""
+
+import json
+import logging
+import os
+import re
+from statistics import median
+
+from .node_record import node_record
+from .stats import BuildStats, is_stats_db, split_node, stats_file_node, summarize
+
+log = logging.getLogger(__file__)
+
+# used for every node if there are no durations at all
+DEFAULT_DURATION = 1.0
+
+
+def _stats_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for fn in files:
+                yield os.path.join(root, fn)
+
+
+def load_durations(paths):
+    """The duration in seconds of the most recent build of each node that has a stats file in
+    paths (files, or folders that are searched recursively), by node.  paths can also be build
+    stats databases (see c3i stats ingest)."""
+    latest = {}
+    databases = [path for path in paths if is_stats_db(path)]
+    for path in _stats_files([path for path in paths if path not in databases]):
+        parsed = stats_file_node(os.path.basename(path))
+        if not parsed:
+            continue
+        node, when = parsed
+        if node in latest and latest[node][0] >= when:
+            continue
+        try:
+            with open(path) as f:
+                duration = summarize(json.load(f))['elapsed']
+        except (IOError, OSError, ValueError, TypeError, AttributeError) as e:
+            log.warn("Unable to read build stats from %s. Error was: %s", path, e)
+            continue
+        latest[node] = (when, duration)
+    durations = {}
+    for path in databases:
+        db = BuildStats(path)
+        try:
+            durations.update(db.durations())
+        finally:
+            db.close()
+    # stats files are more recent than what was ingested, usually
+    durations.update((node, duration) for node, (_, duration) in latest.items())
+    return durations
+
+
+def _test_prefix(graph, node):
+    """What the nodes of earlier tests of the package of node start with, if node is a
+    test"""
+    if graph.nodes[node].get('test_only'):
+        # the test-only jobs of noarch: python packages (see collapse_noarch_python_nodes)
+        return 'test-'
+    return 'c3itest-' if node.startswith('c3itest-') else ''
+
+
+def estimate_durations(graph, durations):
+    """The expected duration of every node of graph, based on durations (see load_durations).
+
+    Nodes without a duration of their own use the longest duration of the other versions (or
+    variants) of the same package on the same platform, if there are any.  The rest get the
+    median of the durations that were found."""
+    estimates = {}
+    unknown = []
+    for node in graph.nodes():
+        if node in durations:
+            estimates[node] = durations[node]
+            continue
+        if 'record' in graph.nodes[node] or 'meta' in graph.nodes[node]:
+            name = node_record(graph, node).name
+        else:
+            # graphs read from a plan.yml (see simulate) only have node keys
+            name = split_node(node)[0]
+        pattern = re.compile('^{}{}-\\d.*-on-{}$'.format(
+            _test_prefix(graph, node),
+            re.escape(name.replace(' ', '_')),
+            re.escape(graph.nodes[node]['worker']['label'].replace(' ', '_'))))
+        matches = [duration for key, duration in durations.items() if pattern.match(key)]
+        if matches:
+            estimates[node] = max(matches)
+        else:
+            unknown.append(node)
+    default = median(estimates.values()) if estimates else DEFAULT_DURATION
+    for node in unknown:
+        estimates[node] = default
+    return estimates
@@ -1,5 +1,7 @@
 import contextlib
 import glob
+import hashlib
+import json
 import logging
 import os
 import shutil
@@ -8,7 +10,8 @@ import subprocess
 import tempfile
 import time
 
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from fnmatch import fnmatch
 
 import conda_build.api
@@ -18,13 +21,27 @@ from conda_build.variants import get_package_variants
 
 import networkx as nx
 
-import requests
-
 import yaml
 
-from .compute_build_graph import construct_graph, expand_run, order_build, package_key
-from .concourse import Concourse
+from . import __version__
+from .build_watcher import BuildWatcher
+from .compute_build_graph import (collapse_noarch_python_nodes, compact_graph, construct_graph,
+                                  expand_run, expand_run_upstream, installability, order_build,
+                                  package_key, set_dependency_index, set_lazy_render,
+                                  set_render_cache, splice_intradependencies)
+from .concourse import concourse_from_config
 from .concourse_config import PipelineConfig, JobConfig, BuildStepConfig
+from .dependency_index import folder_states
+from .durations import estimate_durations, load_durations
+from .graph_artifact import (FILENAME as GRAPH_FILENAME, load_graph, load_task_graph,
+                             platform_graph, save_graph)
+from .index_snapshot import load_index, read_manifest, save_snapshot
+from .local_run import LocalRun, format_summary
+from .node_record import NodeRecord, node_record
+from .render_cache import render_cache_key
+from .simulate import format_report, platform_workers, simulate as simulate_graph
+from .stats import BuildStats, format_top
+from .recipe_log import DEFAULT_MAX_COUNT, set_recipe_log_options, write_recipe_logs
 from .utils import HashableDict, ensure_list, load_yaml_config_dir
 
 log = logging.getLogger(__file__)
@@ -66,6 +83,200 @@ def _parse_python_numpy_from_pass_throughs(pass_through_list):
     return parsed
 
 
+# render cache of a worker process of collect_tasks.  See _init_platform_worker.
+_worker_render_cache = None
+
+
+def _init_platform_worker(render_cache_dir, render_cache_max_size, dependency_index,
+                          recipe_log_options, lazy_render=False):
+    """Set up the caches of a worker process of collect_tasks.  Connections to them must not be
+    shared with the parent process."""
+    global _worker_render_cache
+    _worker_render_cache = set_render_cache(render_cache_dir, max_size=render_cache_max_size)
+    set_dependency_index(dependency_index)
+    set_recipe_log_options(**recipe_log_options)
+    set_lazy_render(lazy_render)
+
+
+def _plan_params(path, folders, platform, channels, steps, max_downstream, upstream,
+                 index_snapshot, skip_existing=True):
+    """Hash of what the graph of a platform is computed from, other than the recipes in it
+    and the channel index (see _index_digest).  A previous graph is only reused if this is the
+    same."""
+    params = {'folders': sorted(folders or []), 'worker': platform,
+              'channels': list(channels or []), 'steps': steps,
+              'max_downstream': max_downstream, 'upstream': upstream,
+              'skip_existing': skip_existing, 'c3i': __version__}
+    if index_snapshot:
+        params['index_snapshot'] = read_manifest(index_snapshot)
+    if steps:
+        # any recipe might be downstream
+        recipes_dir = os.path.abspath(path)
+        params['recipes'] = folder_states(recipes_dir, sorted(
+            folder for folder in os.listdir(recipes_dir)
+            if not folder.startswith('.') and os.path.isdir(os.path.join(recipes_dir, folder))))
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def _index_digest(index, graph):
+    """Hash of the records of the channel index for the packages that the nodes of graph
+    produce or depend on.  Whether those are already built (see skip_existing) or installable
+    decides which nodes are in the graph, so a previous graph is only reused if this is the
+    same."""
+    names = set()
+    for _, data in graph.nodes(data=True):
+        names.update(data['record'].outputs)
+        names.update(spec.split()[0] for spec in data['record'].deps if spec.strip())
+    keys = sorted(str(key) for key, record in index.items() if record.name in names)
+    return hashlib.sha256('\n'.join(keys).encode('utf-8')).hexdigest()
+
+
+def _recipe_folders(graph, path):
+    """The folders of path that the recipes of the nodes of graph are in"""
+    recipes_dir = os.path.abspath(path)
+    folders = set()
+    for _, data in graph.nodes(data=True):
+        folder = os.path.relpath(os.path.abspath(data['record'].recipe_dir),
+                                 recipes_dir).split(os.sep)[0]
+        if folder not in (os.curdir, os.pardir):
+            folders.add(os.path.join(recipes_dir, folder))
+    return sorted(folder for folder in folders if os.path.isdir(folder))
+
+
+def _reusable_graph(previous, path, folders, platform, config):
+    """Split the previous graph of a platform into what can be reused and what needs computing
+    again.
+
+    A node needs computing again if the inputs of its render changed, or if it depends on a
+    node that does.  Returns the reusable part of the graph and the folders to render."""
+    graph = previous['graph'].copy()
+    recipes_dir = os.path.abspath(path)
+    hashes = {}
+
+    def input_hash(recipe_dir):
+        if recipe_dir not in hashes:
+            hashes[recipe_dir] = (render_cache_key(recipe_dir, platform, config)
+                                  if os.path.isdir(recipe_dir) else None)
+        return hashes[recipe_dir]
+
+    def folder(node):
+        return os.path.relpath(graph.nodes[node]['record'].meta_path,
+                               recipes_dir).split(os.sep)[0]
+
+    changed = [node for node, data in graph.nodes(data=True)
+               if input_hash(data['record'].recipe_dir) != data.get('input_hash')]
+    invalid = set(changed)
+    for node in changed:
+        invalid.update(nx.ancestors(graph, node))
+    render_folders = set(folder(node) for node in invalid)
+    render_folders.update(f for f in folders or ()
+                          if input_hash(os.path.join(recipes_dir, f)) !=
+                          previous['folder_hashes'].get(f))
+    # dependencies that were only there for the nodes computed again are dropped.  If they are
+    #    still needed, computing those nodes adds them back.
+    dropped = set(invalid)
+    while True:
+        unneeded = [node for node in graph.nodes()
+                    if node not in dropped and folder(node) not in (folders or ()) and
+                    any(True for _ in graph.predecessors(node)) and
+                    all(pred in dropped for pred in graph.predecessors(node))]
+        if not unneeded:
+            break
+        dropped.update(unneeded)
+    graph.remove_nodes_from(dropped)
+    return graph, sorted(folder for folder in render_folders
+                         if os.path.isdir(os.path.join(recipes_dir, folder)))
+
+
+def _platform_graph(path, folders, matrix_base_dir, platform, config, channels,
+                    variant_config_files, steps, max_downstream, render_jobs,
+                    index_snapshot=None, upstream=False, previous=None):
+    """Compute the graph of build tasks for a single platform.  Module level so that it can
+    run in a process pool.
+
+    previous is the graph of this platform from a previous run, along with the hashes of its
+    requested folders and of the channel index, if it was computed with the same parameters
+    (see _plan_params).  Only what changed since is computed again.  If the packages in the
+    channels that the graph is made of changed (see _index_digest), everything is."""
+    subdir = f"{platform['platform']}-{platform['arch']}"
+    config.variants = get_package_variants(path, config, platform.get('variants'))
+    config.channel_urls = channels or []
+    config.variant_config_files = variant_config_files or []
+    folder_hashes = {folder: render_cache_key(os.path.join(path, folder), platform, config)
+                     for folder in folders or ()}
+    if index_snapshot:
+        index = load_index(index_snapshot, subdir, channels=channels or [])
+    else:
+        index = get_build_index(
+            subdir=subdir, bldpkgs_dir=config.bldpkgs_dir, channel_urls=channels)[0]
+    if (previous is not None and
+            _index_digest(index, previous['graph']) != previous.get('index_digest')):
+        print(f"{subdir}: packages in the channels changed; computing the graph again")
+        previous = None
+    reused = None
+    if previous is not None:
+        reused, render_folders = _reusable_graph(previous, path, folders, platform, config)
+        reused.graph['folder_hashes'] = folder_hashes
+        write_recipe_logs(_recipe_folders(reused, path))
+        if not render_folders:
+            print(f"{subdir}: the previous graph is up to date ({len(reused)} nodes)")
+            reused.graph['index_digest'] = _index_digest(index, reused)
+            return reused
+        print(f"{subdir}: reusing {len(reused)} nodes of the previous graph, rendering "
+              f"{', '.join(render_folders)} again")
+        folders = render_folders
+    conda_resolve = Resolve(index)
+    # this graph is potentially different for platform and for build or test mode ("run")
+    graph = construct_graph(
+        path,
+        worker=platform,
+        folders=folders,
+        run="build",
+        matrix_base_dir=matrix_base_dir,
+        conda_resolve=conda_resolve,
+        config=config,
+        render_jobs=render_jobs,
+    )
+    # Apply the build label to any nodes that need (re)building or testing
+    expand_run(
+        graph,
+        config=config.copy(),
+        conda_resolve=conda_resolve,
+        worker=platform,
+        run="build",
+        steps=steps,
+        max_downstream=max_downstream,
+        recipes_dir=path,
+        matrix_base_dir=matrix_base_dir,
+        render_jobs=render_jobs,
+    )
+    expand_run_upstream(
+        graph,
+        conda_resolve=conda_resolve,
+        worker=platform,
+        run="build",
+        steps=-1 if upstream else 0,
+        recipes_dir=path,
+        matrix_base_dir=matrix_base_dir,
+    )
+    print(f"{subdir} {installability(conda_resolve).stats()}")
+    if _worker_render_cache:
+        print(f"{subdir} {_worker_render_cache.stats()}")
+    # the rest of the way, the nodes' MetaData is dead weight
+    compact_graph(graph)
+    for node, data in graph.nodes(data=True):
+        data['input_hash'] = render_cache_key(data['record'].recipe_dir, platform, config)
+    if reused is not None:
+        reused.add_nodes_from(graph.nodes(data=True))
+        reused.add_edges_from(graph.edges())
+        splice_intradependencies(reused, graph.nodes())
+        graph = reused
+    graph.graph['folder_hashes'] = folder_hashes
+    graph.graph['index_digest'] = _index_digest(index, graph)
+    return graph
+
+
 def collect_tasks(
         path,
         folders,
@@ -80,10 +291,51 @@ def collect_tasks(
         append_sections_file=None,
         pass_throughs=None,
         skip_existing=True,
-        build_config_vars={}
+        build_config_vars={},
+        render_jobs=1,
+        render_cache_dir=None,
+        render_cache_max_size=None,
+        dependency_index=None,
+        platform_jobs=1,
+        index_snapshot=None,
+        recipe_log_max_count=DEFAULT_MAX_COUNT,
+        recipe_log_since=None,
+        recipe_log_cache_dir=None,
+        upstream=False,
+        lazy_render=False,
+        previous_graph=None,
+        graph_artifact=None,
         ):
-    """ Return a graph of build tasks """
+    """ Return a graph of build tasks
+
+    With platform_jobs > 1, the graphs of the platforms are computed concurrently in that many
+    processes.  They are merged in the order of the platforms either way, so the result does
+    not depend on platform_jobs.
+
+    index_snapshot is a folder written by index_snapshot (c3i index-snapshot).  If given, the
+    channel index is read from it instead of being downloaded.
+
+    The recipe_log_* arguments limit and cache the git logs written into the recipes.  See
+    recipe_log.set_recipe_log_options.
+
+    With upstream, each graph is checked for upstream dependencies that can't be installed, and
+    the recipes avoided compared with rebuilding everything upstream are reported.  See
+    compute_build_graph.expand_run_upstream.
+
+    With lazy_render, recipes that their meta.yaml rules out are not rendered.  See
+    compute_build_graph.set_lazy_render.
+
+    graph_artifact is a path to save the graph to (see graph_artifact.save_graph).  Given such
+    a saved graph as previous_graph, the graph of each platform that was computed with the same
+    parameters is reused, and only the recipes that changed since are rendered again.
+    """
     task_graph = nx.DiGraph()
+    render_cache = set_render_cache(render_cache_dir, max_size=render_cache_max_size)
+    set_dependency_index(dependency_index)
+    recipe_log_options = dict(max_count=recipe_log_max_count, since=recipe_log_since,
+                              cache_dir=recipe_log_cache_dir)
+    set_recipe_log_options(**recipe_log_options)
+    set_lazy_render(lazy_render)
     parsed_cli_args = _parse_python_numpy_from_pass_throughs(pass_throughs)
     config = conda_build.api.Config(
         clobber_sections_file=clobber_sections_file,
@@ -93,94 +345,62 @@ def collect_tasks(
     )
     platform_filters = ensure_list(platform_filters) if platform_filters else ['*']
     platforms = parse_platforms(matrix_base_dir, platform_filters, build_config_vars)
-    # loop over platforms here because each platform may have different dependencies
+    params = {platform['label']: _plan_params(path, folders, platform, channels, steps,
+                                              max_downstream, upstream, index_snapshot,
+                                              skip_existing)
+              for platform in platforms}
+    previous = {}
+    if previous_graph:
+        try:
+            old_graph, old_platforms = load_graph(previous_graph)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            log.warn("Unable to use previous graph %s; computing everything.  Error was: %s",
+                     previous_graph, e)
+            old_graph, old_platforms = None, {}
+        for label, platform_params in params.items():
+            if old_platforms.get(label, {}).get('params') == platform_params:
+                previous[label] = {'graph': platform_graph(old_graph, label),
+                                   'folder_hashes': old_platforms[label]['folder_hashes'],
+                                   'index_digest': old_platforms[label].get('index_digest')}
+            else:
+                print(f"{label}: parameters differ from the previous graph; computing it again")
+    # each platform may have different dependencies, so each gets its own graph.
     # each platform will be submitted with a different label
-    for platform in platforms:
-        subdir = f"{platform['platform']}-{platform['arch']}"
-        config.variants = get_package_variants(path, config, platform.get('variants'))
-        config.channel_urls = channels or []
-        config.variant_config_files = variant_config_files or []
-        conda_resolve = Resolve(get_build_index(
-            subdir=subdir, bldpkgs_dir=config.bldpkgs_dir, channel_urls=channels)[0])
-        # this graph is potentially different for platform and for build or test mode ("run")
-        graph = construct_graph(
-            path,
-            worker=platform,
-            folders=folders,
-            run="build",
-            matrix_base_dir=matrix_base_dir,
-            conda_resolve=conda_resolve,
-            config=config,
-        )
-        # Apply the build label to any nodes that need (re)building or testing
-        expand_run(
-            graph,
-            config=config.copy(),
-            conda_resolve=conda_resolve,
-            worker=platform,
-            run="build",
-            steps=steps,
-            max_downstream=max_downstream,
-            recipes_dir=path,
-            matrix_base_dir=matrix_base_dir,
-        )
-        # merge this graph with the main one
-        task_graph = nx.compose(task_graph, graph)
+    platform_args = [(path, folders, matrix_base_dir, platform, config.copy(), channels,
+                      variant_config_files, steps, max_downstream, render_jobs, index_snapshot,
+                      upstream, previous.get(platform['label']))
+                     for platform in platforms]
+    if platform_jobs > 1 and len(platforms) > 1:
+        print(f'computing graphs for {len(platforms)} platforms with '
+              f'{min(platform_jobs, len(platforms))} processes')
+        with ProcessPoolExecutor(max_workers=min(platform_jobs, len(platforms)),
+                                 initializer=_init_platform_worker,
+                                 initargs=(render_cache_dir, render_cache_max_size,
+                                           dependency_index, recipe_log_options,
+                                           lazy_render)) as pool:
+            futures = [pool.submit(_platform_graph, *args) for args in platform_args]
+            graphs = [future.result() for future in futures]
+    else:
+        graphs = [_platform_graph(*args) for args in platform_args]
+    _merge_graphs(task_graph, graphs)
+    if graph_artifact:
+        save_graph(graph_artifact, task_graph,
+                   {platform['label']: {'params': params[platform['label']],
+                                        'folder_hashes': graph.graph['folder_hashes'],
+                                        'index_digest': graph.graph['index_digest']}
+                    for platform, graph in zip(platforms, graphs)})
     collapse_noarch_python_nodes(task_graph)
+    if render_cache:
+        print(render_cache.stats())
     return task_graph
 
 
-def collapse_noarch_python_nodes(graph):
-    """ Collapse nodes for noarch python packages into a single node
-
-    Collapse nodes corresponding to any noarch python packages so that each package
-    in built on a single platform and test on the remaining platforms.  Edges are
-    reassinged or removed as needed.
-    """
-    # TODO make build_subdir configurable
-    build_subdir = 'linux-64'
-
-    # find all noarch python builds, group by package name
-    noarch_groups = defaultdict(list)
-    for node in graph.nodes():
-        if graph.nodes[node].get('noarch_pkg', False):
-            pkg_name = graph.nodes[node]['meta'].name()
-            noarch_groups[pkg_name].append(node)
-
-    for pkg_name, nodes in noarch_groups.items():
-        # split into build and test nodes
-        build_nodes = []
-        test_nodes = []
-        for node in nodes:
-            if graph.nodes[node]['meta'].config.subdir == build_subdir:
-                build_nodes.append(node)
-            else:
-                test_nodes.append(node)
-        if len(build_nodes) > 1:
-            log.warn('more than one noarch python build for %s' % (pkg_name))
-        if len(build_nodes) == 0:
-            raise ValueError(
-                'The %s platform has no noarch python build for %s' % (build_subdir, pkg_name))
-        build_node = build_nodes[0]
-
-        for test_node in test_nodes:
-            # reassign any dependencies on the test_only node to the build node
-            for edge in tuple(graph.in_edges(test_node)):
-                new_edge = edge[0], build_node
-                graph.add_edge(*new_edge)
-                graph.remove_edge(*edge)
-            # remove all test_only node dependencies
-            for edge in tuple(graph.out_edges(test_node)):
-                graph.remove_edge(*edge)
-            # add a test only node
-            metadata = graph.nodes[test_node]['meta']
-            worker = graph.nodes[test_node]['worker']
-            name = 'test-' + test_node
-            graph.add_node(name, meta=metadata, worker=worker, test_only=True)
-            graph.add_edge(name, build_node)
-            # remove the test_only node
-            graph.remove_node(test_node)
-    return
+def _merge_graphs(task_graph, graphs):
+    """Merge graphs into task_graph, in place and in order.  Like nx.compose, attributes from
+    later graphs win, but without copying task_graph for every graph."""
+    for graph in graphs:
+        task_graph.add_nodes_from(graph.nodes(data=True))
+        task_graph.add_edges_from(graph.edges(data=True))
 
 
 def get_build_task(
@@ -197,9 +417,10 @@ def get_build_task(
         automated_pipeline=False,
         pull_recipes_resource=None,
         ):
-
-    worker_tags = (ensure_list(worker_tags) +
-                   ensure_list(meta.meta.get('extra', {}).get('worker_tags')))
+    """meta is the NodeRecord (or the MetaData) of node"""
+    if not isinstance(meta, NodeRecord):
+        meta = NodeRecord.from_metadata(meta)
+    worker_tags = ensure_list(worker_tags) + list(meta.worker_tags)
     stepconfig = BuildStepConfig(test_only, worker['platform'], worker_tags)
 
     # setup the task config
@@ -216,7 +437,7 @@ def get_build_task(
     stepconfig.cb_args.append(f'--stats-file={stats_file}')
     if test_only:
         stepconfig.cb_args.append('--test')
-    for channel in meta.config.channel_urls:
+    for channel in meta.channel_urls:
         stepconfig.cb_args.extend(['-c', channel])
     if artifact_input:
         stepconfig.cb_args.extend(('-c', os.path.join('indexed-artifacts')))
@@ -274,9 +495,11 @@ def graph_to_plan_with_jobs(
         public=True, worker_tags=None, pass_throughs=None,
         use_repo_access=False, use_staging_channel=False,
         automated_pipeline=False, branches=None, folders=None,
-        pr_num=None, repository=None):
+        pr_num=None, repository=None, durations=None):
+    """durations (expected seconds, by node) make the jobs come in critical path order.  See
+    compute_build_graph.order_build."""
     # upload_config_path = os.path.join(matrix_base_dir, 'uploads.d')
-    order = order_build(graph)
+    order = order_build(graph, durations)
     if graph.number_of_nodes() == 0:
         raise Exception(
             "Build graph is empty. The default behaviour is to skip existing builds."
@@ -309,7 +532,7 @@ def graph_to_plan_with_jobs(
         plconfig.add_rsync_build_pack(config_vars)
 
     for node in order:
-        meta = graph.nodes[node]['meta']
+        meta = node_record(graph, node)
         worker = graph.nodes[node]['worker']
         test_only = graph.nodes[node].get('test_only', False)
         rsync_artifacts = worker.get("rsync") in [None, True]
@@ -319,7 +542,7 @@ def graph_to_plan_with_jobs(
         jobconfig = JobConfig(name=name)
         if automated_pipeline:
             # TODO use mapping between node -> folder/feedstock
-            feedstock_name = meta.meta['package']['name']
+            feedstock_name = meta.package_name
             pull_recipes_resource = f"pull-recipes-{feedstock_name}"
             jobconfig.plan.append(
                 {'get': pull_recipes_resource, 'trigger': True}
@@ -336,7 +559,7 @@ def graph_to_plan_with_jobs(
             if rsync_artifacts:
                 jobconfig.add_rsync_prereq(prereq)
         if prereqs:
-            jobconfig.add_consolidate_task(prereqs, meta.config.host_subdir,
+            jobconfig.add_consolidate_task(prereqs, meta.host_subdir,
                     docker_user=docker_user, docker_pass=docker_pass)
         jobconfig.plan.append(get_build_task(
             node, meta, worker,
@@ -351,7 +574,7 @@ def graph_to_plan_with_jobs(
             pull_recipes_resource=pull_recipes_resource,
         ))
         if not test_only:
-            jobconfig.add_convert_task(meta.config.host_subdir,
+            jobconfig.add_convert_task(meta.host_subdir,
                     docker_user=docker_user, docker_pass=docker_pass)
             resource_name = 'rsync_' + node
             jobconfig.add_put_artifacts(resource_name)
@@ -416,21 +639,30 @@ def _get_current_git_rev(path, branch=False):
     return out[:8] if not branch else out
 
 
+# logged in Concourse objects, by config.yml path.  See _ensure_login_and_sync.
+_concourses = {}
+
+
 def _ensure_login_and_sync(config_root_dir):
     """
     Return Concourse object after logging in and syncing the fly version.
+
+    The object is kept for the config.yml it was made from, so that fly is only synced once
+    for every operation of a run (each pipeline of a batch, the removal of each pipeline, ...).
+    The login is checked every time, since it can expire during a long batch.
     """
-    config_path = os.path.expanduser(os.path.join(config_root_dir, 'config.yml'))
+    config_path = os.path.abspath(os.path.expanduser(os.path.join(config_root_dir, 'config.yml')))
     with open(config_path) as src:
         config_vars = yaml.safe_load(src)
-    con = Concourse(
-        concourse_url=config_vars['concourse-url'],
-        username=config_vars.get('concourse-username'),
-        password=config_vars.get('concourse-password'),
-        team_name=config_vars.get('concourse-team'),
-    )
+    con, cached_vars = _concourses.get(config_path, (None, None))
+    synced = con is not None and cached_vars == config_vars
+    if not synced:
+        con = concourse_from_config(config_vars)
+    # only logs in again if the token expired (see Concourse.login)
     con.login()
-    con.sync()
+    if not synced:
+        con.sync()
+        _concourses[config_path] = (con, config_vars)
     return con
 
 
@@ -596,9 +828,30 @@ def compute_builds(path, base_name, folders, matrix_base_dir=None,
         clobber_sections_file=clobber_sections_file,
         pass_throughs=pass_throughs,
         skip_existing=skip_existing,
-        build_config_vars=build_config_vars
+        build_config_vars=build_config_vars,
+        render_jobs=kw.get('render_jobs') or 1,
+        render_cache_dir=kw.get('render_cache_dir'),
+        render_cache_max_size=(kw['render_cache_max_size'] * 1024 ** 2
+                               if kw.get('render_cache_max_size') else None),
+        dependency_index=kw.get('dependency_index'),
+        platform_jobs=kw.get('platform_jobs') or 1,
+        index_snapshot=kw.get('index_snapshot'),
+        recipe_log_max_count=kw.get('recipe_log_max_count', DEFAULT_MAX_COUNT),
+        recipe_log_since=kw.get('recipe_log_since'),
+        recipe_log_cache_dir=kw.get('recipe_log_cache_dir'),
+        upstream=kw.get('upstream', False),
+        lazy_render=kw.get('lazy_render', False),
+        previous_graph=kw.get('previous_graph'),
+        graph_artifact=(os.path.join(output_dir.format(base_name=base_name,
+                                                       git_identifier=git_identifier),
+                                     GRAPH_FILENAME)
+                        if kw.get('save_graph') or kw.get('previous_graph') else None),
     )
 
+    durations = None
+    if kw.get('build_order') == 'critical-path':
+        durations = estimate_durations(task_graph, load_durations(kw.get('build_stats') or []))
+
     with open(os.path.join(matrix_base_dir, 'config.yml')) as src:
         config_vars = yaml.safe_load(src)
     config_vars['recipe-repo-commit'] = repo_commit
@@ -621,7 +874,8 @@ def compute_builds(path, base_name, folders, matrix_base_dir=None,
         branches=kw.get("branches", None),
         pr_num=kw.get("pr_num", None),
         repository=kw.get("repository", None),
-        folders=folders
+        folders=folders,
+        durations=durations,
     )
 
     if kw.get('pr_file'):
@@ -671,14 +925,14 @@ def compute_builds(path, base_name, folders, matrix_base_dir=None,
     for fn in glob.glob(os.path.join(output_dir, 'output_order*')):
         os.remove(fn)
     last_recipe_dir = None
-    nodes = list(nx.topological_sort(task_graph))
-    nodes.reverse()
+    if durations is None:
+        nodes = list(nx.topological_sort(task_graph))
+        nodes.reverse()
+    else:
+        nodes = order_build(task_graph, durations)
     for node in nodes:
-        meta = task_graph.nodes[node]['meta']
-        if meta.meta_path:
-            recipe = os.path.dirname(meta.meta_path)
-        else:
-            recipe = meta.meta.get('extra', {}).get('parent_recipe', {}).get('path', '')
+        meta = node_record(task_graph, node)
+        recipe = meta.recipe_dir
         assert recipe, ("no parent recipe set, and no path associated "
                                 "with this metadata")
         # make recipe path relative
@@ -696,7 +950,7 @@ def compute_builds(path, base_name, folders, matrix_base_dir=None,
         # write the conda_build_config.yml for this particular metadata into that recipe
         #   This should sit alongside meta.yaml, where conda-build will be able to find it
         with open(os.path.join(out_folder, 'conda_build_config.yaml'), 'w') as f:
-            yaml.dump(meta.config.squished_variants, f, default_flow_style=False)
+            yaml.dump(meta.squished_variants, f, default_flow_style=False)
 
         # copy any clobber or append file that is specified either on CLI or via condarc
         if clobber_sections_file:
@@ -717,11 +971,7 @@ def compute_builds(path, base_name, folders, matrix_base_dir=None,
 
     # clean up recipe_log.txt so that we don't leave a dirty git state
     for node in nodes:
-        meta = task_graph.nodes[node]['meta']
-        if meta.meta_path:
-            recipe = os.path.dirname(meta.meta_path)
-        else:
-            recipe = meta.meta.get('extra', {}).get('parent_recipe', {}).get('path', '')
+        recipe = node_record(task_graph, node).recipe_dir
         if os.path.isfile(os.path.join(recipe, 'recipe_log.json')):
             os.remove(os.path.join(recipe, 'recipe_log.json'))
         if os.path.isfile(os.path.join(recipe, 'recipe_log.txt')):
@@ -788,6 +1038,91 @@ Overview:
     """.format(base_name))
 
 
+def index_snapshot(snapshot_dir, channel=None, subdirs=None, config_root_dir=None,
+                   platform_filters=None, pass_throughs=None, **kw):
+    """Save the channel index for each of subdirs (by default, the subdirs of the build
+    platforms in config_root_dir) into snapshot_dir.  Use it with --index-snapshot."""
+    if not subdirs:
+        if not config_root_dir:
+            raise ValueError("Either subdirs or config_root_dir (to read build platforms from) "
+                             "must be given")
+        platform_filters = ensure_list(platform_filters) if platform_filters else ['*']
+        platforms = parse_platforms(os.path.expanduser(config_root_dir), platform_filters, {})
+        subdirs = list(dict.fromkeys(f"{platform['platform']}-{platform['arch']}"
+                                     for platform in platforms))
+    save_snapshot(snapshot_dir, subdirs, channels=channel)
+
+
+def stats_ingest(db, paths, pass_throughs=None, **kw):
+    """Add the stats files in paths (copies of <intermediate-base-folder>/stats, or files in
+    them) to the build stats database db"""
+    build_stats = BuildStats(db)
+    try:
+        added = build_stats.ingest(paths)
+    finally:
+        build_stats.close()
+    print("added {} builds to {}".format(added, db))
+    return added
+
+
+def stats_query(db, sort=None, limit=20, platform=None, package=None, include_tests=False,
+                pass_throughs=None, **kw):
+    """Print the slowest and the most memory-hungry recipes in the build stats database db, or
+    the ones highest in sort (see stats.SORT_KEYS)"""
+    if not os.path.isfile(db):
+        raise ValueError("{} does not exist.  Create it with 'c3i stats ingest'".format(db))
+    build_stats = BuildStats(db)
+    try:
+        for key in ([sort] if sort else ['elapsed', 'rss']):
+            print(format_top(build_stats.top(key, limit=limit, platform=platform,
+                                             package=package, include_tests=include_tests),
+                             key))
+    finally:
+        build_stats.close()
+
+
+def simulate(path, config_root_dir=None, platform_filters=None, build_stats=None, workers=None,
+             job_overhead=0, build_order='topological', pass_throughs=None, **kw):
+    """Print how long running the task graph in path (graph.json, plan.yml, or the output
+    folder of c3i examine holding them) would take.  See simulate.simulate.
+
+    The number of workers of each platform is read from the "workers" key of its
+    build_platforms.d entry in config_root_dir; workers (LABEL=N strings) override it."""
+    graph = load_task_graph(path)
+    platforms = []
+    if config_root_dir:
+        platform_filters = ensure_list(platform_filters) if platform_filters else ['*']
+        platforms = parse_platforms(os.path.expanduser(config_root_dir), platform_filters, {})
+    overrides = {}
+    for label_count in ensure_list(workers):
+        label, _, count = label_count.rpartition('=')
+        if not label or not count.isdigit():
+            raise ValueError("--workers takes LABEL=N, not {}".format(label_count))
+        overrides[label] = int(count)
+    durations = estimate_durations(graph, load_durations(ensure_list(build_stats)))
+    order = order_build(graph, durations if build_order == 'critical-path' else None)
+    result = simulate_graph(graph, durations, platform_workers(platforms, overrides),
+                            overhead=job_overhead, order=order)
+    print(format_report(result, graph))
+    return result
+
+
+def local_run(output_dir, jobs=1, labels=None, work_dir=None, channel=None, keep_going=True,
+              dry_run=False, pass_throughs=None, **kw):
+    """Build the plan that c3i examine wrote to output_dir on this machine, with up to jobs
+    conda-build processes at a time.  See local_run.LocalRun.  Returns whether every node was
+    built."""
+    runner = LocalRun(output_dir, work_dir=work_dir, labels=labels, channels=channel,
+                      pass_throughs=pass_throughs)
+    if dry_run:
+        for node in runner.order:
+            print(' '.join(runner.command(node)))
+        return True
+    results = runner.run(jobs=jobs, keep_going=keep_going)
+    print(format_summary(results, runner.order))
+    return all(status == 'succeeded' for status, _ in results.values())
+
+
 def submit_one_off(pipeline_label, recipe_root_dir, folders, config_root_dir, pass_throughs=None,
                    **kwargs):
     """A 'one-off' job is a submission of local recipes that use the concourse build workers.
@@ -802,34 +1137,62 @@ def submit_one_off(pipeline_label, recipe_root_dir, folders, config_root_dir, pa
         4. submit the generated plan created by step 1
     """
 
-    # the intermediate paths are set up for the configuration name.  With one-offs, we're ignoring
-    #    the configuration's tie to a github repo.  What we should do is replace the base_name in
-    #    the configuration locations with our pipeline label
-    config_overrides = {'base-name': pipeline_label}
-    config_root_dir = os.path.expanduser(config_root_dir)
     ctx = (contextlib.contextmanager(lambda: (yield kwargs.get('output_dir'))) if
            kwargs.get('output_dir') else TemporaryDirectory)
     with ctx() as tmpdir:
         kwargs['output_dir'] = tmpdir
-        compute_builds(path=recipe_root_dir, base_name=pipeline_label, folders=folders,
-                       matrix_base_dir=config_root_dir, config_overrides=config_overrides,
-                       pass_throughs=pass_throughs, **kwargs)
-        if kwargs.get("dry_run", False):
-            print("!!! Dry run, pipeline not submitted to concourse")
-            print(f"!!! Prepared plans and recipes stored in {tmpdir}")
-        else:
-            submit(pipeline_file=os.path.join(tmpdir, 'plan.yml'), base_name=pipeline_label,
-                pipeline_name=pipeline_label, src_dir=tmpdir, config_root_dir=config_root_dir,
-                config_overrides=config_overrides, pass_throughs=pass_throughs, **kwargs)
+        prepare_one_off(pipeline_label, recipe_root_dir, folders, config_root_dir,
+                        pass_throughs=pass_throughs, **kwargs)
+        submit_prepared_one_off(pipeline_label, config_root_dir, pass_throughs=pass_throughs,
+                                **kwargs)
+
+
+def _one_off_overrides(pipeline_label):
+    # the intermediate paths are set up for the configuration name.  With one-offs, we're ignoring
+    #    the configuration's tie to a github repo.  What we should do is replace the base_name in
+    #    the configuration locations with our pipeline label
+    return {'base-name': pipeline_label}
+
+
+def prepare_one_off(pipeline_label, recipe_root_dir, folders, config_root_dir, output_dir,
+                    pass_throughs=None, **kwargs):
+    """Step 1 of submit_one_off: compute the plan and recipes of a one-off into output_dir"""
+    compute_builds(path=recipe_root_dir, base_name=pipeline_label, folders=folders,
+                   matrix_base_dir=os.path.expanduser(config_root_dir),
+                   config_overrides=_one_off_overrides(pipeline_label),
+                   pass_throughs=pass_throughs, output_dir=output_dir, **kwargs)
+
+
+def submit_prepared_one_off(pipeline_label, config_root_dir, output_dir, pass_throughs=None,
+                            **kwargs):
+    """Steps 2 to 4 of submit_one_off, for the plan that prepare_one_off put in output_dir"""
+    if kwargs.get("dry_run", False):
+        print("!!! Dry run, pipeline not submitted to concourse")
+        print(f"!!! Prepared plans and recipes stored in {output_dir}")
+    else:
+        submit(pipeline_file=os.path.join(output_dir, 'plan.yml'), base_name=pipeline_label,
+               pipeline_name=pipeline_label, src_dir=output_dir,
+               config_root_dir=os.path.expanduser(config_root_dir),
+               config_overrides=_one_off_overrides(pipeline_label),
+               pass_throughs=pass_throughs, **kwargs)
 
 
 def submit_batch(
         batch_file, recipe_root_dir, config_root_dir,
         max_builds, poll_time, build_lookback, label_prefix,
-        pass_throughs=None, **kwargs):
+        pass_throughs=None, prepare_ahead=0, **kwargs):
     """
     Submit a batch of 'one-off' jobs with controlled submission based on the
     number of running builds.
+
+    A one-off is submitted as soon as fewer than max_builds builds are active (see
+    build_watcher.BuildWatcher).  After each submission, the next one waits until the builds
+    of the new pipeline show up, for up to poll_time seconds.  Builds of private pipelines
+    are seen with the token of the login to the server.
+
+    With prepare_ahead, the plans of the next prepare_ahead one-offs are computed by as many
+    processes (see prepare_one_off), each into a temporary folder, while earlier ones wait for
+    the server.  Submitting is then only the rsync and set-pipeline of a plan that is ready.
     """
     with open(batch_file) as f:
         batch_lines = sorted([line for line in f])
@@ -840,32 +1203,80 @@ def submit_batch(
         data = yaml.safe_load(src)
 
     concourse_url = data['concourse-url']
+    token = None
+    if not kwargs.get('dry_run'):
+        token = _ensure_login_and_sync(config_root_dir).bearer_token()
+
+    def item_args(batch_item):
+        extra = kwargs.copy()
+        extra.update(batch_item.item_kwargs)
+        return batch_item.get_label(label_prefix), extra
+
+    # one-offs being prepared, in order: (batch item, future, output folder)
+    prepared = deque()
+    pool = ProcessPoolExecutor(max_workers=prepare_ahead) if prepare_ahead > 0 else None
+
+    def prepare_next():
+        while pool and batch_items and len(prepared) < prepare_ahead:
+            batch_item = batch_items.pop(0)
+            pipeline_label, extra = item_args(batch_item)
+            extra['output_dir'] = tempfile.mkdtemp(prefix=pipeline_label + '-')
+            future = pool.submit(prepare_one_off, pipeline_label, recipe_root_dir,
+                                 batch_item.folders, config_root_dir,
+                                 pass_throughs=pass_throughs, **extra)
+            prepared.append((batch_item, future, extra['output_dir']))
 
     success = []
     failed = []
-    while len(batch_items):
-        num_activate_builds = _get_activate_builds(concourse_url, build_lookback)
-        if num_activate_builds < max_builds:
+    watcher = BuildWatcher(concourse_url, lookback=build_lookback, token=token)
+    try:
+        prepare_next()
+        while len(batch_items) or len(prepared):
+            num_activate_builds = watcher.refresh()
+            if num_activate_builds >= max_builds:
+                print("Too many active builds:", num_activate_builds)
+                watcher.wait_for_slot(max_builds, poll_time)
+                continue
+            if pool:
+                batch_item, future, output_dir = prepared.popleft()
+                prepare_next()
+            else:
+                batch_item = batch_items.pop(0)
             # use a try/except block here so a single failed one-off does not
             # break the batch
             try:
-                batch_item = batch_items.pop(0)
                 print("Starting build for:", batch_item)
 
-                pipeline_label = batch_item.get_label(label_prefix)
-                extra = kwargs.copy()
-                extra.update(batch_item.item_kwargs)
-                submit_one_off(pipeline_label, recipe_root_dir, batch_item.folders,
-                               config_root_dir, pass_throughs=pass_throughs, **extra)
+                pipeline_label, extra = item_args(batch_item)
+                if pool:
+                    future.result()
+                    extra['output_dir'] = output_dir
+                    submit_prepared_one_off(pipeline_label, config_root_dir,
+                                            pass_throughs=pass_throughs, **extra)
+                else:
+                    submit_one_off(pipeline_label, recipe_root_dir, batch_item.folders,
+                                   config_root_dir, pass_throughs=pass_throughs, **extra)
                 print("Success", batch_item)
                 success.append(batch_item)
             except Exception as e:
                 print("Fail", batch_item)
                 print("Exception was:", e)
                 failed.append(batch_item)
-        else:
-            print("Too many active builds:", num_activate_builds)
-        time.sleep(poll_time)
+                continue
+            finally:
+                if pool and not kwargs.get('dry_run'):
+                    shutil.rmtree(output_dir, ignore_errors=True)
+            if batch_items or prepared:
+                # count the builds of the new pipeline before deciding on the next one
+                watcher.wait_for_new_builds(poll_time, pipeline_name=pipeline_label)
+    finally:
+        watcher.close()
+        if pool:
+            for _, future, _ in prepared:
+                future.cancel()
+            pool.shutdown()
+            for _, _, output_dir in prepared:
+                shutil.rmtree(output_dir, ignore_errors=True)
 
     print("one-off jobs submitted:", len(success))
     if len(failed):
@@ -899,80 +1310,100 @@ class BatchItem(object):
         return ' '.join(self.folders)
 
 
-def _get_activate_builds(concourse_url, limit):
-    """ Return the number of active builds on the server. """
-    url = requests.compat.urljoin(concourse_url, 'api/v1/builds')
-    r = requests.get(url, params={'limit': limit})
-    all_items = r.json()
-    if len(all_items) < 5:
-        raise ValueError("Something wrong")
-    running = [i for i in all_items if i['status'] == 'started']
-    return len(running)
+def _bulk(action, items, func, parallel=1):
+    """Call func on each of items, up to parallel at a time, printing the outcome of each.  A
+    failure doesn't stop the others.  Ends with a summary; returns the items that failed."""
+    items = list(items)
+    failed = []
+
+    def run(item):
+        try:
+            func(item)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as pool:
+        futures = {pool.submit(run, item): item for item in items}
+        for n, future in enumerate(as_completed(futures), 1):
+            item, error = futures[future], future.result()
+            if error is None:
+                print(f"[{n}/{len(items)}] {action} {item}: ok")
+            else:
+                failed.append(item)
+                print(f"[{n}/{len(items)}] {action} {item}: FAILED ({error})")
+    print(f"{action}: {len(items) - len(failed)} succeeded, {len(failed)} failed")
+    for item in sorted(failed):
+        print(f"  failed: {item}")
+    return failed
+
+
+def _abort_builds(con, pipeline):
+    for job in con.get_builds(pipeline):
+        if job["status"] == "started":
+            print(f"{pipeline}/{job['job_name']}")
+            con.abort_build(pipeline, job["job_name"], job["name"])
 
 
-def rm_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None, **kwargs):
-    con = _ensure_login_and_sync(config_root_dir)
-    pipelines_to_remove = _filter_existing_pipelines(con, pipeline_names)
-    print("Removing pipelines:")
-    for p in pipelines_to_remove:
+def _confirm(pipelines, listing, yolo, do_it_dammit):
+    print(listing)
+    for p in pipelines:
         print(p)
     if not do_it_dammit:
         confirmation = input("Confirm [y]/n: ") or 'y'
     else:
-        print("YOLO! removing all listed pipelines")
-    if do_it_dammit or confirmation == 'y':
-        # make sure we have aborted all pipelines and their jobs ...
-        abort_pipeline(pipelines_to_remove, config_root_dir)
-        # remove the specified pipelines
-        for pipeline_name in pipelines_to_remove:
-            con.destroy_pipeline(pipeline_name)
-    else:
+        print(yolo)
+    return do_it_dammit or confirmation == 'y'
+
+
+def rm_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None,
+                parallel=1, **kwargs):
+    con = _ensure_login_and_sync(config_root_dir)
+    pipelines_to_remove = _filter_existing_pipelines(con, pipeline_names)
+    if not _confirm(pipelines_to_remove, "Removing pipelines:",
+                    "YOLO! removing all listed pipelines", do_it_dammit):
         print("aborted")
+        return []
+
+    def remove(pipeline_name):
+        # make sure we have aborted the jobs of the pipeline ...
+        _abort_builds(con, pipeline_name)
+        con.destroy_pipeline(pipeline_name)
+    return _bulk('remove', pipelines_to_remove, remove, parallel)
 
 
-def pause_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None, **kwargs):
+def pause_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None,
+                   parallel=1, **kwargs):
     con = _ensure_login_and_sync(config_root_dir)
     pipelines_to_pause = _filter_existing_pipelines(con, pipeline_names)
-    print("Pausing pipelines:")
-    for p in pipelines_to_pause:
-        print(p)
-    if not do_it_dammit:
-        confirmation = input("Confirm [y]/n: ") or 'y'
-    else:
-        print("YOLO! pausing all listed pipelines")
-    if do_it_dammit or confirmation == 'y':
-        # make sure we have aborted all pipelines and their jobs ...
-        abort_pipeline(pipelines_to_pause, config_root_dir)
-        # pause the specified pipelines
-        for pipeline_name in pipelines_to_pause:
-            con.pause_pipeline(pipeline_name)
-    else:
+    if not _confirm(pipelines_to_pause, "Pausing pipelines:",
+                    "YOLO! pausing all listed pipelines", do_it_dammit):
         print("aborted")
+        return []
+
+    def pause(pipeline_name):
+        # make sure we have aborted the jobs of the pipeline ...
+        _abort_builds(con, pipeline_name)
+        con.pause_pipeline(pipeline_name)
+    return _bulk('pause', pipelines_to_pause, pause, parallel)
 
 
-def unpause_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None, **kwargs):
+def unpause_pipeline(pipeline_names, config_root_dir, do_it_dammit=False, pass_throughs=None,
+                     parallel=1, **kwargs):
     con = _ensure_login_and_sync(config_root_dir)
     pipelines_to_unpause = _filter_existing_pipelines(con, pipeline_names)
-    print("Unpausing pipelines:")
-    for p in pipelines_to_unpause:
-        print(p)
-    if not do_it_dammit:
-        confirmation = input("Confirm [y]/n: ") or 'y'
-    else:
-        print("YOLO! unpausing all listed pipelines")
-    if do_it_dammit or confirmation == 'y':
-        # unpause the specified pipelines
-        for pipeline_name in pipelines_to_unpause:
-            con.unpause_pipeline(pipeline_name)
-    else:
+    if not _confirm(pipelines_to_unpause, "Unpausing pipelines:",
+                    "YOLO! unpausing all listed pipelines", do_it_dammit):
         print("aborted")
+        return []
+    return _bulk('unpause', pipelines_to_unpause, con.unpause_pipeline, parallel)
 
 
-def trigger_pipeline(pipeline_names, config_root_dir, trigger_all=False, **kwargs):
+def trigger_pipeline(pipeline_names, config_root_dir, trigger_all=False, parallel=1, **kwargs):
     con = _ensure_login_and_sync(config_root_dir)
     pipelines_to_trigger = _filter_existing_pipelines(con, pipeline_names)
     print("Triggering jobs:")
-    for pipeline in pipelines_to_trigger:
+
+    def trigger(pipeline):
         for job in con.get_jobs(pipeline):
             if trigger_all:
                 print(f"{pipeline}/{job['name']}")
@@ -993,14 +1424,12 @@ def trigger_pipeline(pipeline_names, config_root_dir, trigger_all=False, **kwarg
             if status != 'succeeded':
                 print(f"{pipeline}/{job['name']}")
                 con.trigger_job(pipeline, job['name'])
+    return _bulk('trigger', pipelines_to_trigger, trigger, parallel)
 
 
-def abort_pipeline(pipeline_names, config_root_dir, **kwargs):
+def abort_pipeline(pipeline_names, config_root_dir, parallel=1, **kwargs):
     con = _ensure_login_and_sync(config_root_dir)
     pipelines_to_abort = _filter_existing_pipelines(con, pipeline_names)
     print("Aborting pipelines:")
-    for pipeline in pipelines_to_abort:
-        for job in con.get_builds(pipeline):
-            if job["status"] == "started":
-                print(f"{pipeline}/{job['job_name']}")
-                con.abort_build(pipeline, job["job_name"], job["name"])
+    return _bulk('abort', pipelines_to_abort, lambda pipeline: _abort_builds(con, pipeline),
+                 parallel)
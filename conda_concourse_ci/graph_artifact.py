@@ -0,0 +1,115 @@
+"""
+The task graph, saved next to plan.yml for incremental re-planning.
+
+compute_builds used to throw the task graph away once the plan was written.  Saving it (as
+graph.json) lets the next examination of the same recipes reuse the parts of the graph whose
+inputs have not changed (c3i examine --previous-graph).  For each platform, the artifact holds
+a hash of the parameters the graph was computed with and hashes of the requested recipe
+folders.  For each node, it holds the node's NodeRecord, its worker and a hash of the inputs it
+was rendered from.  The graph is saved before noarch: python nodes are collapsed (see
+compute_build_graph.collapse_noarch_python_nodes), since that is what is reused;
+load_task_graph collapses it, so that its nodes are the jobs of plan.yml.  load_task_graph also
+reads the task graph back from a plan.yml, for plans that have no graph.json.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+import networkx as nx
+import yaml
+
+from .compute_build_graph import collapse_noarch_python_nodes
+from .node_record import NodeRecord
+from .stats import split_node
+
+log = logging.getLogger(__file__)
+
+FILENAME = 'graph.json'
+FORMAT_VERSION = 1
+
+# node attributes that are stored as they are
+_ATTRIBUTES = ('worker', 'input_hash', 'noarch_pkg', 'test_only')
+
+
+def save_graph(path, graph, platforms):
+    """Write graph (compacted, see compute_build_graph.compact_graph) to path.
+
+    platforms maps worker labels to a dict with the 'params' and 'folder_hashes' the graph of
+    that platform was computed with."""
+    artifact = {
+        'format': FORMAT_VERSION,
+        'platforms': platforms,
+        'nodes': [dict({'key': node, 'record': data['record'].to_dict()},
+                       **{key: data[key] for key in _ATTRIBUTES if key in data})
+                  for node, data in graph.nodes(data=True)],
+        'edges': [list(edge) for edge in graph.edges()],
+    }
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(artifact, f, sort_keys=True, separators=(',', ':'), default=str)
+    os.replace(tmp, path)
+
+
+def load_graph(path):
+    """Read a graph written by save_graph.  Returns the graph and its platforms dict."""
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact.get('format') != FORMAT_VERSION:
+        raise ValueError("graph {} has format {}, but this version of c3i reads format "
+                         "{}".format(path, artifact.get('format'), FORMAT_VERSION))
+    graph = nx.DiGraph()
+    for node in artifact['nodes']:
+        graph.add_node(node['key'], record=NodeRecord.from_dict(node['record']),
+                       **{key: node[key] for key in _ATTRIBUTES if key in node})
+    graph.add_edges_from(tuple(edge) for edge in artifact['edges'])
+    return graph, artifact['platforms']
+
+
+def platform_graph(graph, label):
+    """The part of graph that runs on the workers labeled label, as a new graph"""
+    return graph.subgraph([node for node, data in graph.nodes(data=True)
+                           if data['worker']['label'] == label]).copy()
+
+
+def _plan_graph(path):
+    """The task graph described by a plan.yml: one node for each build or test job, with edges
+    from the job to the jobs it has passed constraints on"""
+    with open(path) as f:
+        plan = yaml.safe_load(f)
+    graph = nx.DiGraph()
+    jobs = set()
+    for job in plan.get('jobs', []):
+        # jobs are called like the nodes they run, test-only jobs test-<key>
+        node = job['name']
+        test_only = node.startswith('test-')
+        label = split_node(node)[3]
+        if not label:
+            # uploads, branch pushes, ...
+            continue
+        jobs.add(node)
+        graph.add_node(node, worker={'label': label}, test_only=test_only)
+        for step in job.get('plan', []):
+            for prereq in step.get('passed', []) if isinstance(step, dict) else []:
+                graph.add_edge(node, prereq)
+    # passed constraints on anything else (uploads, ...) are not part of the task graph
+    graph.remove_nodes_from([node for node in list(graph.nodes()) if node not in jobs])
+    return graph
+
+
+def load_task_graph(path):
+    """The task graph saved in path: graph.json, a plan.yml or a folder (the output of c3i
+    examine) containing either.  Either way, its nodes are the jobs of the plan."""
+    if os.path.isdir(path):
+        for fn in (FILENAME, 'plan.yml'):
+            if os.path.isfile(os.path.join(path, fn)):
+                return load_task_graph(os.path.join(path, fn))
+        raise ValueError("{} has neither {} nor plan.yml".format(path, FILENAME))
+    if path.endswith('.json'):
+        graph = load_graph(path)[0]
+        collapse_noarch_python_nodes(graph)
+        return graph
+    return _plan_graph(path)
@@ -0,0 +1,98 @@
+"""
+Local snapshots of the channel index.
+
+Computing a build graph needs the index (repodata) of the channels for every platform.
+Downloading it on every run is slow, doesn't work without network access, and makes the result
+depend on when the run happened.  A snapshot is a folder holding one compressed pickle of the
+index per subdir, plus a small json manifest describing where it came from:
+
+    snapshot/
+        snapshot.json
+        linux-64.pkl.gz
+        win-64.pkl.gz
+"""
+
+import gzip
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+import conda_build.api
+from conda_build.index import get_build_index
+
+log = logging.getLogger(__file__)
+
+MANIFEST = 'snapshot.json'
+FORMAT_VERSION = 1
+
+# loaded indexes, by (path, mtime).  Batches compute many graphs against the same snapshot.
+_loaded = {}
+
+
+def _index_path(snapshot_dir, subdir):
+    return os.path.join(snapshot_dir, subdir + '.pkl.gz')
+
+
+def read_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.isfile(path):
+        raise ValueError("{} is not an index snapshot (no {} found).  Create one with "
+                         "'c3i index-snapshot'".format(snapshot_dir, MANIFEST))
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError("index snapshot {} has format {}, but this version of c3i reads format "
+                         "{}.  Please create it again.".format(snapshot_dir,
+                                                              manifest.get('format'),
+                                                              FORMAT_VERSION))
+    return manifest
+
+
+def save_snapshot(snapshot_dir, subdirs, channels=None, bldpkgs_dir=None):
+    """Fetch the index of channels for each of subdirs and store it in snapshot_dir"""
+    channels = list(channels or [])
+    bldpkgs_dir = bldpkgs_dir or conda_build.api.Config().bldpkgs_dir
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for subdir in subdirs:
+        print("fetching index of {} for {}".format(', '.join(channels) or 'default channels',
+                                                  subdir))
+        index = get_build_index(subdir=subdir, bldpkgs_dir=bldpkgs_dir, channel_urls=channels)[0]
+        path = _index_path(snapshot_dir, subdir)
+        fd, tmp = tempfile.mkstemp(dir=snapshot_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb',
+                                                       compresslevel=6) as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        print("wrote {} records to {}".format(len(index), path))
+    manifest = {'format': FORMAT_VERSION,
+                'channels': channels,
+                'subdirs': sorted(subdirs),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'conda-build': conda_build.__version__}
+    with open(os.path.join(snapshot_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_index(snapshot_dir, subdir, channels=None):
+    """Load the index of subdir from snapshot_dir.
+
+    If channels are given and differ from the channels the snapshot was made from, a warning is
+    logged; the snapshot is used regardless."""
+    manifest = read_manifest(snapshot_dir)
+    if channels is not None and list(channels) != manifest['channels']:
+        log.warn("index snapshot %s was made from channels %s, not %s", snapshot_dir,
+                 manifest['channels'], list(channels))
+    path = _index_path(snapshot_dir, subdir)
+    if not os.path.isfile(path):
+        raise ValueError("index snapshot {} has no index for {}.  It has {}.".format(
+            snapshot_dir, subdir, ', '.join(manifest['subdirs'])))
+    key = (os.path.abspath(path), os.stat(path).st_mtime)
+    if key not in _loaded:
+        with gzip.open(path, 'rb') as f:
+            _loaded[key] = pickle.load(f)
+    # Resolve may hold on to (and add to) the index it is given
+    return dict(_loaded[key])
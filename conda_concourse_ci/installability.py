@@ -0,0 +1,103 @@
+"""
+Fast answers to "can conda install a package matching this spec from our channels?"
+
+Checking every dependency of every recipe against the channel index is one of the hot loops of
+graph computation.  An InstallabilityIndex wraps the Resolve object of one platform, keeps its
+records grouped by package name, evaluates specs in batches and remembers the result for each
+(normalized) spec string, no matter which recipe or config asked for it.
+"""
+
+import weakref
+from collections import OrderedDict
+
+from conda_build import conda_interface
+
+
+def normalize_spec(spec):
+    """Canonical form of a spec string, so that equivalent specs share a cache entry"""
+    return ' '.join(spec.split())
+
+
+class InstallabilityIndex(object):
+    """
+    Installability lookups against the records of a single Resolve object
+
+    Parameters
+    ----------
+    conda_resolve : conda Resolve
+        channel index of the platform to answer for
+    """
+
+    def __init__(self, conda_resolve):
+        # a weak reference, so that a cache of indexes by Resolve doesn't keep the Resolve alive
+        self._resolve = weakref.ref(conda_resolve)
+        self._groups = None
+        self._matches = {}
+        # specs evaluated by prime that haven't been looked up yet
+        self._primed = set()
+        # not installable specs that were reported (see compute_build_graph._installable)
+        self.warned = set()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conda_resolve(self):
+        return self._resolve()
+
+    @property
+    def groups(self):
+        """Records of the index, grouped by package name.  Built on first use."""
+        if self._groups is None:
+            groups = getattr(self.conda_resolve, 'groups', None)
+            if groups is None:
+                groups = {}
+                for record in self.conda_resolve.index.values():
+                    groups.setdefault(record.name, []).append(record)
+            self._groups = groups
+        return self._groups
+
+    def __contains__(self, spec):
+        return normalize_spec(spec) in self._matches
+
+    def _evaluate(self, specs):
+        # group by name, so that the candidates of each name are looked up once
+        by_name = OrderedDict()
+        for spec in specs:
+            ms = conda_interface.MatchSpec(spec)
+            by_name.setdefault(ms.name, []).append((spec, ms))
+        for name, name_specs in by_name.items():
+            candidates = self.groups.get(name, ())
+            for spec, ms in name_specs:
+                self._matches[spec] = tuple(record for record in candidates if ms.match(record))
+
+    def prime(self, specs):
+        """Evaluate all of specs that have not been evaluated yet, in one batch"""
+        todo = []
+        for spec in specs:
+            spec = normalize_spec(spec)
+            if spec not in self._matches and spec not in todo:
+                todo.append(spec)
+        if todo:
+            self._evaluate(todo)
+            self._primed.update(todo)
+        return todo
+
+    def find_matches(self, spec):
+        """The records matching spec (an empty tuple if nothing matches).  The first lookup of a
+        spec counts as a miss, even if prime evaluated it."""
+        spec = normalize_spec(spec)
+        if spec in self._primed:
+            self._primed.discard(spec)
+            self.misses += 1
+        elif spec in self._matches:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._evaluate([spec])
+        return self._matches[spec]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return "installability: {} lookups, {} specs evaluated ({:.0%} hit rate)".format(
+            lookups, len(self._matches), rate)
@@ -0,0 +1,226 @@
+"""
+Running a plan on the local machine, without Concourse.
+
+compute_builds writes, into its output folder, a recipe folder for every node of the task
+graph (with the conda_build_config.yaml of its variant), the order of the nodes for each worker
+label (output_order_<label>) and the task graph itself (graph.json, or plan.yml).  local_run
+builds those nodes with conda-build, running up to a given number of builds at the same time.
+A node starts once all the nodes it depends on have been built.
+
+On Concourse, the consolidate task of a job gathers the packages built by the jobs it depends
+on into an indexed channel (indexed-artifacts) that the build uses.  Here, every node gets such
+a channel in its work folder, made from the packages its dependencies built.  Each node's
+conda-build log, packages and stats file (see the stats module) are kept in the work folder:
+
+    <work_dir>/
+        <node>/
+            build.log
+            indexed-artifacts/
+            output-artifacts/
+        stats/<node>_<time>.json
+"""
+
+import glob
+import logging
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+
+import conda_build.api
+import networkx as nx
+
+from .graph_artifact import load_task_graph
+from .stats import format_duration
+
+log = logging.getLogger(__file__)
+
+ORDER_PREFIX = 'output_order_'
+# output_order_recipes_<label> lists recipe folders, not nodes
+RECIPES_ORDER_PREFIX = 'output_order_recipes_'
+PACKAGE_EXTENSIONS = ('.tar.bz2', '.conda')
+
+SUCCEEDED, FAILED, SKIPPED = 'succeeded', 'failed', 'skipped'
+
+
+def read_output_order(output_dir, labels=None):
+    """The nodes of the output_order_<label> files in output_dir, in order.  labels are glob
+    patterns selecting the labels to read; all of them by default."""
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(output_dir, ORDER_PREFIX + '*'))):
+        fn = os.path.basename(path)
+        if fn.startswith(RECIPES_ORDER_PREFIX):
+            continue
+        label = fn[len(ORDER_PREFIX):]
+        if labels and not any(fnmatch(label, pattern) for pattern in labels):
+            continue
+        with open(path) as f:
+            nodes.extend(line.strip() for line in f if line.strip())
+    return nodes
+
+
+def _packages(folder):
+    """Packages in the subdir folders of folder"""
+    return [path for path in glob.glob(os.path.join(folder, '*', '*'))
+            if path.endswith(PACKAGE_EXTENSIONS)]
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def consolidate(channel_dir, prereq_dirs):
+    """Gather the packages in the output-artifacts of prereq_dirs into channel_dir and index
+    it, like the consolidate task of a Concourse job"""
+    if os.path.isdir(channel_dir):
+        shutil.rmtree(channel_dir)
+    os.makedirs(os.path.join(channel_dir, 'noarch'))
+    for prereq_dir in prereq_dirs:
+        for package in _packages(os.path.join(prereq_dir, 'output-artifacts')):
+            subdir = os.path.join(channel_dir, os.path.basename(os.path.dirname(package)))
+            os.makedirs(subdir, exist_ok=True)
+            _link_or_copy(package, os.path.join(subdir, os.path.basename(package)))
+    conda_build.api.update_index(channel_dir)
+
+
+def build_command(recipe_dir, node_dir, stats_file, channels=(), test_only=False,
+                  artifacts_channel=None, pass_throughs=None):
+    """The conda-build command that builds (or tests) the recipe in recipe_dir, like the one
+    get_build_task runs on Concourse"""
+    cmd = ['conda-build', '--no-anaconda-upload',
+           '--output-folder', os.path.join(node_dir, 'output-artifacts'),
+           '--croot', os.path.join(node_dir, 'croot'),
+           '--stats-file', stats_file]
+    if test_only:
+        cmd.append('--test')
+    for channel in channels:
+        cmd.extend(['-c', channel])
+    if artifacts_channel:
+        cmd.extend(['-c', artifacts_channel])
+    cmd.extend(pass_throughs or [])
+    cmd.append(recipe_dir)
+    return cmd
+
+
+class LocalRun(object):
+    """Builds the nodes of a compute_builds output folder locally.  See local_run."""
+
+    def __init__(self, output_dir, work_dir=None, labels=None, channels=None,
+                 pass_throughs=None):
+        self.output_dir = os.path.abspath(output_dir)
+        self.work_dir = os.path.abspath(work_dir or os.path.join(self.output_dir, 'local-run'))
+        self.order = read_output_order(self.output_dir, labels)
+        if not self.order:
+            raise ValueError("{} has no output_order files{}".format(
+                output_dir, " for " + ", ".join(labels) if labels else ""))
+        graph = load_task_graph(self.output_dir)
+        missing = [node for node in self.order if node not in graph]
+        if missing:
+            raise ValueError("the task graph in {} does not have {}".format(
+                output_dir, ', '.join(missing)))
+        self.graph = graph.subgraph(self.order).copy()
+        for node in self.order:
+            for prereq in graph.successors(node):
+                if prereq not in self.graph:
+                    log.warn("%s depends on %s, which is not run here.  It has to be available "
+                             "from the channels.", node, prereq)
+        self.channels = list(channels or [])
+        self.pass_throughs = list(pass_throughs or [])
+
+    def _channels(self, node):
+        record = self.graph.nodes[node].get('record')
+        return list(record.channel_urls if record else []) + self.channels
+
+    def command(self, node):
+        node_dir = os.path.join(self.work_dir, node)
+        prereqs = list(self.graph.successors(node))
+        return build_command(
+            os.path.join(self.output_dir, node), node_dir,
+            os.path.join(self.work_dir, 'stats', '{}_{}.json'.format(node, int(time.time()))),
+            channels=self._channels(node),
+            test_only=self.graph.nodes[node].get('test_only', False),
+            artifacts_channel=os.path.join(node_dir, 'indexed-artifacts') if prereqs else None,
+            pass_throughs=self.pass_throughs)
+
+    def run_node(self, node):
+        """Build node.  Returns whether conda-build succeeded."""
+        node_dir = os.path.join(self.work_dir, node)
+        if os.path.isdir(os.path.join(node_dir, 'output-artifacts')):
+            shutil.rmtree(os.path.join(node_dir, 'output-artifacts'))
+        os.makedirs(node_dir, exist_ok=True)
+        os.makedirs(os.path.join(self.work_dir, 'stats'), exist_ok=True)
+        prereqs = list(self.graph.successors(node))
+        if prereqs:
+            consolidate(os.path.join(node_dir, 'indexed-artifacts'),
+                        [os.path.join(self.work_dir, prereq) for prereq in prereqs])
+        with open(os.path.join(node_dir, 'build.log'), 'wb') as f:
+            return subprocess.call(self.command(node), stdout=f, stderr=subprocess.STDOUT) == 0
+
+    def run(self, jobs=1, keep_going=True):
+        """Build every node, up to jobs at a time.  Nodes whose dependencies failed are
+        skipped.  Unless keep_going, no new builds start after a failure.  Returns the status
+        and duration (in seconds) of each node, by node."""
+        jobs = max(jobs, 1)
+        position = {node: i for i, node in enumerate(self.order)}
+        waiting = {node: self.graph.out_degree(node) for node in self.order}
+        ready = [node for node in self.order if not waiting[node]]
+        results = {}
+        started = {}
+        running = {}
+        stop = False
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while ready or running:
+                while ready and len(running) < jobs and not stop:
+                    node = ready.pop(0)
+                    print("building {}".format(node))
+                    started[node] = time.time()
+                    running[pool.submit(self.run_node, node)] = node
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception as e:
+                        log.warn("Unable to build %s. Error was: %s", node, e)
+                        succeeded = False
+                    elapsed = time.time() - started[node]
+                    if succeeded:
+                        results[node] = (SUCCEEDED, elapsed)
+                        print("{} succeeded in {}".format(node, format_duration(elapsed)))
+                        for dependent in self.graph.predecessors(node):
+                            waiting[dependent] -= 1
+                            if not waiting[dependent]:
+                                ready.append(dependent)
+                        ready.sort(key=position.get)
+                    else:
+                        results[node] = (FAILED, elapsed)
+                        print("{} failed in {}.  See {}".format(
+                            node, format_duration(elapsed),
+                            os.path.join(self.work_dir, node, 'build.log')))
+                        stop = not keep_going
+                        for dependent in nx.ancestors(self.graph, node):
+                            results.setdefault(dependent, (SKIPPED, 0))
+        for node in self.order:
+            results.setdefault(node, (SKIPPED, 0))
+        return results
+
+
+def format_summary(results, order):
+    """A summary of the results of LocalRun.run, as text"""
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    lines = ['{} succeeded, {} failed, {} skipped'.format(
+        counts.get(SUCCEEDED, 0), counts.get(FAILED, 0), counts.get(SKIPPED, 0))]
+    for node in order:
+        status, elapsed = results[node]
+        if status != SUCCEEDED:
+            lines.append('  {}: {}'.format(node, status))
+    return '\n'.join(lines)
@@ -0,0 +1,134 @@
+"""
+Compact records of the nodes of a task graph.
+
+While the graph is being computed, each node carries the conda-build MetaData it was rendered
+from, which holds the full config, all variants and the parsed recipe.  Once the graph is
+complete, writing the plan only needs a handful of values from it.
+compute_build_graph.compact_graph replaces the MetaData of every node by a NodeRecord holding
+just those, which keeps big graphs (and the graphs sent back by platform worker processes)
+small.  Records are also what the saved graph artifact (see graph_artifact) is made of.
+"""
+
+import os
+
+import conda_build.api
+
+from .utils import ensure_list
+
+
+class NodeRecord(object):
+    """What writing the plan needs to know about a node of the task graph"""
+
+    __slots__ = ('name', 'version', 'package_name', 'used_vars', 'variant', 'subdir',
+                 'host_subdir', 'meta_path', 'squished_variants', 'channel_urls', 'noarch',
+                 'worker_tags', 'build', 'build_number', 'outputs', 'deps')
+
+    def __init__(self, name, version, package_name, used_vars, variant, subdir, host_subdir,
+                 meta_path, squished_variants, channel_urls, noarch, worker_tags,
+                 build=None, build_number=0, outputs=(), deps=()):
+        self.name = name
+        self.version = version
+        # the name of the top-level package of the recipe
+        self.package_name = package_name
+        # the loop variables (of the variant) the package uses
+        self.used_vars = used_vars
+        # the values of used_vars and of target_platform
+        self.variant = variant
+        self.subdir = subdir
+        self.host_subdir = host_subdir
+        self.meta_path = meta_path
+        self.squished_variants = squished_variants
+        self.channel_urls = channel_urls
+        self.noarch = noarch
+        self.worker_tags = worker_tags
+        # what dependencies on this node are matched against: its build string (without hash
+        #    placeholders), build number and the names of all of the recipe's outputs
+        self.build = build
+        self.build_number = build_number
+        self.outputs = outputs
+        # the dependency specs of the node, as strings
+        self.deps = deps
+
+    @classmethod
+    def from_metadata(cls, metadata, build=None, deps=()):
+        used_vars = tuple(metadata.get_used_loop_vars())
+        variant = {k: metadata.config.variant[k] for k in used_vars
+                   if k in metadata.config.variant}
+        if 'target_platform' in metadata.config.variant:
+            variant['target_platform'] = metadata.config.variant['target_platform']
+        meta_path = metadata.meta_path
+        if not meta_path:
+            meta_path = os.path.join(
+                metadata.meta.get('extra', {}).get('parent_recipe', {}).get('path', ''),
+                'meta.yaml')
+        outputs = set([metadata.name()])
+        outputs.update(output['name'] for output in metadata.meta.get('outputs') or ()
+                       if isinstance(output, dict) and output.get('name'))
+        return cls(name=metadata.name(),
+                   version=metadata.version(),
+                   package_name=metadata.meta['package']['name'],
+                   used_vars=used_vars,
+                   variant=variant,
+                   subdir=metadata.config.subdir,
+                   host_subdir=metadata.config.host_subdir,
+                   meta_path=meta_path,
+                   squished_variants=metadata.config.squished_variants,
+                   channel_urls=tuple(metadata.config.channel_urls),
+                   noarch=metadata.noarch,
+                   worker_tags=tuple(ensure_list(
+                       metadata.meta.get('extra', {}).get('worker_tags'))),
+                   build=build,
+                   build_number=int(metadata.build_number() or 0),
+                   outputs=tuple(sorted(outputs)),
+                   deps=tuple(deps))
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d):
+        d = dict(d)
+        # json has no tuples
+        for key in ('used_vars', 'channel_urls', 'worker_tags', 'outputs', 'deps'):
+            d[key] = tuple(d[key])
+        return cls(**d)
+
+    @property
+    def recipe_dir(self):
+        return os.path.dirname(self.meta_path)
+
+    def metadata(self):
+        """Render the MetaData of this node again.  This is expensive; only use it where the
+        values of the record are not enough."""
+        kwargs = {}
+        if '-' in (self.host_subdir or ''):
+            # for the platform the node was rendered for, like _get_or_render_metadata does
+            kwargs['platform'], kwargs['arch'] = self.host_subdir.rsplit('-', 1)
+        rendered = conda_build.api.render(self.recipe_dir, variants=self.squished_variants,
+                                          channel_urls=list(self.channel_urls),
+                                          finalize=False, bypass_env_check=True, **kwargs)
+        for (m, _, _) in rendered:
+            if m.name() == self.name and all(m.config.variant.get(k) == v
+                                             for k, v in self.variant.items()):
+                return m
+        raise ValueError("rendering {} again did not produce {} for variant {}".format(
+            self.recipe_dir, self.name, self.variant))
+
+    def __repr__(self):
+        return 'NodeRecord({}-{} for {})'.format(self.name, self.version, self.host_subdir)
+
+
+def node_record(graph, node):
+    """The NodeRecord of node, whether or not the graph has been compacted"""
+    data = graph.nodes[node]
+    if 'record' in data:
+        return data['record']
+    return NodeRecord.from_metadata(data['meta'])
+
+
+def node_metadata(graph, node):
+    """The MetaData of node, rendered again if the graph has been compacted"""
+    data = graph.nodes[node]
+    if 'meta' in data:
+        return data['meta']
+    return data['record'].metadata()
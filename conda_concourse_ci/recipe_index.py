@@ -0,0 +1,358 @@
+"""
+Cheap, static inspection of recipes.
+
+Rendering a recipe with conda-build is expensive.  Often all we need to know is which packages a
+recipe folder can produce, and that is usually spelled out literally (or through simple
+``{% set %}`` variables) in meta.yaml.  The functions here read meta.yaml as text, fill in what
+can be filled in without rendering, and give up (returning None) on anything that is not clear.
+Callers must treat None as "unknown" and fall back to rendering.
+
+What depends on the platform or the variant is not clear: values on lines with selectors or
+inside control blocks, keys that appear more than once (one for each selector, usually) and
+variables that are set more than once or inside control blocks are all UNKNOWN.
+"""
+
+import logging
+import os
+import re
+
+import yaml
+
+log = logging.getLogger(__file__)
+
+# {% set name = "foo" %}
+_SET_RE = re.compile(r'''{%-?\s*set\s+(\w+)\s*=\s*(["'])((?:(?!\2).)*)\2\s*-?%}''')
+# any {% set %}, whatever its value
+_ANY_SET_RE = re.compile(r'{%-?\s*set\s+(\w+)\s*=')
+# the statements of {% if ... %} and {% for ... %} blocks
+_CONTROL_RE = re.compile(r'{%-?\s*(if|for|elif|else|endif|endfor)\b')
+# a selector: # [win]
+_SELECTOR_RE = re.compile(r'#\s*\[.*\]')
+# key: value, or - key: value in a list
+_SCALAR_LINE_RE = re.compile(r'^(\s*(?:-\s+)?[\w.-]+:)[ \t]+[^\s#|>].*$')
+# {{ name }}, {{ name|lower }}, {{ name | replace("_", "-") }}
+_EXPR_RE = re.compile(r'{{-?\s*(.*?)\s*-?}}')
+_STATEMENT_RE = re.compile(r'{%.*?%}', re.DOTALL)
+_COMMENT_RE = re.compile(r'{#.*?#}', re.DOTALL)
+_FILTER_RE = re.compile(r'''^(\w+)\s*\(\s*(?:(["'])(.*?)\2\s*,\s*(["'])(.*?)\4)?\s*\)$|^(\w+)$''')
+# {{ pin_compatible("numpy", max_pin="x.x") }}, {{ compiler('c') }}
+_CALL_RE = re.compile(r'''^(\w+)\s*\(\s*(["'])(.*?)\2''')
+# stands in for jinja expressions we cannot evaluate
+UNKNOWN = '__c3i_unknown__'
+# stands in for {{ compiler(...) }}, which renders to <compiler>_<target platform>
+COMPILER = '__c3i_compiler__'
+_COMPILER_NAME_RE = re.compile(r'.+_(?:linux|osx|win)-\w+$')
+
+
+def find_meta_yaml(recipe_dir):
+    """Return the path to meta.yaml in either recipe_dir or recipe_dir/recipe (the conda-forge
+    feedstock layout), or None"""
+    for path in (os.path.join(recipe_dir, 'meta.yaml'),
+                 os.path.join(recipe_dir, 'recipe', 'meta.yaml')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _apply_filter(value, filter_expr):
+    match = _FILTER_RE.match(filter_expr.strip())
+    if not match:
+        return None
+    name = match.group(1) or match.group(6)
+    if name == 'lower':
+        return value.lower()
+    if name == 'upper':
+        return value.upper()
+    if name == 'replace' and match.group(3) is not None:
+        return value.replace(match.group(3), match.group(5))
+    return None
+
+
+def _evaluate(expr, variables):
+    """Evaluate a jinja expression if it is a (quoted) string or a known variable, possibly
+    followed by simple filters.  Returns None if it can't be evaluated.
+
+    Of the functions conda-build provides, only the package name that pin_compatible and
+    pin_subpackage render to is evaluated, and compiler becomes COMPILER."""
+    call = _CALL_RE.match(expr.strip())
+    if call and call.group(1) in ('pin_compatible', 'pin_subpackage'):
+        return call.group(3)
+    if call and call.group(1) == 'compiler':
+        return COMPILER
+    parts = [part.strip() for part in expr.split('|')]
+    head = parts[0]
+    if len(head) > 1 and head[0] == head[-1] and head[0] in ('"', "'"):
+        value = head[1:-1]
+    elif head in variables:
+        value = variables[head]
+    else:
+        return None
+    for filter_expr in parts[1:]:
+        value = _apply_filter(value, filter_expr)
+        if value is None:
+            return None
+    return value
+
+
+class _Loader(yaml.SafeLoader):
+    """SafeLoader that makes the value of a key that appears more than once UNKNOWN, rather
+    than keeping the last one"""
+
+
+def _construct_mapping(loader, node, deep=False):
+    loader.flatten_mapping(node)
+    mapping = {}
+    for key_node, value_node in node.value:
+        key = loader.construct_object(key_node, deep=deep)
+        value = loader.construct_object(value_node, deep=deep)
+        mapping[key] = UNKNOWN if key in mapping else value
+    return mapping
+
+
+_Loader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_mapping)
+
+
+def _uncertain_lines(text):
+    """Make the values of the key: value lines of text that carry a selector, are inside a
+    control block or hold a control statement UNKNOWN.  Returns the new text and the names of
+    the variables that are set more than once, inside a control block or on a line with a
+    selector."""
+    assignments = {}
+    uncertain = set()
+    depth = 0
+    lines = []
+    for line in text.splitlines():
+        selector = bool(_SELECTOR_RE.search(line))
+        conditional = selector or depth > 0
+        for statement in _STATEMENT_RE.findall(line):
+            control = _CONTROL_RE.match(statement)
+            if control:
+                conditional = True
+                if control.group(1) in ('if', 'for'):
+                    depth += 1
+                elif control.group(1) in ('endif', 'endfor'):
+                    depth = max(depth - 1, 0)
+                continue
+            for name in _ANY_SET_RE.findall(statement):
+                assignments[name] = assignments.get(name, 0) + 1
+                if depth or selector:
+                    uncertain.add(name)
+        match = _SCALAR_LINE_RE.match(line) if conditional else None
+        lines.append(match.group(1) + ' ' + UNKNOWN if match else line)
+    uncertain.update(name for name, count in assignments.items() if count > 1)
+    return '\n'.join(lines), uncertain
+
+
+def static_meta(meta_yaml_text):
+    """Parse meta.yaml text into a dict without rendering it.
+
+    Jinja expressions that can't be evaluated statically are replaced by UNKNOWN, control
+    statements are dropped and selectors are ignored (so lists contain the entries for all
+    platforms), except that values which depend on them are UNKNOWN (see the module
+    docstring).  Returns None if the result is not valid yaml.
+    """
+    text = _COMMENT_RE.sub('', meta_yaml_text)
+    text, uncertain = _uncertain_lines(text)
+    variables = {}
+    for name, _, value in _SET_RE.findall(text):
+        if name not in uncertain:
+            variables[name] = value
+
+    def _substitute(match):
+        value = _evaluate(match.group(1), variables)
+        return UNKNOWN if value is None else value
+
+    text = _STATEMENT_RE.sub('', text)
+    text = _EXPR_RE.sub(_substitute, text)
+    try:
+        meta = yaml.load(text, Loader=_Loader)
+    except (yaml.YAMLError, TypeError):
+        # TypeError: keys that can't be dict keys
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def _known(value):
+    return isinstance(value, str) and value and UNKNOWN not in value
+
+
+def output_names(meta):
+    """Names of all packages that the statically parsed meta.yaml produces, or None if any of
+    them are unknown"""
+    names = []
+    package = meta.get('package') or {}
+    outputs = meta.get('outputs') or []
+    if not isinstance(package, dict) or not isinstance(outputs, list):
+        return None
+    if 'name' in package:
+        names.append(package['name'])
+    for output in outputs:
+        if not isinstance(output, dict):
+            return None
+        names.append(output.get('name'))
+    if not names or not all(_known(name) for name in names):
+        return None
+    return names
+
+
+def requirement_names(meta):
+    """Names of all of the requirements (build, host, run and test, of the recipe and of its
+    outputs) in a statically parsed meta.yaml.  As selectors are ignored, this includes the
+    requirements of all platforms.
+
+    Names that can't be determined are included as UNKNOWN, and compilers as COMPILER."""
+    names = set()
+    sections = [meta] + [output for output in (meta.get('outputs') or [])
+                         if isinstance(output, dict)]
+    for section in sections:
+        requirements = section.get('requirements') or {}
+        if isinstance(requirements, dict):
+            lists = [requirements.get(key) for key in ('build', 'host', 'run')]
+        else:
+            # outputs can list their requirements directly
+            lists = [requirements]
+        test = section.get('test') or {}
+        if isinstance(test, dict):
+            lists.append(test.get('requires'))
+        for lst in lists:
+            if lst is not None and not isinstance(lst, list):
+                names.add(UNKNOWN)
+                continue
+            for requirement in lst or ():
+                if not isinstance(requirement, str) or not requirement.split():
+                    names.add(UNKNOWN)
+                    continue
+                name = requirement.split()[0]
+                if UNKNOWN in name:
+                    names.add(UNKNOWN)
+                elif COMPILER in name:
+                    names.add(COMPILER)
+                else:
+                    names.add(name)
+    return names
+
+
+def static_versions(meta):
+    """Dict of output name: version for the outputs of a statically parsed meta.yaml whose
+    version is spelled out as a string.  Versions that yaml reads as numbers are left out, since
+    the number may not be what conda-build makes of them (1.10 becomes 1.1), and so are
+    versions that depend on selectors or control blocks (see static_meta)."""
+    versions = {}
+    package = meta.get('package') or {}
+    outputs = meta.get('outputs') or []
+    if not isinstance(package, dict) or not isinstance(outputs, list):
+        return versions
+    version = package.get('version')
+    if 'name' in package and _known(package['name']) and _known(version):
+        versions[package['name']] = version
+    for output in outputs:
+        if isinstance(output, dict) and _known(output.get('name')):
+            # outputs without a version of their own have the version of the package
+            output_version = output.get('version', version)
+            if _known(output_version):
+                versions[output['name']] = output_version
+    return versions
+
+
+def static_recipe(recipe_dir):
+    """The statically parsed meta.yaml of the recipe in recipe_dir, or None"""
+    meta_yaml = find_meta_yaml(recipe_dir)
+    if not meta_yaml:
+        return None
+    try:
+        with open(meta_yaml) as f:
+            return static_meta(f.read())
+    except (IOError, OSError, UnicodeDecodeError):
+        return None
+
+
+def recipe_output_names(recipe_dir):
+    """Names of the packages produced by the recipe in recipe_dir, or None if that can't be
+    determined without rendering"""
+    meta = static_recipe(recipe_dir)
+    if meta is None:
+        return None
+    return output_names(meta)
+
+
+class RecipeIndex(object):
+    """
+    Map of package names to the recipe folders (relative to recipes_dir) that produce them.
+
+    Folders whose output names can't be determined statically are kept aside.  For those,
+    recipe_dirs falls back to matching the folder name against the package name.
+
+    This doubles as a skeleton of the dependency graph: requirements maps folders to the names
+    of their requirements (see requirement_names), or to None if the folder's meta.yaml could
+    not be parsed, outputs maps folders to the names of their packages (None if unknown) and
+    versions maps folders to the statically known versions of their packages (see
+    static_versions).
+
+    Parameters
+    ----------
+    recipes_dir : str
+        folder containing one recipe (or feedstock) per subfolder
+    """
+
+    def __init__(self, recipes_dir):
+        self.recipes_dir = recipes_dir
+        self.names = {}
+        self.unresolved = []
+        self.requirements = {}
+        self.outputs = {}
+        self.versions = {}
+        for dirname in sorted(os.listdir(recipes_dir)):
+            path = os.path.join(recipes_dir, dirname)
+            if dirname.startswith('.') or not os.path.isdir(path):
+                continue
+            meta = static_recipe(path)
+            self.requirements[dirname] = None if meta is None else requirement_names(meta)
+            self.versions[dirname] = {} if meta is None else static_versions(meta)
+            names = None if meta is None else output_names(meta)
+            self.outputs[dirname] = names
+            if names is None:
+                self.unresolved.append(dirname)
+                continue
+            for name in names:
+                dirs = self.names.setdefault(name, [])
+                if dirname not in dirs:
+                    dirs.append(dirname)
+        log.debug('indexed %d package names in %s; %d folders could not be indexed',
+                  len(self.names), recipes_dir, len(self.unresolved))
+
+    def recipe_dirs(self, name):
+        """Recipe folders that (may) produce the package called name"""
+        dirs = list(self.names.get(name, []))
+        if self.unresolved:
+            packagename_re = re.compile(r'%s(?:\-[0-9]+[\.0-9\_\-a-zA-Z]*)?$' % re.escape(name))
+            dirs.extend(dirname for dirname in self.unresolved if packagename_re.match(dirname))
+        return dirs
+
+    def may_depend_on(self, folder, names):
+        """Could the recipe in folder depend on any of the packages called names?  True unless
+        its requirements, as far as they can be read statically, rule it out."""
+        requirements = self.requirements.get(folder)
+        if requirements is None or UNKNOWN in requirements:
+            return True
+        if COMPILER in requirements and any(_COMPILER_NAME_RE.match(name) for name in names):
+            return True
+        return not requirements.isdisjoint(names)
+
+    def downstream(self, folders, steps=-1):
+        """Folders that may depend, directly or within steps steps (all of them if steps is
+        -1), on the packages produced by folders, including folders themselves.  None if
+        that can't be narrowed down statically."""
+        reachable = set(folders)
+        frontier = list(folders)
+        step = 0
+        while frontier and (steps < 0 or step < steps):
+            step += 1
+            names = set()
+            for folder in frontier:
+                if self.outputs.get(folder) is None:
+                    return None
+                names.update(self.outputs[folder])
+            frontier = [folder for folder in self.requirements
+                        if folder not in reachable and self.may_depend_on(folder, names)]
+            reachable.update(frontier)
+        return reachable
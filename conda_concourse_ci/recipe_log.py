@@ -0,0 +1,190 @@
+"""
+Recipe logs: the git history of the repository a recipe lives in, written to recipe_log.txt next
+to meta.yaml.  Conda-build finds that file and includes it with the package.
+
+The full history of an old feedstock can be megabytes, so logs can be capped to a number of
+commits (and/or a date); by default they hold the complete history.  Logs depend only on the
+commit the repository (or submodule) is at, which is read straight from its .git folder, and on
+those limits, so a log is generated once per commit and otherwise reused without running git at
+all.
+"""
+
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__file__)
+
+# the complete history
+DEFAULT_MAX_COUNT = 0
+
+# generated logs, by cache key
+_logs = {}
+# see _since_time
+_since_times = {}
+# see set_recipe_log_options
+_options = {'max_count': DEFAULT_MAX_COUNT, 'since': None, 'cache_dir': None}
+
+
+def set_recipe_log_options(max_count=DEFAULT_MAX_COUNT, since=None, cache_dir=None):
+    """Limit recipe logs to max_count commits (all of them if max_count is 0 or None), going
+    back no further than since (anything git log --since understands).  If cache_dir is given,
+    generated logs are also kept there, for use by later runs."""
+    _options.update(max_count=max_count, since=since, cache_dir=cache_dir)
+    _since_times.clear()
+
+
+def git_dir(path):
+    """The git dir of the repository or submodule that path is in, or None"""
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            # submodules and worktrees: "gitdir: <path>"
+            with open(dot_git) as f:
+                content = f.read().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            return os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def head_sha(path):
+    """The commit that the repository containing path is at, without running git.  None if it
+    can't be determined."""
+    gd = git_dir(path)
+    if not gd:
+        return None
+    head = _read(os.path.join(gd, 'HEAD'))
+    if not head or not head.startswith('ref:'):
+        # detached
+        return head
+    ref = head[len('ref:'):].strip()
+    # linked worktrees keep their refs in the common dir
+    common = _read(os.path.join(gd, 'commondir'))
+    dirs = [gd] + ([os.path.normpath(os.path.join(gd, common))] if common else [])
+    for d in dirs:
+        sha = _read(os.path.join(d, ref))
+        if sha:
+            return sha
+    for d in dirs:
+        packed = _read(os.path.join(d, 'packed-refs')) or ''
+        for line in packed.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return None
+
+
+def _log_dir(path):
+    if not os.path.exists(os.path.join(path, "meta.yaml")):
+        path = os.path.join(path, "recipe")
+    return path
+
+
+def _since_time(path, since):
+    """since (anything git log --since understands) in seconds since the epoch, as git reads
+    it in the repository of path.  Resolved once per run, so that relative dates ("1 year
+    ago") mean the same for every log of the run, and logs cached by earlier runs are only
+    reused if they go back to the same time."""
+    if not since:
+        return None
+    if since not in _since_times:
+        output = subprocess.check_output(['git', 'rev-parse', '--since={}'.format(since)],
+                                         cwd=path)
+        # --max-age=<seconds>
+        _since_times[since] = int(output.decode('utf-8').strip().split('=', 1)[1])
+    return _since_times[since]
+
+
+def _cache_key(path, max_count, since_time):
+    sha = head_sha(path)
+    if not sha:
+        return None
+    return '-'.join((sha, str(max_count or 0), str(since_time or 0)))
+
+
+def _git_log(path, max_count, since_time):
+    cmd = ['git', 'log']
+    if max_count:
+        cmd.append('--max-count={}'.format(max_count))
+    if since_time:
+        cmd.append('--max-age={}'.format(since_time))
+    return subprocess.check_output(cmd, cwd=path)
+
+
+def _get_log(path, key, max_count, since_time, cache_dir):
+    if key and key in _logs:
+        return _logs[key]
+    cache_file = os.path.join(cache_dir, key + '.txt') if key and cache_dir else None
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            output = f.read()
+    else:
+        output = _git_log(path, max_count, since_time)
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                f.write(output)
+    if key:
+        _logs[key] = output
+    return output
+
+
+def write_recipe_log(path):
+    """Write recipe_log.txt for the recipe in path.  See set_recipe_log_options."""
+    path = _log_dir(path)
+    max_count = _options['max_count']
+    try:
+        since_time = _since_time(path, _options['since'])
+        output = _get_log(path, _cache_key(path, max_count, since_time), max_count, since_time,
+                          _options['cache_dir'])
+        with open(os.path.join(path, "recipe_log.txt"), "wb") as f:
+            f.write(output)
+    except subprocess.CalledProcessError as e:
+        log.warn("Unable to produce recipe git log for %s. Error was: %s",
+                 path, e)
+    except FileNotFoundError as e:
+        log.warn(f"File {path} does not exist. Error was {e}. Skipping.")
+
+
+def write_recipe_logs(paths, jobs=8):
+    """write_recipe_log for each of paths, concurrently.  Recipes in the same repository (and
+    at the same commit) share a log, which is only generated once."""
+    paths = list(paths)
+    groups = {}
+    for path in paths:
+        try:
+            since_time = _since_time(_log_dir(path), _options['since'])
+        except (subprocess.CalledProcessError, OSError):
+            # write_recipe_log reports it
+            key = None
+        else:
+            key = _cache_key(_log_dir(path), _options['max_count'], since_time)
+        groups.setdefault(key, []).append(path)
+    # one path for each log that needs generating.  That fills the cache for the others.
+    first = [group[0] for key, group in groups.items() if key is not None and key not in _logs]
+    first_set = set(first)
+    rest = [path for path in paths if path not in first_set]
+    if jobs > 1 and len(first) > 1:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(first))) as pool:
+            list(pool.map(write_recipe_log, first))
+    else:
+        for path in first:
+            write_recipe_log(path)
+    for path in rest:
+        write_recipe_log(path)
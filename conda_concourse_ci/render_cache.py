@@ -0,0 +1,203 @@
+"""
+A persistent, content-addressed cache of rendered recipes.
+
+Rendering is by far the most expensive part of computing a build graph, and the plan director
+re-renders the same (unchanged) recipes on every run.  This cache stores the pickled output of
+conda-build's render (the list of (MetaData, need_download, need_reparse) tuples) on disk, keyed
+by everything that influences that output:
+
+* the contents of the recipe files
+* the variants (conda_build_config.yaml and friends) that go into the render
+* the worker platform and arch
+* the channel urls
+* the conda and conda-build versions
+
+The cache directory is bounded in size; least recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+import conda_build
+from conda_build import conda_interface
+
+log = logging.getLogger(__file__)
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+# these files are written by c3i itself and have no influence on the rendered recipe
+IGNORED_FILES = ('recipe_log.txt', 'recipe_log.json')
+
+
+def _hash_file(h, path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+
+
+def recipe_content_hash(recipe_path):
+    """Hash of the relative paths and contents of all files in a recipe folder.
+
+    recipe_path can also be the path to a meta.yaml, in which case its folder is hashed.
+    """
+    if os.path.isfile(recipe_path):
+        recipe_path = os.path.dirname(recipe_path)
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(recipe_path):
+        dirs[:] = sorted(d for d in dirs if d != '.git')
+        for fn in sorted(files):
+            if fn in IGNORED_FILES or fn == '.git':
+                continue
+            path = os.path.join(root, fn)
+            h.update(os.path.relpath(path, recipe_path).encode('utf-8') + b'\0')
+            try:
+                _hash_file(h, path)
+            except (IOError, OSError):
+                # broken symlinks and the like.  The name is still part of the hash.
+                pass
+    return h.hexdigest()
+
+
+def _files_hash(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(str(path).encode('utf-8') + b'\0')
+        if path and os.path.isfile(path):
+            _hash_file(h, path)
+    return h.hexdigest()
+
+
+def render_cache_key(recipe_path, worker, config=None, finalize=False):
+    """Compute the cache key for rendering recipe_path on worker with config"""
+    inputs = {
+        'recipe': recipe_content_hash(recipe_path),
+        # MetaData objects remember where their recipe lives, so cached results are not
+        #    relocatable to a different checkout.
+        'path': os.path.abspath(recipe_path),
+        'platform': worker['platform'],
+        'arch': str(worker['arch']),
+        'finalize': finalize,
+        'conda-build': conda_build.__version__,
+        'conda': getattr(conda_interface, 'CONDA_VERSION', None),
+    }
+    if config is not None:
+        inputs.update({
+            'variants': config.variants,
+            'channel_urls': list(config.channel_urls or []),
+            'config_files': _files_hash(
+                list(config.variant_config_files or []) +
+                list(getattr(config, 'exclusive_config_files', None) or []) +
+                [config.clobber_sections_file, config.append_sections_file]),
+        })
+    serialized = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class RenderCache(object):
+    """
+    On-disk cache of rendered recipes
+
+    Parameters
+    ----------
+    cache_dir : str
+        Folder in which to store cache entries.  Created if necessary.
+    max_size : int, optional
+        Maximum total size, in bytes, of the entries in the cache.  The least recently used
+        entries are removed once this is exceeded.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.pkl')
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for fn in files:
+                if fn.endswith('.pkl'):
+                    path = os.path.join(root, fn)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def key(self, recipe_path, worker, config=None, finalize=False):
+        return render_cache_key(recipe_path, worker, config=config, finalize=finalize)
+
+    def get(self, key):
+        """Return the cached render for key, or None if there is no (usable) entry"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception as e:
+            # truncated entries or entries pickled by an incompatible version of conda-build
+            log.warn('discarding unreadable render cache entry %s: %s', path, e)
+            self._remove(path)
+            self.misses += 1
+            return None
+        # mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            log.warn('unable to cache rendered recipe: %s', e)
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size.  A little extra
+        room is freed so that every subsequent put does not have to evict again."""
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = int(self.max_size * 0.9)
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            self._remove(path)
+            size -= entry_size
+        self._size = size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return "render cache: {} hits, {} misses ({:.0%} hit rate)".format(
+            self.hits, self.misses, rate)
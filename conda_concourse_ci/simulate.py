@@ -0,0 +1,155 @@
+"""
+Simulation of how long a plan takes on the workers it runs on.
+
+Concourse starts a job once the jobs it depends on (passed constraints) have succeeded and a
+worker of its platform is free.  Given a task graph (graph.json or the plan.yml next to it, see
+graph_artifact.load_task_graph), the number of workers of each platform and the durations of earlier
+builds (see durations), simulate replays that with a discrete-event simulation: no Concourse
+is needed, and even graphs of thousands of jobs take well under a second.  The result is the
+makespan (the time from the first job starting to the last one finishing), how busy the
+workers of each platform were and the chain of jobs that determined the makespan.
+"""
+
+import heapq
+import logging
+
+import networkx as nx
+
+from .stats import format_duration
+
+log = logging.getLogger(__file__)
+
+# workers per platform, for platforms whose build_platforms.d entry has no "workers"
+DEFAULT_WORKERS = 1
+
+
+class SimulationResult(object):
+    """What simulate found.  Times are in seconds from the start of the pipeline."""
+
+    def __init__(self, makespan, start, end, workers, busy, critical_path, lower_bound):
+        self.makespan = makespan
+        # start and end of each job, by node
+        self.start = start
+        self.end = end
+        # number of workers and seconds of work of each platform, by worker label
+        self.workers = workers
+        self.busy = busy
+        # the chain of jobs that ended last: each started as soon as the one before it ended,
+        #    or waited for a worker
+        self.critical_path = critical_path
+        # the longest chain of jobs in the graph.  No number of workers makes it faster.
+        self.lower_bound = lower_bound
+
+    def utilization(self, label):
+        if not self.makespan or not self.workers.get(label):
+            return 0.0
+        return self.busy.get(label, 0) / (self.workers[label] * self.makespan)
+
+
+def platform_workers(platforms, overrides=None):
+    """The number of workers of each platform, by label.  platforms are the build_platforms.d
+    entries (see execute.parse_platforms); each can say how many workers it has with a "workers"
+    key.  overrides (label: count) take precedence."""
+    workers = {}
+    for platform in platforms:
+        if 'workers' in platform:
+            workers[platform['label']] = int(platform['workers'])
+    workers.update(overrides or {})
+    return workers
+
+
+def simulate(graph, durations, workers, overhead=0, order=None):
+    """Simulate running graph.
+
+    durations are the expected seconds of each node (see durations.estimate_durations), and
+    workers the number of workers by label (platforms that are missing have DEFAULT_WORKERS).
+    overhead is added to every job, for getting resources, consolidating artifacts, etc.
+
+    Jobs that are ready at the same time start in order (see compute_build_graph.order_build),
+    or in the order of the graph's nodes.
+    """
+    if not nx.is_directed_acyclic_graph(graph):
+        raise ValueError("Cycles detected in graph: %s" % nx.find_cycle(graph))
+    position = {node: i for i, node in enumerate(order or graph.nodes())}
+    label = {node: graph.nodes[node]['worker']['label'] for node in graph.nodes()}
+    workers = {lbl: int(workers.get(lbl, DEFAULT_WORKERS)) for lbl in set(label.values())}
+    for lbl, count in workers.items():
+        if count < 1:
+            raise ValueError("platform {} needs at least one worker".format(lbl))
+    duration = {node: float(durations.get(node, 0)) + overhead for node in graph.nodes()}
+
+    waiting = {node: graph.out_degree(node) for node in graph.nodes()}
+    queues = {lbl: [] for lbl in workers}
+    free = dict(workers)
+    start, end = {}, {}
+    running = []
+    now = 0.0
+
+    def make_ready(node):
+        heapq.heappush(queues[label[node]], (now, position[node], node))
+
+    for node in graph.nodes():
+        if not waiting[node]:
+            make_ready(node)
+    while True:
+        for lbl, queue in queues.items():
+            while queue and free[lbl]:
+                node = heapq.heappop(queue)[2]
+                free[lbl] -= 1
+                start[node] = now
+                end[node] = now + duration[node]
+                heapq.heappush(running, (end[node], position[node], node))
+        if not running:
+            break
+        now, _, node = heapq.heappop(running)
+        free[label[node]] += 1
+        for dependent in graph.predecessors(node):
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                make_ready(dependent)
+
+    makespan = max(end.values()) if end else 0.0
+    busy = {}
+    for node, seconds in duration.items():
+        busy[label[node]] = busy.get(label[node], 0) + seconds
+
+    critical_path = []
+    node = max(end, key=lambda n: (end[n], -position[n])) if end else None
+    while node is not None:
+        critical_path.append(node)
+        prereqs = list(graph.successors(node))
+        node = max(prereqs, key=lambda n: (end[n], -position[n])) if prereqs else None
+    critical_path.reverse()
+
+    longest = {}
+    for node in reversed(list(nx.topological_sort(graph))):
+        longest[node] = duration[node] + max(
+            [longest[prereq] for prereq in graph.successors(node)] or [0])
+
+    return SimulationResult(makespan, start, end, workers, busy, critical_path,
+                            max(longest.values()) if longest else 0.0)
+
+
+def format_report(result, graph):
+    """A summary of result (see simulate), as text"""
+    lines = ['{} jobs, makespan {} (the longest chain of jobs takes {})'.format(
+        len(result.end), format_duration(result.makespan),
+        format_duration(result.lower_bound))]
+    lines.append('')
+    lines.append('platform utilization:')
+    width = max([len(label) for label in result.workers] or [0])
+    for label in sorted(result.workers):
+        jobs = sum(1 for node in result.end
+                   if graph.nodes[node]['worker']['label'] == label)
+        lines.append('  {}  {:3d} workers  {:5d} jobs  {:6.1%} busy'.format(
+            label.ljust(width), result.workers[label], jobs, result.utilization(label)))
+    lines.append('')
+    lines.append('critical path:')
+    previous_end = 0.0
+    for node in result.critical_path:
+        waited = result.start[node] - previous_end
+        lines.append('  {}  {} - {}{}'.format(
+            node, format_duration(result.start[node]), format_duration(result.end[node]),
+            '  (waited {} for a worker)'.format(format_duration(waited)) if waited > 0 else ''))
+        previous_end = result.end[node]
+    return '\n'.join(lines)
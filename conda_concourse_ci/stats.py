@@ -0,0 +1,263 @@
+"""
+A local store of build statistics.
+
+Every build and test job passes --stats-file=stats/<node>_<time>.json to conda-build, and the
+stats folder is synced to <intermediate-base-folder>/stats (see
+PipelineConfig.add_rsync_stats).  conda-build writes one entry per step of the run (building
+each output, testing it, ...) with its elapsed time, user and system CPU time, peak memory
+(rss) and disk usage.  ``c3i stats ingest`` reads a copy of those files into a SQLite database,
+one row per file, and ``c3i stats query`` reports the slowest and most memory-hungry recipes
+from it.  Files that are already in the database are not read again, so a growing stats folder
+can be ingested over and over.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+
+log = logging.getLogger(__file__)
+
+SCHEMA_VERSION = 1
+# the first bytes of every SQLite database file
+SQLITE_HEADER = b'SQLite format 3\x00'
+# stats/<node>_<int(time.time())>.json, see execute.get_build_task
+_STATS_FILE_RE = re.compile(r'^(?P<node>.+)_(?P<time>\d+)\.json$')
+# what the nodes (and stats files) of tests start with
+TEST_PREFIXES = ('c3itest-', 'test-')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS builds (
+    file TEXT PRIMARY KEY,
+    node TEXT NOT NULL,
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    test INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    elapsed REAL NOT NULL,
+    cpu_user REAL NOT NULL,
+    cpu_sys REAL NOT NULL,
+    rss INTEGER NOT NULL,
+    disk INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_node ON builds (node, time);
+CREATE INDEX IF NOT EXISTS builds_package ON builds (package, platform);
+"""
+
+# what the query command can sort by: column, description
+SORT_KEYS = {
+    'elapsed': ('elapsed', 'slowest'),
+    'rss': ('rss', 'most memory-hungry'),
+    'disk': ('disk', 'largest on disk'),
+    'cpu': ('cpu_user + cpu_sys', 'most CPU-hungry'),
+}
+
+
+def stats_file_node(fn):
+    """The node and time of the build that wrote the stats file called fn, or None if fn is
+    not the name of a stats file"""
+    match = _STATS_FILE_RE.match(fn)
+    if not match:
+        return None
+    return match.group('node'), int(match.group('time'))
+
+
+def is_stats_db(path):
+    """Whether path is a SQLite file (rather than a stats file or folder)"""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def split_node(node):
+    """The package name, version, variant, worker label and whether it is a test, from a node
+    of the task graph (see compute_build_graph.package_key) or a job of the plan (test-only
+    jobs are test-<key>, see collapse_noarch_python_nodes).  Versions are assumed to start
+    with a digit; nodes that don't look like that get the whole name and an empty version."""
+    prefix = next((prefix for prefix in TEST_PREFIXES if node.startswith(prefix)), '')
+    test = bool(prefix)
+    node = node[len(prefix):]
+    rest, _, platform = node.rpartition('-on-')
+    if not rest:
+        rest, platform = node, ''
+    parts = rest.split('-')
+    for i, part in enumerate(parts[1:], 1):
+        if part[:1].isdigit():
+            return '-'.join(parts[:i]), part, '-'.join(parts[i + 1:]), platform, test
+    return rest, '', '', platform, test
+
+
+def summarize(stats):
+    """Totals of the steps in the stats written by one conda-build run: elapsed time and CPU
+    time add up, memory and disk usage are peaks."""
+    steps = [step for key, step in stats.items() if key != 'total' and isinstance(step, dict)]
+    if isinstance(stats.get('total'), dict) and 'elapsed' in stats['total']:
+        elapsed = float(stats['total']['elapsed'])
+    else:
+        elapsed = sum(float(step.get('elapsed') or 0) for step in steps)
+    return {
+        'elapsed': elapsed,
+        'cpu_user': sum(float(step.get('cpu_user') or 0) for step in steps),
+        'cpu_sys': sum(float(step.get('cpu_sys') or 0) for step in steps),
+        'rss': max([int(step.get('rss') or 0) for step in steps] or [0]),
+        'disk': max([int(step.get('disk') or 0) for step in steps] or [0]),
+    }
+
+
+class BuildStats(object):
+    """
+    Statistics of earlier builds, stored in SQLite
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file.  Created if necessary.
+    """
+
+    def __init__(self, path):
+        if path != ':memory:':
+            path = os.path.abspath(os.path.expanduser(path))
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self._check_schema()
+
+    def _check_schema(self):
+        c = self.connection
+        c.executescript(_SCHEMA)
+        row = c.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None or int(row[0]) != SCHEMA_VERSION:
+            if row is not None:
+                log.warn('build stats %s have an old format; starting from scratch', self.path)
+            with c:
+                c.execute('DELETE FROM builds')
+                c.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)",
+                          (str(SCHEMA_VERSION), ))
+
+    def close(self):
+        self.connection.close()
+
+    def _files(self, paths):
+        """Stats files in paths (files, or folders that are searched recursively) that are not
+        in the database yet"""
+        known = set(row[0] for row in self.connection.execute('SELECT file FROM builds'))
+        for path in paths:
+            if os.path.isfile(path):
+                candidates = [path]
+            else:
+                candidates = (os.path.join(root, fn) for root, _, files in os.walk(path)
+                              for fn in files)
+            for candidate in candidates:
+                fn = os.path.basename(candidate)
+                if fn not in known and stats_file_node(fn):
+                    known.add(fn)
+                    yield candidate
+
+    def _rows(self, paths):
+        for path in self._files(paths):
+            node, when = stats_file_node(os.path.basename(path))
+            try:
+                with open(path) as f:
+                    totals = summarize(json.load(f))
+            except (IOError, OSError, ValueError, TypeError, AttributeError) as e:
+                log.warn("Unable to read build stats from %s. Error was: %s", path, e)
+                continue
+            package, version, variant, platform, test = split_node(node)
+            yield (os.path.basename(path), node, package, version, variant, platform,
+                   int(test), when, totals['elapsed'], totals['cpu_user'], totals['cpu_sys'],
+                   totals['rss'], totals['disk'])
+
+    def ingest(self, paths):
+        """Add the stats files in paths (files, or folders that are searched recursively) that
+        are not in the database yet.  Returns the number of files added."""
+        c = self.connection
+        before = c.total_changes
+        with c:
+            c.executemany('INSERT OR IGNORE INTO builds VALUES '
+                          '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self._rows(paths))
+        return c.total_changes - before
+
+    def durations(self):
+        """The elapsed time of the most recent build of each node, by node.  See
+        durations.load_durations."""
+        rows = self.connection.execute(
+            'SELECT node, elapsed FROM builds AS b WHERE time = '
+            '(SELECT MAX(time) FROM builds WHERE node = b.node)')
+        return dict(rows)
+
+    def top(self, sort='elapsed', limit=20, platform=None, package=None, include_tests=False):
+        """The recipes (package and platform) that are highest in sort (a key of SORT_KEYS),
+        highest first.  Each is a dict with the number of builds, the version of the most
+        recent one, and the mean and maximum of elapsed, cpu, rss and disk."""
+        column = SORT_KEYS[sort][0]
+        conditions, args = [], []
+        if platform:
+            conditions.append('platform = ?')
+            args.append(platform)
+        if package:
+            conditions.append('package = ?')
+            args.append(package)
+        if not include_tests:
+            conditions.append('test = 0')
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        query = """
+            SELECT package, platform, COUNT(*), MAX(time),
+                   AVG(elapsed), MAX(elapsed), AVG(cpu_user + cpu_sys), MAX(cpu_user + cpu_sys),
+                   AVG(rss), MAX(rss), AVG(disk), MAX(disk),
+                   (SELECT version FROM builds AS latest
+                    WHERE latest.package = b.package AND latest.platform = b.platform
+                    ORDER BY time DESC LIMIT 1)
+            FROM builds AS b {where}
+            GROUP BY package, platform
+            ORDER BY MAX({column}) DESC, package, platform
+            LIMIT ?""".format(where=where, column=column)
+        result = []
+        for row in self.connection.execute(query, args + [limit]):
+            result.append({'package': row[0], 'platform': row[1], 'builds': row[2],
+                           'latest': row[3], 'version': row[12],
+                           'elapsed': (row[4], row[5]), 'cpu': (row[6], row[7]),
+                           'rss': (row[8], row[9]), 'disk': (row[10], row[11])})
+        return result
+
+
+def format_duration(seconds):
+    """seconds as h:mm:ss"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+def _size(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024.0
+    return '{:.1f}TB'.format(n)
+
+
+def format_top(rows, sort='elapsed'):
+    """A table of rows (see BuildStats.top), as text"""
+    lines = ['{} recipes:'.format(SORT_KEYS[sort][1])]
+    if not rows:
+        lines.append('  (no builds)')
+        return '\n'.join(lines)
+    header = ('package', 'version', 'platform', 'builds', 'time (max)', 'cpu (max)',
+              'rss (max)', 'disk (max)')
+    table = [header] + [(row['package'], row['version'], row['platform'], str(row['builds']),
+                         format_duration(row['elapsed'][1]), format_duration(row['cpu'][1]),
+                         _size(row['rss'][1]), _size(row['disk'][1]))
+                        for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    for line in table:
+        lines.append('  ' + '  '.join(value.ljust(width)
+                                      for value, width in zip(line, widths)).rstrip())
+    return '\n'.join(lines)
@@ -14,6 +14,7 @@ from conda_build import api
 
 from six.moves.urllib import parse
 
+from .node_record import node_metadata
 from .utils import ensure_list, load_yaml_config_dir
 
 log = logging.getLogger(__file__)
@@ -152,7 +153,7 @@ def upload_commands(package_path, commands, config_vars, **file_contents):
 
 def get_upload_tasks(graph, node, upload_config_path, config_vars, commit_id, public=True):
     upload_tasks = []
-    meta = graph.nodes[node]['meta']
+    meta = node_metadata(graph, node)
     worker = graph.nodes[node]['worker']
     configurations = load_yaml_config_dir(upload_config_path)
     for package in api.get_output_file_paths(meta):
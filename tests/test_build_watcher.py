@@ -0,0 +1,157 @@
+import threading
+
+import pytest
+import requests
+
+from conda_concourse_ci import build_watcher
+
+
+class FakeResponse(object):
+    def __init__(self, data=None, lines=(), status_code=200, block=None):
+        self.data = data
+        self.lines = lines
+        self.status_code = status_code
+        self.block = block
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+    def iter_lines(self, decode_unicode=False):
+        if self.block:
+            self.block.wait(5)
+        for line in self.lines:
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _build(build_id, status, pipeline_name='pipeline'):
+    return {'id': build_id, 'status': status, 'pipeline_name': pipeline_name}
+
+
+@pytest.fixture
+def server(mocker):
+    """Fake builds, by id, and events, by build id"""
+    builds, events = {}, {}
+
+    def get(url, params=None, **kwargs):
+        path = url[len('https://ci.example.com/'):]
+        if path == 'api/v1/builds':
+            ids = sorted(builds, reverse=True)
+            if 'since' in params:
+                ids = sorted(i for i in ids if i > params['since'])[:params['limit']]
+                ids.reverse()
+            return FakeResponse([builds[i] for i in ids[:params['limit']]])
+        build_id = int(path.split('/')[3])
+        if path.endswith('/events'):
+            return events.get(build_id, FakeResponse(status_code=403))
+        return FakeResponse(builds[build_id])
+
+    server = mocker.MagicMock(builds=builds, events=events)
+    server.get.side_effect = get
+    mocker.patch.object(build_watcher.requests, 'Session', return_value=server)
+    return server
+
+
+def _join():
+    """Wait for the event streams to be read"""
+    for thread in threading.enumerate():
+        if thread.name.startswith('build-'):
+            thread.join(5)
+
+
+def test_refresh_is_incremental(server):
+    for i in range(1, 8):
+        server.builds[i] = _build(i, 'succeeded')
+    server.builds[8] = _build(8, 'started')
+    server.builds[9] = _build(9, 'pending')
+    streams = threading.Event()
+    server.events[8] = FakeResponse(lines=['event: event', 'data: {}'], block=streams)
+    server.events[9] = FakeResponse(lines=['event: event', 'event: end'], block=streams)
+    watcher = build_watcher.BuildWatcher('https://ci.example.com', lookback=3)
+    assert watcher.refresh() == 2
+    streams.set()
+    _join()
+    # 9 ended; the events of 8 stopped without an end
+    assert set(watcher.active) == {8}
+    assert server.get.call_args_list[0][1]['params'] == {'limit': 3}
+
+    for i in range(10, 15):
+        server.builds[i] = _build(i, 'started' if i == 14 else 'succeeded')
+    server.builds[8] = _build(8, 'succeeded')
+    server.get.reset_mock()
+    assert watcher.refresh() == 1
+    _join()
+    assert watcher.last_id == 14
+    # two pages of new builds, then 8 was read by itself
+    requested = [(c[0][0], c[1].get('params')) for c in server.get.call_args_list]
+    assert requested[:3] == [
+        ('https://ci.example.com/api/v1/builds', {'since': 9, 'limit': 3}),
+        ('https://ci.example.com/api/v1/builds', {'since': 12, 'limit': 3}),
+        ('https://ci.example.com/api/v1/builds/8', {}),
+    ]
+    # the events of 14 can't be read
+    assert set(watcher.active) == {14}
+    watcher.close()
+
+
+def test_connection_pool():
+    watcher = build_watcher.BuildWatcher('https://ci.example.com', max_followers=20)
+    adapter = watcher.session.get_adapter('https://ci.example.com/api/v1/builds')
+    assert adapter._pool_maxsize == 21
+    watcher.close()
+
+
+def test_no_builds(server):
+    with pytest.raises(ValueError):
+        build_watcher.BuildWatcher('https://ci.example.com').refresh()
+
+
+def test_wait_for_slot(server):
+    for i in range(1, 6):
+        server.builds[i] = _build(i, 'succeeded')
+    server.builds[6] = _build(6, 'started')
+    server.builds[7] = _build(7, 'started')
+    release = threading.Event()
+    server.events[6] = FakeResponse(lines=['event: end'], block=release)
+    server.events[7] = FakeResponse(lines=['event: end'], block=threading.Event())
+    watcher = build_watcher.BuildWatcher('https://ci.example.com', max_followers=2)
+    assert watcher.refresh() == 2
+    assert not watcher.wait_for_slot(2, 0.01)
+    release.set()
+    # woken by the end of build 6
+    assert watcher.wait_for_slot(2, 5)
+    assert watcher.running == 1
+    watcher.close()
+    assert watcher.wait_for_slot(0, 5)
+
+
+def test_wait_for_new_builds(server, mocker):
+    for i in range(1, 6):
+        server.builds[i] = _build(i, 'succeeded')
+    watcher = build_watcher.BuildWatcher('https://ci.example.com')
+    watcher.refresh()
+    assert not watcher.wait_for_new_builds(0)
+
+    def add_build(seconds):
+        server.builds[6] = _build(6, 'succeeded')
+    mocker.patch.object(build_watcher.time, 'sleep', side_effect=add_build)
+    assert watcher.wait_for_new_builds(60)
+    assert watcher.last_id == 6
+
+    # only the builds of the given pipeline count
+    def add_builds(seconds):
+        build_id = max(server.builds) + 1
+        server.builds[build_id] = _build(build_id, 'succeeded',
+                                         'one-off' if build_id == 9 else 'other')
+    mocker.patch.object(build_watcher.time, 'sleep', side_effect=add_builds)
+    assert watcher.wait_for_new_builds(60, pipeline_name='one-off')
+    assert watcher.last_id == 9
@@ -57,6 +57,18 @@ def test_submit_one_off(mocker):
         pr_file=None,
         repository=None,
         dry_run=False,
+        render_jobs=1,
+        render_cache_dir=None,
+        render_cache_max_size=None,
+        dependency_index=None,
+        platform_jobs=1,
+        index_snapshot=None,
+        recipe_log_max_count=0,
+        recipe_log_since=None,
+        recipe_log_cache_dir=None,
+        lazy_render=False,
+        build_order='topological',
+        build_stats=None,
     )
 
 
@@ -71,6 +83,7 @@ def test_submit_batch(mocker):
         max_builds=6,
         poll_time=120,
         build_lookback=500,
+        prepare_ahead=0,
         label_prefix='autobot_',
         debug=False,
         public=True,
@@ -86,9 +99,78 @@ def test_submit_batch(mocker):
         use_staging_channel=False,
         pass_throughs=[],
         skip_existing=True,
+        render_jobs=1,
+        render_cache_dir=None,
+        render_cache_max_size=None,
+        dependency_index=None,
+        platform_jobs=1,
+        index_snapshot=None,
+        recipe_log_max_count=0,
+        recipe_log_since=None,
+        recipe_log_cache_dir=None,
+        lazy_render=False,
+        build_order='topological',
+        build_stats=None,
     )
 
 
+def test_index_snapshot(mocker):
+    mocker.patch.object(cli.execute, 'index_snapshot')
+    cli.main(['index-snapshot', 'snap', '-c', 'conda-forge', '--subdir', 'linux-64'])
+    cli.execute.index_snapshot.assert_called_once_with(
+        snapshot_dir='snap', channel=['conda-forge'], subdirs=['linux-64'],
+        config_root_dir=mocker.ANY, platform_filters=None, debug=False,
+        subparser_name='index-snapshot', pass_throughs=[])
+
+
+def test_stats(mocker):
+    mocker.patch.object(cli.execute, 'stats_ingest')
+    mocker.patch.object(cli.execute, 'stats_query')
+    cli.main(['stats', 'ingest', 'stats', 'more_stats', '--db', 'stats.sqlite'])
+    cli.execute.stats_ingest.assert_called_once_with(
+        paths=['stats', 'more_stats'], db='stats.sqlite', debug=False, subparser_name='stats',
+        stats_command='ingest', pass_throughs=[])
+    cli.main(['stats', 'query', '--sort', 'rss', '--platform', 'linux-64'])
+    cli.execute.stats_query.assert_called_once_with(
+        db='c3i_stats.sqlite', sort='rss', limit=20, platform='linux-64', package=None,
+        include_tests=False, debug=False, subparser_name='stats', stats_command='query',
+        pass_throughs=[])
+
+
+def test_stats_without_command_raises(capsys):
+    with pytest.raises(SystemExit):
+        cli.main(['stats'])
+    assert 'stats_command' in capsys.readouterr().err
+
+
+def test_simulate(mocker):
+    mocker.patch.object(cli.execute, 'simulate')
+    cli.main(['simulate', 'output', '--workers', 'linux-64=4', '--build-stats', 'stats'])
+    cli.execute.simulate.assert_called_once_with(
+        path='output', config_root_dir=mocker.ANY, platform_filters=None,
+        workers=['linux-64=4'], build_stats=['stats'], job_overhead=0,
+        build_order='topological', debug=False, subparser_name='simulate', pass_throughs=[])
+
+
+def test_local_run(mocker):
+    mocker.patch.object(cli.execute, 'local_run', return_value=False)
+    with pytest.raises(SystemExit):
+        cli.main(['local-run', 'output', '-j', '4', '--label', 'linux*', '--python=3.8'])
+    cli.execute.local_run.assert_called_once_with(
+        output_dir='output', jobs=4, labels=['linux*'], work_dir=None, channel=None,
+        keep_going=True, dry_run=False, debug=False, subparser_name='local-run',
+        pass_throughs=['--python=3.8'])
+
+
+def test_rm_parallel(mocker):
+    mocker.patch.object(cli.execute, 'rm_pipeline', return_value=['failed-pipeline'])
+    with pytest.raises(SystemExit):
+        cli.main(['rm', 'one-off-*', '-y', '--parallel', '8'])
+    cli.execute.rm_pipeline.assert_called_once_with(
+        pipeline_names=['one-off-*'], config_root_dir=mocker.ANY, do_it_dammit=True, parallel=8,
+        debug=False, subparser_name='rm', pass_throughs=[])
+
+
 def test_submit_without_base_name_raises():
     with pytest.raises(SystemExit):
         args = ['submit']
@@ -1,4 +1,5 @@
 import os
+import subprocess
 
 from conda_build.metadata import MetaData
 from conda_build.api import Config
@@ -96,6 +97,46 @@ def test_platform_specific_graph(mocker, testing_conda_resolve):
     assert set(g.edges()) == deps
 
 
+def test_construct_graph_render_jobs(mocker, monkeypatch, testing_conda_resolve):
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = False
+    graphs = []
+    for render_jobs in (1, 3):
+        monkeypatch.setattr(compute_build_graph, '_rendered_recipes', {})
+        graphs.append(compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                                          folders=('a', 'b', 'c', 'd', 'e'),
+                                                          run='build',
+                                                          matrix_base_dir=test_config_dir,
+                                                          conda_resolve=testing_conda_resolve,
+                                                          render_jobs=render_jobs))
+    serial, parallel = graphs
+    assert list(serial.nodes()) == list(parallel.nodes())
+    assert list(serial.edges()) == list(parallel.edges())
+
+
+def test_construct_graph_render_cache(mocker, monkeypatch, testing_workdir,
+                                     testing_conda_resolve):
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = True
+    render = mocker.spy(compute_build_graph, '_render_recipe')
+    compute_build_graph.set_render_cache(os.path.join(testing_workdir, 'cache'))
+    try:
+        graphs = []
+        for _ in range(2):
+            monkeypatch.setattr(compute_build_graph, '_rendered_recipes', {})
+            graphs.append(compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                                              folders=('a', 'b'),
+                                                              run='build',
+                                                              matrix_base_dir=test_config_dir,
+                                                              conda_resolve=testing_conda_resolve))
+    finally:
+        compute_build_graph.set_render_cache(None)
+    # second pass is served entirely from the on-disk cache
+    assert render.call_count == 2
+    assert set(graphs[0].nodes()) == set(graphs[1].nodes())
+    assert set(graphs[0].edges()) == set(graphs[1].edges())
+
+
 def test_run_test_graph(testing_conda_resolve):
     g = compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
                                             folders=('a', 'b', 'c'),
@@ -144,6 +185,32 @@ def test_new_submodules(testing_new_submodules):
     assert 'docker-images' not in new_submodules
 
 
+def test_git_changeset(testing_git_repo):
+    subprocess.check_call(['git', 'mv', 'test_dir_2', 'renamed_dir'])
+    subprocess.check_call(['git', 'commit', '-m', 'rename'])
+    # uncommitted changes count too
+    with open(os.path.join('test_dir_1', 'meta.yaml'), 'a') as f:
+        f.write('\n# a change\n')
+    changeset = compute_build_graph.git_changeset('HEAD')
+    assert [(change.folder, change.kind) for change in changeset] == [
+        ('renamed_dir', 'renamed'), ('test_dir_1', 'modified')]
+    assert changeset[1].files == ['meta.yaml']
+
+
+def test_git_raw_diff_full_shas(testing_git_repo):
+    entries = compute_build_graph._git_raw_diff('HEAD', git_root='.')
+    assert entries
+    for entry in entries:
+        # abbreviated object names can be ambiguous where they are resolved (submodules)
+        assert len(entry[3]) == len(entry[4]) == 40
+
+
+def test_git_changeset_submodules(testing_submodule_commit):
+    changeset = compute_build_graph.git_changeset('HEAD')
+    assert {change.folder: change.kind for change in changeset} == {
+        'conda-feedstock': 'submodule', 'cb3-feedstock': 'renamed'}
+
+
 def test_add_dependency_nodes_and_edges(mocker, testing_graph, testing_conda_resolve):
     mocker.patch.object(compute_build_graph, '_installable')
     compute_build_graph._installable.return_value = False
@@ -252,6 +319,23 @@ def test_expand_run_all_steps_down(mocker, testing_graph, testing_conda_resolve)
                               'd-1.0-on-linux', 'e-1.0-on-linux'}
 
 
+def test_expand_run_visits_each_node_once(mocker, testing_conda_resolve):
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = False
+    g = compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                            folders=('b',), run='build',
+                                            matrix_base_dir=test_config_dir,
+                                            conda_resolve=testing_conda_resolve)
+    dependent_folders = mocker.spy(compute_build_graph, 'dependent_folders')
+    compute_build_graph.expand_run(g, Config(), testing_conda_resolve,
+                                   run='build', worker=dummy_worker,
+                                   recipes_dir=graph_data_dir,
+                                   matrix_base_dir=test_config_dir,
+                                   max_downstream=-1, steps=-1)
+    assert len(g.nodes()) == 5
+    assert dependent_folders.call_count == 5
+
+
 def test_expand_run_all_steps_down_with_max(mocker, testing_conda_resolve):
     mocker.patch.object(compute_build_graph, '_installable')
     compute_build_graph._installable.return_value = False
@@ -268,6 +352,117 @@ def test_expand_run_all_steps_down_with_max(mocker, testing_conda_resolve):
     assert set(g.nodes()) == {'a-1.0-on-linux', 'b-1.0-on-linux', 'c-1.0-on-linux'}
 
 
+def test_expand_run_dependency_index(mocker, testing_conda_resolve, testing_workdir):
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = False
+    index_path = os.path.join(testing_workdir, 'deps.sqlite')
+    nodes = []
+    records = mocker.spy(compute_build_graph, '_dependency_index_records')
+    for _ in range(2):
+        # a fresh connection to the same file, like a second run would have
+        compute_build_graph.set_dependency_index(index_path)
+        g = compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                                folders=('a',), run='build',
+                                                matrix_base_dir=test_config_dir,
+                                                conda_resolve=testing_conda_resolve)
+        compute_build_graph.expand_run(g, Config(), testing_conda_resolve,
+                                       run='build', worker=dummy_worker,
+                                       recipes_dir=graph_data_dir,
+                                       matrix_base_dir=test_config_dir,
+                                       steps=1)
+        nodes.append(set(g.nodes()))
+    compute_build_graph.set_dependency_index()
+    assert nodes[0] == nodes[1] == {'a-1.0-on-linux', 'b-1.0-on-linux'}
+    # nothing changed, so nothing was indexed again
+    assert records.call_count == len([d for d in os.listdir(graph_data_dir)
+                                      if os.path.isdir(os.path.join(graph_data_dir, d))])
+
+
+def test_expand_run_lazy_render(mocker, monkeypatch, testing_conda_resolve):
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = False
+    records = mocker.spy(compute_build_graph, '_dependency_index_records')
+    graphs = []
+    for lazy in (False, True):
+        monkeypatch.setattr(compute_build_graph, '_lazy_render', lazy)
+        compute_build_graph.set_dependency_index()
+        g = compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                                folders=('d',), run='build',
+                                                matrix_base_dir=test_config_dir,
+                                                conda_resolve=testing_conda_resolve)
+        compute_build_graph.expand_run(g, Config(), testing_conda_resolve,
+                                       run='build', worker=dummy_worker,
+                                       recipes_dir=graph_data_dir,
+                                       matrix_base_dir=test_config_dir,
+                                       max_downstream=-1, steps=-1)
+        graphs.append(g)
+    eager, lazy = graphs
+    assert list(eager.nodes()) == list(lazy.nodes())
+    assert list(eager.edges()) == list(lazy.edges())
+    # all five folders when eager, only d and e (which depends on d) when lazy
+    assert records.call_count == 5 + 2
+
+
+def test_expand_run_lazy_render_upstream(mocker, monkeypatch, testing_workdir,
+                                         testing_conda_resolve):
+    # q needs r, which is not installable, so r is added while expanding.  s depends on r only.
+    make_recipe('p')
+    make_recipe('q', ['p', 'r'])
+    make_recipe('r')
+    make_recipe('s', ['r'])
+    mocker.patch.object(compute_build_graph, '_installable',
+                        side_effect=lambda name, *args: name != 'r')
+    graphs = []
+    for lazy in (False, True):
+        monkeypatch.setattr(compute_build_graph, '_lazy_render', lazy)
+        monkeypatch.setattr(compute_build_graph, '_recipe_indexes', {})
+        compute_build_graph.set_dependency_index()
+        g = compute_build_graph.construct_graph(testing_workdir, dummy_worker,
+                                                folders=('p',), run='build',
+                                                matrix_base_dir=test_config_dir,
+                                                conda_resolve=testing_conda_resolve)
+        compute_build_graph.expand_run(g, Config(), testing_conda_resolve,
+                                       run='build', worker=dummy_worker,
+                                       recipes_dir=testing_workdir,
+                                       matrix_base_dir=test_config_dir,
+                                       max_downstream=-1, steps=-1)
+        graphs.append(g)
+    eager, lazy = graphs
+    assert 's-1.0-on-linux' in eager.nodes()
+    assert sorted(eager.nodes()) == sorted(lazy.nodes())
+    assert sorted(eager.edges()) == sorted(lazy.edges())
+
+
+@pytest.mark.parametrize('version', [
+    '{% if linux %}{% set version = "1.0" %}{% else %}{% set version = "2.0" %}{% endif %}\n'
+    'package:\n  name: v\n  version: {{ version }}\n',
+    'package:\n  name: v\n  version: "1.0"  # [linux]\n  version: "2.0"  # [not linux]\n',
+])
+def test_lazy_render_conditional_versions(mocker, monkeypatch, testing_workdir,
+                                          testing_conda_resolve, version):
+    # v renders to 1.0 here, but 2.0 is the last version in its meta.yaml
+    os.makedirs(os.path.join('recipes', 'v'))
+    with open(os.path.join('recipes', 'v', 'meta.yaml'), 'w') as f:
+        f.write(version)
+    os.chdir('recipes')
+    make_recipe('w', ['v 1.0'])
+    os.chdir(testing_workdir)
+    recipes = os.path.join(testing_workdir, 'recipes')
+    mocker.patch.object(compute_build_graph, '_installable')
+    compute_build_graph._installable.return_value = False
+    graphs = []
+    for lazy in (False, True):
+        monkeypatch.setattr(compute_build_graph, '_lazy_render', lazy)
+        monkeypatch.setattr(compute_build_graph, '_recipe_indexes', {})
+        graphs.append(compute_build_graph.construct_graph(
+            recipes, dummy_worker, folders=('w',), run='build',
+            matrix_base_dir=test_config_dir, conda_resolve=testing_conda_resolve))
+    eager, lazy = graphs
+    assert 'v-1.0-on-linux' in eager.nodes()
+    assert sorted(eager.nodes()) == sorted(lazy.nodes())
+    assert sorted(eager.edges()) == sorted(lazy.edges())
+
+
 def test_expand_run_build_non_installable_prereq(mocker, testing_conda_resolve):
     mocker.patch.object(compute_build_graph, '_installable')
     compute_build_graph._installable.return_value = False
@@ -288,12 +483,44 @@ def test_expand_run_build_non_installable_prereq(mocker, testing_conda_resolve):
     assert set(g.nodes()) == {'a-1.0-on-linux', 'b-1.0-on-linux', 'c-1.0-on-linux'}
 
 
+def test_expand_run_upstream(mocker, testing_conda_resolve):
+    # d depends on c, which depends on b, which depends on a.  Only c is not installable.
+    mocker.patch.object(compute_build_graph, '_installable',
+                        lambda name, *args: name != 'c')
+    g = compute_build_graph.construct_graph(graph_data_dir, dummy_worker,
+                                            folders=('d',), run='build',
+                                            matrix_base_dir=test_config_dir,
+                                            conda_resolve=testing_conda_resolve)
+    assert set(g.nodes()) == {'c-1.0-on-linux', 'd-1.0-on-linux'}
+    g.remove_node('c-1.0-on-linux')
+    added = compute_build_graph.expand_run_upstream(g, testing_conda_resolve,
+                                                    worker=dummy_worker, run='build',
+                                                    recipes_dir=graph_data_dir, steps=-1)
+    assert added == 1
+    # a and b are not built, although rebuilding everything upstream would build them
+    assert set(g.nodes()) == {'c-1.0-on-linux', 'd-1.0-on-linux'}
+    assert set(g.edges()) == {('d-1.0-on-linux', 'c-1.0-on-linux')}
+    assert compute_build_graph._static_upstream_folders(graph_data_dir, {'d'}) == {'a', 'b', 'c'}
+
+
 def test_order_build(testing_graph):
     order = compute_build_graph.order_build(testing_graph)
     assert order.index('b-on-linux') > order.index('a-on-linux')
     assert order.index('c3itest-c-on-linux') > order.index('b-on-linux')
 
 
+def test_order_build_critical_path():
+    g = nx.DiGraph()
+    # c depends on b, which depends on a.  d is a long build that nothing depends on.
+    g.add_edges_from([('c', 'b'), ('b', 'a')])
+    g.add_node('d')
+    order = compute_build_graph.order_build(g, {'a': 1, 'b': 1, 'c': 1, 'd': 10})
+    assert order == ['d', 'a', 'b', 'c']
+    # the chain takes longer than d now
+    order = compute_build_graph.order_build(g, {'a': 1, 'b': 1, 'c': 10, 'd': 10})
+    assert order == ['a', 'b', 'd', 'c']
+
+
 def test_get_base_folders(testing_workdir):
     make_recipe('some_recipe')
     os.makedirs('not_a_recipe')
@@ -404,3 +631,17 @@ def test_version_matching(testing_conda_resolve):
     assert len(g.nodes()) == 4
     assert ('downstream-1.0-upstream_1.0-on-linux', 'upstream-1.0.1-on-linux') in g.edges()
     assert ('downstream-1.0-upstream_2.0-on-linux', 'upstream-2.0.2-on-linux') in g.edges()
+
+
+def test_installable_warns_once(mocker, testing_conda_resolve, testing_metadata):
+    warn = mocker.patch.object(compute_build_graph.log, 'warn')
+    index = compute_build_graph.installability(testing_conda_resolve)
+    # evaluated in a batch first, like add_dependency_nodes_and_edges does
+    index.prime(['f', 'a 920'])
+    for _ in range(2):
+        assert not compute_build_graph._installable('f', '', '', testing_metadata.config,
+                                                    testing_conda_resolve)
+        assert compute_build_graph._installable('a', '920', '', testing_metadata.config,
+                                                testing_conda_resolve)
+    assert warn.call_count == 1
+    assert 'Dependency f' in warn.call_args[0][0]
@@ -0,0 +1,177 @@
+import base64
+import json
+import time
+
+import pytest
+import requests
+import yaml
+
+from conda_concourse_ci import concourse
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.content = b'x' if data is not None else b''
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+
+def _jwt(exp):
+    payload = base64.urlsafe_b64encode(json.dumps({'exp': exp}).encode()).rstrip(b'=')
+    return 'header.{}.signature'.format(payload.decode())
+
+
+@pytest.fixture
+def api(mocker, tmpdir):
+    con = concourse.ConcourseAPI('https://ci.example.com/', username='user', password='pass',
+                                 team_name='team', flyrc=str(tmpdir.join('flyrc')),
+                                 token_cache=str(tmpdir.join('tokens.json')))
+    mocker.patch.object(con.session, 'post',
+                        return_value=FakeResponse(data={'access_token': 'token'}))
+    mocker.patch.object(con.session, 'request')
+    return con
+
+
+def test_concourse_from_config():
+    config = {'concourse-url': 'https://ci.example.com', 'concourse-team': 'team'}
+    assert type(concourse.concourse_from_config(config)) is concourse.Concourse
+    config['concourse-backend'] = 'api'
+    con = concourse.concourse_from_config(config)
+    assert isinstance(con, concourse.ConcourseAPI)
+    assert con.team == 'team'
+    config['concourse-backend'] = 'telnet'
+    with pytest.raises(ValueError):
+        concourse.concourse_from_config(config)
+
+
+def test_api_requests(api, mocker):
+    api.session.request.side_effect = [
+        FakeResponse(data=[{'name': 'p1'}, {'name': 'p2'}]),
+        FakeResponse(),
+        FakeResponse(data=[{'id': 42, 'job_name': 'job', 'name': '3', 'status': 'started'}]),
+        FakeResponse(),
+    ]
+    fly = mocker.patch.object(concourse.subprocess, 'run')
+    assert api.pipelines == ['p1', 'p2']
+    api.pause_pipeline('p1')
+    assert api.get_builds('p1')[0]['status'] == 'started'
+    # the id is known from get_builds
+    api.abort_build('p1', 'job', '3')
+    # logged in once, and the token was sent with everything
+    assert api.session.post.call_count == 1
+    assert api.session.headers['Authorization'] == 'Bearer token'
+    assert [c[0] for c in api.session.request.call_args_list] == [
+        ('GET', 'https://ci.example.com/api/v1/teams/team/pipelines'),
+        ('PUT', 'https://ci.example.com/api/v1/teams/team/pipelines/p1/pause'),
+        ('GET', 'https://ci.example.com/api/v1/teams/team/pipelines/p1/builds'),
+        ('PUT', 'https://ci.example.com/api/v1/builds/42/abort'),
+    ]
+    assert not fly.called
+
+
+def test_api_token_expiry(api):
+    api.session.request.side_effect = [FakeResponse(401), FakeResponse(data=[])]
+    assert api.get_jobs('p1') == []
+    assert api.session.post.call_count == 2
+    api.session.request.side_effect = [FakeResponse(500)]
+    with pytest.raises(requests.HTTPError):
+        api.trigger_job('p1', 'job')
+
+
+def test_api_set_pipeline_uses_fly(api, mocker):
+    fly = mocker.patch.object(concourse.subprocess, 'run')
+    mocker.patch.object(concourse.requests, 'get', side_effect=requests.ConnectionError)
+    api.set_pipeline('p1', 'plan.yml', 'config.yml')
+    api.set_pipeline('p2', 'plan.yml', 'config.yml')
+    commands = [c[0][0][3] for c in fly.call_args_list if c[0][0][1] == '-t']
+    # fly is logged in (and synced) only once
+    assert commands == ['login', 'sync', 'set-pipeline', 'set-pipeline']
+
+
+def test_token_expiry():
+    assert concourse.token_expiry(_jwt(1234)) == 1234
+    assert concourse.token_expiry('token') is None
+    assert concourse.token_expiry('a.!!!.b') is None
+    assert concourse.token_expiry(None) is None
+
+
+def test_fly_login_reuses_token(mocker, tmpdir):
+    flyrc = tmpdir.join('flyrc')
+    con = concourse.Concourse('https://ci.example.com', 'user', 'pass', 'team', flyrc=str(flyrc))
+    fly = mocker.patch.object(concourse.subprocess, 'run')
+
+    def write_target(**target):
+        flyrc.write(yaml.safe_dump({'targets': {'conda-concourse-server': target}}))
+
+    # no ~/.flyrc
+    con.login()
+    assert fly.call_count == 1
+    assert con.bearer_token() is None
+    token = _jwt(time.time() + 3600)
+    write_target(api='https://ci.example.com/', team='team',
+                 token={'type': 'bearer', 'value': token})
+    con.login()
+    assert fly.call_count == 1
+    assert con.bearer_token() == token
+    con.login(force=True)
+    assert fly.call_count == 2
+    # about to expire
+    write_target(api='https://ci.example.com/', team='team',
+                 token={'type': 'bearer', 'value': _jwt(time.time() + 60)})
+    con.login()
+    assert fly.call_count == 3
+    # another team
+    write_target(api='https://ci.example.com/', team='main',
+                 token={'type': 'bearer', 'value': _jwt(time.time() + 3600)})
+    con.login()
+    assert fly.call_count == 4
+
+
+def test_sync_only_when_versions_differ(mocker):
+    con = concourse.Concourse('https://ci.example.com', 'user', 'pass')
+    mocker.patch.object(con, 'fly_version', return_value='7.4.0')
+    get = mocker.patch.object(concourse.requests, 'get',
+                              return_value=FakeResponse(data={'version': '7.4.0'}))
+    fly = mocker.patch.object(con, '_fly')
+    con.sync()
+    assert get.call_args[0][0] == 'https://ci.example.com/api/v1/info'
+    assert not fly.called
+    get.return_value = FakeResponse(data={'version': '7.5.0'})
+    con.sync()
+    assert fly.call_args[0][0] == ['sync']
+    get.side_effect = requests.ConnectionError
+    con.sync()
+    assert fly.call_count == 2
+
+
+def test_api_token_cache(api, tmpdir):
+    token = _jwt(time.time() + 3600)
+    api.session.post.return_value = FakeResponse(data={'id_token': token})
+    api.login()
+    assert api.session.post.call_count == 1
+    assert oct(tmpdir.join('tokens.json').stat().mode & 0o777) == oct(0o600)
+
+    # another run reuses the token
+    other = concourse.ConcourseAPI('https://ci.example.com', username='user', password='pass',
+                                   team_name='team', token_cache=str(tmpdir.join('tokens.json')))
+    other.session.post = api.session.post
+    other.login()
+    assert api.session.post.call_count == 1
+    assert other.session.headers['Authorization'] == 'Bearer ' + token
+    assert other.bearer_token() == token
+
+    other.logout()
+    api.session.post.return_value = FakeResponse(
+        data={'access_token': 'opaque', 'expires_in': 60})
+    api.login()
+    assert api.session.post.call_count == 2
+    # a token that expires within TOKEN_MARGIN is not reused
+    api.login()
+    assert api.session.post.call_count == 3
@@ -0,0 +1,65 @@
+import os
+
+from conda_concourse_ci import dependency_index
+from .utils import make_recipe
+
+
+def _output(name, variant=None):
+    return {'name': name, 'version': '1.0', 'build': '0', 'build_number': 0,
+            'variant': variant or {}}
+
+
+def _dep(name, spec=None, variant=None):
+    return {'name': name, 'spec': spec or name, 'variant': variant or {}}
+
+
+def test_folder_states(testing_git_repo):
+    folders = ['test_dir_1', 'test_dir_2', 'not_a_recipe']
+    states = dependency_index.folder_states('.', folders)
+    assert set(states) == set(folders)
+    assert states['test_dir_1'].startswith('git:')
+    # untracked
+    assert states['not_a_recipe'].startswith('content:')
+    with open(os.path.join('test_dir_1', 'meta.yaml'), 'a') as f:
+        f.write('\n# a change\n')
+    new_states = dependency_index.folder_states('.', folders)
+    assert new_states['test_dir_1'].startswith('content:')
+    assert new_states['test_dir_2'] == states['test_dir_2']
+
+
+def test_folder_states_no_git(testing_workdir):
+    make_recipe('some_recipe')
+    state = dependency_index.folder_states('.', ['some_recipe'])['some_recipe']
+    assert state.startswith('content:')
+    assert dependency_index.folder_states('.', ['some_recipe'])['some_recipe'] == state
+
+
+def test_dependency_index():
+    index = dependency_index.DependencyIndex()
+    index.store('linux', 'a', 'state-a', [_output('a'), _output('a-lib')], [])
+    index.store('linux', 'b', 'state-b', [_output('b', {'python': '3.6'})],
+                [_dep('a', 'a >=1', {'python': '3.6'})])
+    index.store('win', 'c', 'state-c', [_output('c')], [_dep('a')])
+    assert [o['name'] for o in index.outputs('linux', folder='a')] == ['a', 'a-lib']
+    assert index.outputs('linux', name='b')[0]['variant'] == {'python': '3.6'}
+    assert index.dependents('linux', 'a') == [{'folder': 'b', 'spec': 'a >=1',
+                                               'variant': {'python': '3.6'}}]
+    assert [d['folder'] for d in index.dependents('win', 'a')] == ['c']
+
+    assert index.stale_folders('linux', {'a': 'state-a', 'b': 'changed'}) == ['b']
+    # folders that are gone are dropped
+    assert index.stale_folders('linux', {'b': 'state-b'}) == []
+    assert index.outputs('linux', folder='a') == []
+    # storing a folder again replaces it
+    index.store('linux', 'b', 'state-b2', [_output('b')], [])
+    assert index.dependents('linux', 'a') == []
+
+
+def test_dependency_index_persistent(testing_workdir):
+    path = os.path.join(testing_workdir, 'index', 'deps.sqlite')
+    index = dependency_index.DependencyIndex(path)
+    index.store('linux', 'b', 'state-b', [_output('b')], [_dep('a')])
+    index.close()
+    index = dependency_index.DependencyIndex(path)
+    assert index.stale_folders('linux', {'b': 'state-b'}) == []
+    assert [d['folder'] for d in index.dependents('linux', 'a')] == ['b']
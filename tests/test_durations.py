@@ -0,0 +1,46 @@
+import json
+import os
+
+from conda_concourse_ci import durations
+
+
+def _write_stats(folder, node, when, *elapsed):
+    os.makedirs(folder, exist_ok=True)
+    stats = {'step_{}'.format(i): {'elapsed': e, 'rss': 1024} for i, e in enumerate(elapsed)}
+    with open(os.path.join(folder, '{}_{}.json'.format(node, when)), 'w') as f:
+        json.dump(stats, f)
+
+
+def test_load_durations(testing_workdir):
+    _write_stats('stats', 'a-1.0-on-linux', 100, 10, 5)
+    # only the most recent build counts
+    _write_stats('stats', 'b-1.0-on-linux', 100, 60)
+    _write_stats(os.path.join('stats', 'older'), 'b-1.0-on-linux', 50, 1000)
+    _write_stats('more_stats', 'b-1.0-on-linux', 200, 30)
+    with open(os.path.join('stats', 'c-1.0-on-linux_100.json'), 'w') as f:
+        f.write('not json')
+    with open(os.path.join('stats', 'README'), 'w') as f:
+        f.write('not stats')
+    assert durations.load_durations(['stats', 'more_stats']) == {'a-1.0-on-linux': 15,
+                                                                 'b-1.0-on-linux': 30}
+    assert durations.load_durations([os.path.join('stats', 'a-1.0-on-linux_100.json')]) == {
+        'a-1.0-on-linux': 15}
+
+
+def test_estimate_durations(testing_graph):
+    estimates = durations.estimate_durations(testing_graph, {
+        # exact
+        'a-on-linux': 10,
+        # other versions of b
+        'b-0.9-on-linux': 100,
+        'b-0.8-on-linux': 80,
+        # not b, and not on this platform
+        'bb-1.0-on-linux': 1000,
+        'b-0.9-on-win-64': 1000,
+    })
+    assert estimates['a-on-linux'] == 10
+    assert estimates['b-on-linux'] == 100
+    # nothing known about testing c
+    assert estimates['c3itest-c-on-linux'] == 55
+    assert (durations.estimate_durations(testing_graph, {}) ==
+            {node: durations.DEFAULT_DURATION for node in testing_graph.nodes()})
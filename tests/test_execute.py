@@ -1,4 +1,5 @@
 import os
+import shutil
 import subprocess
 
 from conda_concourse_ci import execute
@@ -24,6 +25,66 @@ def test_collect_tasks(mocker, testing_conda_resolve, testing_graph):
     n_platforms = len(build_platforms)
     # minimum args means build and test provided folders.  Two tasks.
     assert len(task_graph.nodes()) == n_platforms
+    # the nodes carry compact records, not MetaData
+    assert all('record' in data and 'meta' not in data
+               for _, data in task_graph.nodes(data=True))
+
+
+def test_collect_tasks_platform_jobs(mocker, testing_conda_resolve):
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_build_index')
+    mocker.patch.object(conda_concourse_ci.compute_build_graph, '_installable')
+    execute.Resolve.return_value = testing_conda_resolve
+    conda_concourse_ci.compute_build_graph._installable.return_value = True
+    serial = execute.collect_tasks(graph_data_dir, folders=['a', 'b'],
+                                   matrix_base_dir=test_config_dir)
+    concurrent = execute.collect_tasks(graph_data_dir, folders=['a', 'b'],
+                                       matrix_base_dir=test_config_dir, platform_jobs=3)
+    assert list(serial.nodes()) == list(concurrent.nodes())
+    assert list(serial.edges()) == list(concurrent.edges())
+
+
+def test_collect_tasks_previous_graph(mocker, testing_conda_resolve, testing_workdir):
+    mocker.patch.object(execute, 'Resolve')
+    mocker.patch.object(execute, 'get_build_index')
+    mocker.patch.object(conda_concourse_ci.compute_build_graph, '_installable')
+    execute.Resolve.return_value = testing_conda_resolve
+    conda_concourse_ci.compute_build_graph._installable.return_value = False
+    recipes = os.path.join(testing_workdir, 'recipes')
+    shutil.copytree(graph_data_dir, recipes)
+    artifact = os.path.join(testing_workdir, 'graph.json')
+    kwargs = dict(folders=['c'], matrix_base_dir=test_config_dir,
+                  platform_filters=['centos5-64'], graph_artifact=artifact)
+    first = execute.collect_tasks(recipes, **kwargs)
+    construct_graph = mocker.spy(execute, 'construct_graph')
+    # nothing changed: nothing is computed
+    again = execute.collect_tasks(recipes, previous_graph=artifact, **kwargs)
+    assert construct_graph.call_count == 0
+    assert set(again.nodes()) == set(first.nodes())
+    assert set(again.edges()) == set(first.edges())
+    # b changed.  c depends on b, so both are computed again, but a is not.
+    with open(os.path.join(recipes, 'b', 'meta.yaml'), 'a') as f:
+        f.write('\n# a change\n')
+    write_recipe_logs = mocker.spy(execute, 'write_recipe_logs')
+    spliced = execute.collect_tasks(recipes, previous_graph=artifact, **kwargs)
+    assert construct_graph.call_args[1]['folders'] == ['b', 'c']
+    assert set(spliced.nodes()) == set(first.nodes())
+    assert set(spliced.edges()) == set(first.edges())
+    # the reused node still gets its recipe log
+    assert write_recipe_logs.call_args[0][0] == [os.path.join(recipes, 'a')]
+    # a build of a appeared in the channels: nothing is reused
+    record = mocker.Mock(spec=['name'])
+    record.name = 'a'
+    execute.get_build_index.return_value = ({'defaults::a-1.0-0': record}, None)
+    execute.collect_tasks(recipes, previous_graph=artifact, **kwargs)
+    assert construct_graph.call_args[1]['folders'] == ['c']
+
+
+def test_plan_params():
+    params = dict(path='recipes', folders=['a'], platform={'label': 'linux'}, channels=[],
+                  steps=0, max_downstream=5, upstream=False, index_snapshot=None)
+    assert (execute._plan_params(skip_existing=True, **params) !=
+            execute._plan_params(skip_existing=False, **params))
 
 
 boilerplate_test_vars = {'base-name': 'steve',
@@ -94,7 +155,10 @@ def test_submit_batch(mocker):
     mocker.patch.object(execute, 'subprocess')
     mocker.patch.object(conda_concourse_ci.concourse, 'subprocess')
     submit_one_off = mocker.patch.object(execute, 'submit_one_off')
-    get_activate_builds = mocker.patch.object(execute, '_get_activate_builds', return_value=3)
+    login = mocker.patch.object(execute, '_ensure_login_and_sync')
+    login.return_value.bearer_token.return_value = 'token'
+    watcher = mocker.patch.object(execute, 'BuildWatcher')
+    watcher.return_value.refresh.return_value = 3
 
     execute.submit_batch(
         os.path.join(test_data_dir, 'batch_sample.txt'),
@@ -108,7 +172,54 @@ def test_submit_batch(mocker):
         mocker.call('sentinel_pytest', mocker.ANY, ['pytest', 'pytest-cov'],
                     mocker.ANY, pass_throughs=None),
     ])
-    get_activate_builds.assert_called()
+    # builds of private pipelines count too
+    watcher.assert_called_once_with(mocker.ANY, lookback=500, token='token')
+    watcher.return_value.refresh.assert_called()
+    # waited for the builds of the first one-off only
+    watcher.return_value.wait_for_new_builds.assert_called_once_with(
+        0, pipeline_name='sentinel_bzip')
+    watcher.return_value.close.assert_called_once_with()
+
+
+def test_submit_batch_prepare_ahead(mocker, capsys):
+    # threads rather than processes, so that the mocks are seen
+    mocker.patch.object(execute, 'ProcessPoolExecutor', execute.ThreadPoolExecutor)
+    mocker.patch.object(execute, '_ensure_login_and_sync')
+    watcher = mocker.patch.object(execute, 'BuildWatcher')
+    watcher.return_value.refresh.return_value = 0
+    output_dirs = {}
+
+    def prepare(pipeline_label, recipe_root_dir, folders, config_root_dir, output_dir, **kw):
+        assert os.path.isdir(output_dir)
+        output_dirs[pipeline_label] = output_dir
+        if pipeline_label == 'sentinel_pytest':
+            raise ValueError('unsatisfiable')
+    prepare_one_off = mocker.patch.object(execute, 'prepare_one_off', side_effect=prepare)
+    submit_prepared = mocker.patch.object(execute, 'submit_prepared_one_off')
+    submit_one_off = mocker.patch.object(execute, 'submit_one_off')
+
+    execute.submit_batch(
+        os.path.join(test_data_dir, 'batch_sample.txt'),
+        os.path.join(test_data_dir, 'one-off-recipes'),
+        config_root_dir=test_config_dir,
+        max_builds=999, poll_time=0, build_lookback=500, label_prefix='sentinel_',
+        prepare_ahead=2)
+    assert prepare_one_off.call_count == 2
+    assert not submit_one_off.called
+    # only the plan that could be computed was submitted, from where it was computed
+    submit_prepared.assert_called_once_with(
+        'sentinel_bzip', test_config_dir, pass_throughs=None,
+        clobber_sections_file='example.yaml', output_dir=output_dirs['sentinel_bzip'])
+    assert not any(os.path.exists(path) for path in output_dirs.values())
+    out = capsys.readouterr().out
+    assert 'Exception was: unsatisfiable' in out
+    assert 'one-off jobs which failed to submit: 1' in out
+
+
+def test_pipeline_configs_are_independent():
+    first = execute.PipelineConfig()
+    first.add_job('job')
+    assert execute.PipelineConfig().to_dict() == {}
 
 
 def test_bootstrap(mocker, testing_workdir):
@@ -260,3 +371,48 @@ def test_collapse_noarch_python():
     assert ('pkg_b-1.0.0-python_2.7-on-win-32', a_build_node) in tasks.edges()
     assert ('pkg_b-1.0.0-python_3.6-on-centos5-64', a_build_node) in tasks.edges()
     assert ('pkg_b-1.0.0-python_2.7-on-centos5-64', a_build_node) in tasks.edges()
+
+
+def test_bulk_pipeline_operations(mocker, capsys):
+    con = mocker.MagicMock()
+    con.pipelines = ['one-off-a', 'one-off-b', 'one-off-c', 'other']
+    con.get_builds.return_value = [{'status': 'started', 'job_name': 'job', 'name': '1'},
+                                   {'status': 'succeeded', 'job_name': 'job', 'name': '2'}]
+
+    def destroy(pipeline):
+        if pipeline == 'one-off-b':
+            raise subprocess.CalledProcessError(1, 'fly')
+    con.destroy_pipeline.side_effect = destroy
+    mocker.patch.object(execute, '_ensure_login_and_sync', return_value=con)
+    failed = execute.rm_pipeline(['one-off-*'], 'config', do_it_dammit=True, parallel=3)
+    # one failure doesn't stop the others
+    assert failed == ['one-off-b']
+    assert sorted(c[0][0] for c in con.destroy_pipeline.call_args_list) == [
+        'one-off-a', 'one-off-b', 'one-off-c']
+    assert con.abort_build.call_count == 3
+    # one login for everything
+    assert execute._ensure_login_and_sync.call_count == 1
+    out = capsys.readouterr().out
+    assert 'remove: 2 succeeded, 1 failed' in out
+    assert '  failed: one-off-b' in out
+
+    assert execute.unpause_pipeline(['other'], 'config', do_it_dammit=True) == []
+    con.unpause_pipeline.assert_called_once_with('other')
+
+
+def test_ensure_login_and_sync_reuses_concourse(mocker, testing_workdir):
+    with open('config.yml', 'w') as f:
+        f.write('concourse-url: https://ci.example.com\n')
+    mocker.patch.object(execute, '_concourses', {})
+    make = mocker.patch.object(execute, 'concourse_from_config')
+    con = execute._ensure_login_and_sync('.')
+    assert execute._ensure_login_and_sync(os.getcwd()) is con
+    assert make.call_count == 1
+    # the login may have expired in between
+    assert con.login.call_count == 2
+    assert con.sync.call_count == 1
+    # a changed config.yml gets a new login
+    with open('config.yml', 'w') as f:
+        f.write('concourse-url: https://other.example.com\n')
+    execute._ensure_login_and_sync('.')
+    assert make.call_count == 2
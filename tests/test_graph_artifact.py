@@ -0,0 +1,32 @@
+import os
+
+import networkx as nx
+import pytest
+
+from conda_concourse_ci import compute_build_graph, graph_artifact
+
+
+def test_save_and_load_graph(testing_workdir, testing_graph):
+    compute_build_graph.compact_graph(testing_graph)
+    for node, data in testing_graph.nodes(data=True):
+        data['input_hash'] = node
+    path = os.path.join(testing_workdir, 'output', graph_artifact.FILENAME)
+    platforms = {'linux': {'params': 'abc', 'folder_hashes': {'a': 'def'}}}
+    graph_artifact.save_graph(path, testing_graph, platforms)
+    g, loaded_platforms = graph_artifact.load_graph(path)
+    assert loaded_platforms == platforms
+    assert list(g.nodes()) == list(testing_graph.nodes())
+    assert set(g.edges()) == set(testing_graph.edges())
+    for node, data in g.nodes(data=True):
+        assert data['input_hash'] == node
+        assert data['worker'] == testing_graph.nodes[node]['worker']
+        assert data['record'].to_dict() == testing_graph.nodes[node]['record'].to_dict()
+    assert set(graph_artifact.platform_graph(g, 'linux').nodes()) == set(g.nodes())
+    assert not graph_artifact.platform_graph(g, 'win')
+
+
+def test_load_graph_of_other_format(testing_workdir):
+    with open('graph.json', 'w') as f:
+        f.write('{"format": 0}')
+    with pytest.raises(ValueError):
+        graph_artifact.load_graph('graph.json')
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from conda_concourse_ci import index_snapshot
+
+
+def test_snapshot_roundtrip(mocker, testing_workdir, testing_conda_resolve):
+    mocker.patch.object(index_snapshot, 'get_build_index')
+    index_snapshot.get_build_index.return_value = (testing_conda_resolve.index, None)
+    snapshot_dir = os.path.join(testing_workdir, 'snap')
+    index_snapshot.save_snapshot(snapshot_dir, ['linux-64', 'win-64'], channels=['r'])
+    assert index_snapshot.get_build_index.call_count == 2
+    manifest = index_snapshot.read_manifest(snapshot_dir)
+    assert manifest['channels'] == ['r']
+    assert manifest['subdirs'] == ['linux-64', 'win-64']
+    index = index_snapshot.load_index(snapshot_dir, 'linux-64', channels=['r'])
+    assert index == testing_conda_resolve.index
+    with pytest.raises(ValueError):
+        index_snapshot.load_index(snapshot_dir, 'osx-64')
+
+
+def test_load_index_not_a_snapshot(testing_workdir):
+    with pytest.raises(ValueError):
+        index_snapshot.load_index(testing_workdir, 'linux-64')
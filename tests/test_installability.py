@@ -0,0 +1,29 @@
+from conda_concourse_ci.installability import InstallabilityIndex, normalize_spec
+
+
+def test_normalize_spec():
+    assert normalize_spec('a  920 ') == normalize_spec('a 920') == 'a 920'
+
+
+def test_find_matches(testing_conda_resolve):
+    index = InstallabilityIndex(testing_conda_resolve)
+    assert index.find_matches('a')
+    assert index.find_matches('a 920')
+    assert not index.find_matches('a 1.0')
+    assert not index.find_matches('f')
+    # equivalent spec, different spelling
+    assert index.find_matches('a  920 ')
+    assert (index.hits, index.misses) == (1, 4)
+
+
+def test_prime(testing_conda_resolve):
+    index = InstallabilityIndex(testing_conda_resolve)
+    assert index.prime(['a', 'b >=900', 'a', 'f']) == ['a', 'b >=900', 'f']
+    assert index.prime(['a', 'c']) == ['c']
+    assert index.find_matches('b >=900')
+    assert not index.find_matches('f')
+    # evaluated in a batch, but looked up for the first time
+    assert (index.hits, index.misses) == (0, 2)
+    assert index.find_matches('b >=900')
+    assert (index.hits, index.misses) == (1, 2)
+    assert '3 lookups, 4 specs evaluated' in index.stats()
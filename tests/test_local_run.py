@@ -0,0 +1,127 @@
+import os
+
+import yaml
+
+from conda_concourse_ci import execute, graph_artifact, local_run
+
+from .utils import test_config_dir, test_data_dir
+
+
+def _write_output(output_dir):
+    # b depends on a, test of c depends on b.  d depends on nothing.
+    plan = {'jobs': [
+        {'name': 'a-1.0-on-linux', 'plan': []},
+        {'name': 'b-1.0-on-linux', 'plan': [{'get': 'rsync_a-1.0-on-linux',
+                                             'passed': ['a-1.0-on-linux']}]},
+        {'name': 'test-c-1.0-on-linux', 'plan': [{'get': 'rsync_b-1.0-on-linux',
+                                                  'passed': ['b-1.0-on-linux']}]},
+        {'name': 'd-1.0-on-linux', 'plan': []},
+    ]}
+    os.makedirs(output_dir)
+    with open(os.path.join(output_dir, 'plan.yml'), 'w') as f:
+        yaml.dump(plan, f)
+    nodes = ['a-1.0-on-linux', 'd-1.0-on-linux', 'b-1.0-on-linux', 'test-c-1.0-on-linux']
+    with open(os.path.join(output_dir, 'output_order_linux'), 'w') as f:
+        f.write('\n'.join(nodes) + '\n')
+    with open(os.path.join(output_dir, 'output_order_recipes_linux'), 'w') as f:
+        f.write('a\nd\nb\nc\n')
+    for node in nodes:
+        os.makedirs(os.path.join(output_dir, node))
+    return nodes
+
+
+def _fake_conda_build(failing=()):
+    calls = []
+
+    def call(cmd, stdout=None, stderr=None):
+        calls.append(cmd)
+        recipe = os.path.basename(cmd[-1])
+        if recipe in failing:
+            return 1
+        output = cmd[cmd.index('--output-folder') + 1]
+        os.makedirs(os.path.join(output, 'linux-64'))
+        with open(os.path.join(output, 'linux-64', recipe + '-0.tar.bz2'), 'w') as f:
+            f.write(recipe)
+        return 0
+    return call, calls
+
+
+def test_read_output_order(testing_workdir):
+    nodes = _write_output('output')
+    assert local_run.read_output_order('output') == nodes
+    assert local_run.read_output_order('output', ['win*']) == []
+
+
+def test_local_run(testing_workdir, mocker):
+    _write_output('output')
+    call, calls = _fake_conda_build()
+    mocker.patch.object(local_run.subprocess, 'call', side_effect=call)
+    update_index = mocker.patch.object(local_run.conda_build.api, 'update_index')
+    runner = local_run.LocalRun('output', channels=['conda-forge'])
+    results = runner.run(jobs=2)
+    assert {status for status, _ in results.values()} == {local_run.SUCCEEDED}
+    built = [os.path.basename(cmd[-1]) for cmd in calls]
+    assert built.index('a-1.0-on-linux') < built.index('b-1.0-on-linux')
+    assert built.index('b-1.0-on-linux') < built.index('test-c-1.0-on-linux')
+    by_node = {os.path.basename(cmd[-1]): cmd for cmd in calls}
+    assert '--test' in by_node['test-c-1.0-on-linux']
+    assert '--test' not in by_node['b-1.0-on-linux']
+    assert ['-c', 'conda-forge'] == by_node['a-1.0-on-linux'][-3:-1]
+    # b gets what a built, in its own indexed channel
+    channel = os.path.join(runner.work_dir, 'b-1.0-on-linux', 'indexed-artifacts')
+    assert channel in by_node['b-1.0-on-linux']
+    assert os.listdir(os.path.join(channel, 'linux-64')) == ['a-1.0-on-linux-0.tar.bz2']
+    update_index.assert_any_call(channel)
+    assert update_index.call_count == 2
+    assert os.path.isdir(os.path.join(runner.work_dir, 'stats'))
+
+
+def test_local_run_failure(testing_workdir, mocker, capsys):
+    _write_output('output')
+    call, calls = _fake_conda_build(failing=['a-1.0-on-linux'])
+    mocker.patch.object(local_run.subprocess, 'call', side_effect=call)
+    mocker.patch.object(local_run.conda_build.api, 'update_index')
+    assert not execute.local_run('output')
+    results = local_run.LocalRun('output').run()
+    assert results['a-1.0-on-linux'][0] == local_run.FAILED
+    assert results['b-1.0-on-linux'][0] == local_run.SKIPPED
+    assert results['test-c-1.0-on-linux'][0] == local_run.SKIPPED
+    # not held up by a
+    assert results['d-1.0-on-linux'][0] == local_run.SUCCEEDED
+    assert '1 succeeded, 1 failed, 2 skipped' in capsys.readouterr().out
+
+    del calls[:]
+    results = local_run.LocalRun('output').run(keep_going=False)
+    assert [os.path.basename(cmd[-1]) for cmd in calls] == ['a-1.0-on-linux']
+    assert results['d-1.0-on-linux'][0] == local_run.SKIPPED
+
+
+def test_local_run_dry_run(testing_workdir, mocker, capsys):
+    _write_output('output')
+    call = mocker.patch.object(local_run.subprocess, 'call')
+    assert execute.local_run('output', dry_run=True)
+    assert not call.called
+    assert capsys.readouterr().out.count('conda-build ') == 4
+
+
+def test_local_run_noarch_python(testing_workdir, mocker, monkeypatch):
+    # the test-only jobs of noarch: python packages are in the graph too
+    monkeypatch.chdir(os.path.join(test_data_dir, 'noarch_python_recipes'))
+    output = os.path.join(testing_workdir, 'output')
+    execute.compute_builds('.', 'config-name', folders=['pkg_a', 'pkg_b'],
+                           matrix_base_dir=test_config_dir, output_dir=output,
+                           variant_config_files=['conda_build_config.yaml'], save_graph=True)
+    plan_graph = graph_artifact.load_task_graph(os.path.join(output, 'plan.yml'))
+    graph = graph_artifact.load_task_graph(output)
+    assert set(graph.nodes()) == set(plan_graph.nodes())
+    assert set(graph.edges()) == set(plan_graph.edges())
+    assert graph.nodes['test-pkg_a-1.0.0-on-win-32']['test_only']
+    assert plan_graph.nodes['test-pkg_a-1.0.0-on-win-32']['test_only']
+
+    call = mocker.patch.object(local_run.subprocess, 'call', return_value=0)
+    mocker.patch.object(local_run.conda_build.api, 'update_index')
+    results = local_run.LocalRun(output, labels=['win-32']).run()
+    assert set(results) == {'test-pkg_a-1.0.0-on-win-32', 'pkg_b-1.0.0-python_3.6-on-win-32',
+                            'pkg_b-1.0.0-python_2.7-on-win-32'}
+    by_node = {os.path.basename(args[0][-1]): args[0] for args, _ in call.call_args_list}
+    assert '--test' in by_node['test-pkg_a-1.0.0-on-win-32']
@@ -0,0 +1,65 @@
+import pickle
+
+import networkx as nx
+
+from conda_concourse_ci import compute_build_graph, node_record
+
+
+def test_node_record_from_metadata(testing_metadata):
+    record = node_record.NodeRecord.from_metadata(testing_metadata)
+    assert record.name == testing_metadata.name()
+    assert record.version == '1.0'
+    assert record.meta_path == testing_metadata.meta_path
+    assert record.host_subdir == testing_metadata.config.host_subdir
+    # the same key, no matter what it is made from
+    for run in ('build', 'test'):
+        assert (compute_build_graph.package_key(record, 'linux', run) ==
+                compute_build_graph.package_key(testing_metadata, 'linux', run))
+    # no __dict__ to weigh it down, but it still pickles (for worker processes)
+    assert not hasattr(record, '__dict__')
+    assert pickle.loads(pickle.dumps(record)).variant == record.variant
+    assert node_record.NodeRecord.from_dict(record.to_dict()).to_dict() == record.to_dict()
+
+
+def test_compact_graph(testing_graph):
+    keys = {node: compute_build_graph.package_key(data['meta'], 'linux')
+            for node, data in testing_graph.nodes(data=True)}
+    compute_build_graph.compact_graph(testing_graph)
+    for node, data in testing_graph.nodes(data=True):
+        assert 'meta' not in data
+        assert data['record'].build is not None
+        assert node_record.node_record(testing_graph, node) is data['record']
+        assert compute_build_graph.package_key(data['record'], 'linux') == keys[node]
+
+
+def test_node_record_of_uncompacted_graph(testing_metadata):
+    g = nx.DiGraph()
+    g.add_node('node', meta=testing_metadata)
+    assert node_record.node_record(g, 'node').name == testing_metadata.name()
+    assert node_record.node_metadata(g, 'node') is testing_metadata
+
+
+def test_splice_intradependencies(testing_graph):
+    compute_build_graph.compact_graph(testing_graph)
+    testing_graph.remove_edge('b-on-linux', 'a-on-linux')
+    # b depends on a.  Splicing a in adds the edge back.
+    compute_build_graph.splice_intradependencies(testing_graph, ['a-on-linux'])
+    assert testing_graph.has_edge('b-on-linux', 'a-on-linux')
+
+
+def test_node_record_metadata_renders_for_its_platform(mocker):
+    record = node_record.NodeRecord(
+        name='a', version='1.0', package_name='a', used_vars=('python', ),
+        variant={'python': '3.9'},
+        subdir='osx-arm64', host_subdir='osx-arm64', meta_path='/recipes/a/meta.yaml',
+        squished_variants={}, channel_urls=('defaults', ), noarch=None, worker_tags=())
+    other, matching = mocker.MagicMock(), mocker.MagicMock()
+    other.name.return_value = matching.name.return_value = 'a'
+    other.config.variant = {'python': '3.8'}
+    matching.config.variant = {'python': '3.9'}
+    render = mocker.patch.object(node_record.conda_build.api, 'render',
+                                 return_value=[(other, None, None), (matching, None, None)])
+    assert record.metadata() is matching
+    assert render.call_args[0] == ('/recipes/a', )
+    assert render.call_args[1]['platform'] == 'osx'
+    assert render.call_args[1]['arch'] == 'arm64'
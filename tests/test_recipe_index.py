@@ -0,0 +1,152 @@
+import os
+
+from conda_concourse_ci import recipe_index
+from .utils import test_data_dir
+
+
+def test_static_meta_substitutes_set_variables():
+    text = '\n'.join([
+        '{% set name = "Foo_Bar" %}',
+        '{% set version = "1.0" %}',
+        '{% set files = [',
+        '    "a",',
+        '] %}',
+        'package:',
+        '  name: {{ name|lower|replace("_", "-") }}',
+        '  version: {{ version }}',
+        'outputs:',
+        '  - name: lib{{ name|lower }}',
+        '  - name: {{ name }}-{{ PY_VER }}',
+    ])
+    meta = recipe_index.static_meta(text)
+    assert meta['package'] == {'name': 'foo-bar', 'version': 1.0}
+    assert meta['outputs'][0]['name'] == 'libfoo_bar'
+    # can't know the output names of this without rendering
+    assert recipe_index.output_names(meta) is None
+
+
+def test_static_meta_selectors():
+    meta = recipe_index.static_meta('\n'.join([
+        '{% set name = "foo" %}',
+        '{% set suffix = "" %}',
+        '{% set suffix = "-win" %}  # [win]',
+        '{% if win %}',
+        '{% set docs = "foo-docs-win" %}',
+        '{% endif %}',
+        'package:',
+        '  name: libfoo  # [not win]',
+        '  name: libfoo-win  # [win]',
+        'outputs:',
+        '  - name: {{ name }}',
+        '  - name: {{ name }}{{ suffix }}',
+        '  - name: {{ docs }}',
+        '  - name: bar',
+        '    version: 1.0.0  # [unix]',
+    ]))
+    # which name applies depends on the platform
+    assert meta['package']['name'] == recipe_index.UNKNOWN
+    assert [output['name'] for output in meta['outputs'][:2]] == [
+        'foo', 'foo' + recipe_index.UNKNOWN]
+    assert meta['outputs'][2]['name'] == recipe_index.UNKNOWN
+    assert meta['outputs'][3]['version'] == recipe_index.UNKNOWN
+    assert recipe_index.output_names(meta) is None
+
+
+def test_requirement_names():
+    meta = recipe_index.static_meta('\n'.join([
+        'requirements:',
+        '  build:',
+        '    - {{ compiler("c") }}',
+        '    - cmake >=3.10',
+        '  run:',
+        '    - python  # [py3k]',
+        'test:',
+        '  requires:',
+        '    - pytest',
+        'outputs:',
+        '  - name: libfoo',
+        '    requirements:',
+        '      - zlib',
+    ]))
+    assert recipe_index.requirement_names(meta) == {recipe_index.COMPILER, 'cmake', 'python',
+                                                    'pytest', 'zlib'}
+
+
+def test_static_versions():
+    meta = recipe_index.static_meta('\n'.join([
+        '{% set version = "1.10.2" %}',
+        'package:',
+        '  name: foo',
+        '  version: {{ version }}',
+        'outputs:',
+        '  - name: libfoo',
+        '  - name: foo-docs',
+        '    version: 1.10',
+    ]))
+    # yaml would make 1.10 out of 1.1
+    assert recipe_index.static_versions(meta) == {'foo': '1.10.2', 'libfoo': '1.10.2'}
+
+
+def test_static_versions_control_blocks():
+    for text in (
+            ['{% if win %}{% set version = "1.0" %}{% else %}{% set version = "2.0" %}{% endif %}',
+             'package:', '  name: foo', '  version: {{ version }}'],
+            ['{% if win %}', '{% set version = "1.0" %}', '{% endif %}',
+             'package:', '  name: foo', '  version: {{ version }}'],
+            ['{% set version = "1.0" if win else "2.0" %}',
+             'package:', '  name: foo', '  version: {{ version }}'],
+            ['package:', '  name: foo', '  version: "1.0"  # [win]', '  version: "2.0"  # [not win]'],
+            ['package:', '  name: foo', '{% if win %}', '  version: "1.0"', '{% endif %}'],
+            ['package:', '  name: foo',
+             '  version: {% if win %}"1.0"{% else %}"2.0"{% endif %}']):
+        meta = recipe_index.static_meta('\n'.join(text))
+        assert recipe_index.static_versions(meta) == {}, text
+        assert recipe_index.output_names(meta) == ['foo']
+
+
+def test_recipe_index():
+    index = recipe_index.RecipeIndex(os.path.join(test_data_dir, 'intradependencies'))
+    # the folder name is not the package name
+    assert index.recipe_dirs('zlib_wannabe') == ['zlib']
+    assert index.recipe_dirs('zlib') == []
+    assert index.requirements['uses_zlib'] == {'zlib_wannabe'}
+    index = recipe_index.RecipeIndex(os.path.join(test_data_dir, 'version_resolution'))
+    assert index.recipe_dirs('upstream') == ['upstream-1.0', 'upstream-2.0']
+
+
+def test_recipe_index_unresolved(testing_workdir):
+    os.makedirs(os.path.join('recipes', 'mystery-1.0'))
+    with open(os.path.join('recipes', 'mystery-1.0', 'meta.yaml'), 'w') as f:
+        f.write('package:\n  name: {{ environ["NAME"] }}\n')
+    index = recipe_index.RecipeIndex('recipes')
+    assert index.unresolved == ['mystery-1.0']
+    # falls back to matching the folder name
+    assert index.recipe_dirs('mystery') == ['mystery-1.0']
+    assert index.recipe_dirs('other') == []
+
+
+def test_recipe_index_selector_name(testing_workdir):
+    os.makedirs(os.path.join('recipes', 'libfoo'))
+    with open(os.path.join('recipes', 'libfoo', 'meta.yaml'), 'w') as f:
+        f.write('package:\n  name: libfoo  # [not win]\n  name: libfoo-win  # [win]\n')
+    index = recipe_index.RecipeIndex('recipes')
+    assert index.unresolved == ['libfoo']
+    assert index.names == {}
+    assert index.recipe_dirs('libfoo') == ['libfoo']
+
+
+def test_recipe_index_downstream(testing_workdir):
+    recipes = {'a': [], 'b': ['a'], 'c': ['b'], 'd': [], 'e': ['{{ compiler("c") }}'],
+               'gcc': [], 'f': ['{{ some_variable }}']}
+    for name, requirements in recipes.items():
+        os.makedirs(os.path.join('recipes', name))
+        with open(os.path.join('recipes', name, 'meta.yaml'), 'w') as f:
+            f.write('package:\n  name: {}\nrequirements:\n  build:\n'.format(
+                'gcc_linux-64' if name == 'gcc' else name))
+            f.writelines('    - {}\n'.format(r) for r in requirements)
+    index = recipe_index.RecipeIndex('recipes')
+    # f's requirements can't be read, so it may depend on anything
+    assert index.downstream({'a'}, steps=1) == {'a', 'b', 'f'}
+    assert index.downstream({'a'}) == {'a', 'b', 'c', 'f'}
+    assert index.downstream({'gcc'}, steps=1) == {'gcc', 'e', 'f'}
+    assert not index.may_depend_on('d', {'a'})
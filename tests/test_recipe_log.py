@@ -0,0 +1,77 @@
+import os
+import subprocess
+
+import pytest
+
+from conda_concourse_ci import recipe_log
+
+
+@pytest.fixture(autouse=True)
+def reset_recipe_logs():
+    recipe_log._logs.clear()
+    yield
+    recipe_log.set_recipe_log_options()
+    recipe_log._logs.clear()
+
+
+def _read_log(folder):
+    with open(os.path.join(folder, 'recipe_log.txt')) as f:
+        return f.read()
+
+
+def test_head_sha(testing_git_repo):
+    sha = subprocess.check_output(['git', 'rev-parse', 'HEAD']).decode().strip()
+    assert recipe_log.head_sha('test_dir_1') == sha
+    subprocess.check_call(['git', 'pack-refs', '--all'])
+    assert recipe_log.head_sha('test_dir_1') == sha
+    subprocess.check_call(['git', 'checkout', 'HEAD~1'])
+    assert recipe_log.head_sha('.') != sha
+
+
+def test_write_recipe_logs(mocker, testing_git_repo):
+    recipe_log.set_recipe_log_options(max_count=2)
+    git_log = mocker.spy(recipe_log, '_git_log')
+    recipe_log.write_recipe_logs(['test_dir_1', 'test_dir_2', 'test_dir_3'])
+    # all of them are in the same repo, at the same commit
+    assert git_log.call_count == 1
+    assert _read_log('test_dir_1') == _read_log('test_dir_3')
+    assert _read_log('test_dir_1').count('\ncommit ') == 1
+    recipe_log.write_recipe_log('test_dir_1')
+    assert git_log.call_count == 1
+
+
+def test_recipe_log_cache_dir(mocker, testing_git_repo):
+    cache_dir = os.path.abspath('cache')
+    recipe_log.set_recipe_log_options(max_count=0, cache_dir=cache_dir)
+    recipe_log.write_recipe_log('test_dir_1')
+    assert len(os.listdir(cache_dir)) == 1
+    # a later run
+    recipe_log._logs.clear()
+    git_log = mocker.spy(recipe_log, '_git_log')
+    recipe_log.write_recipe_log('test_dir_2')
+    assert not git_log.called
+    assert _read_log('test_dir_2').count('    commit ') == 4
+
+
+def test_recipe_log_since(mocker, testing_git_repo):
+    cache_dir = os.path.abspath('cache')
+    recipe_log.set_recipe_log_options(since='2000-01-01', cache_dir=cache_dir)
+    git_log = mocker.spy(recipe_log, '_git_log')
+    recipe_log.write_recipe_log('test_dir_1')
+    # the date, as git reads it, is part of the key
+    since_time = git_log.call_args[0][2]
+    assert isinstance(since_time, int)
+    assert os.listdir(cache_dir)[0].endswith('-0-{}.txt'.format(since_time))
+    assert _read_log('test_dir_1').count('    commit ') == 4
+
+    # a later run, for which '1 year ago' is later than in the run that cached its log
+    recipe_log.set_recipe_log_options(since='1 year ago', cache_dir=cache_dir)
+    recipe_log.write_recipe_log('test_dir_1')
+    recipe_log.set_recipe_log_options(since='1 year ago', cache_dir=cache_dir)
+    recipe_log._logs.clear()
+    mocker.patch.object(recipe_log.subprocess, 'check_output',
+                        side_effect=[b'--max-age=2000000000\n', b''])
+    recipe_log.write_recipe_log('test_dir_1')
+    assert recipe_log.subprocess.check_output.call_args[0][0] == [
+        'git', 'log', '--max-age=2000000000']
+    assert _read_log('test_dir_1') == ''
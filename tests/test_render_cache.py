@@ -0,0 +1,61 @@
+import os
+
+from conda_build.api import Config
+
+from conda_concourse_ci import render_cache
+from .utils import default_worker, make_recipe
+
+
+def test_recipe_content_hash(testing_workdir):
+    make_recipe('some_recipe')
+    first = render_cache.recipe_content_hash('some_recipe')
+    # the recipe log is written by c3i and should not invalidate the cache
+    with open(os.path.join('some_recipe', 'recipe_log.txt'), 'w') as f:
+        f.write('commit abc')
+    assert render_cache.recipe_content_hash('some_recipe') == first
+    assert render_cache.recipe_content_hash(os.path.join('some_recipe', 'meta.yaml')) == first
+    with open(os.path.join('some_recipe', 'build.sh'), 'w') as f:
+        f.write('make install')
+    assert render_cache.recipe_content_hash('some_recipe') != first
+
+
+def test_render_cache_key(testing_workdir):
+    make_recipe('some_recipe')
+    config = Config()
+    config.channel_urls = []
+    key = render_cache.render_cache_key('some_recipe', default_worker, config)
+    assert key == render_cache.render_cache_key('some_recipe', default_worker, config)
+    other_worker = dict(default_worker, platform='win')
+    assert key != render_cache.render_cache_key('some_recipe', other_worker, config)
+    config.channel_urls = ['conda-forge']
+    assert key != render_cache.render_cache_key('some_recipe', default_worker, config)
+
+
+def test_render_cache_get_put(testing_workdir):
+    cache = render_cache.RenderCache('cache')
+    assert cache.get('abc123') is None
+    cache.put('abc123', [('metadata', False, False)])
+    assert cache.get('abc123') == [('metadata', False, False)]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_render_cache_discards_corrupt_entries(testing_workdir):
+    cache = render_cache.RenderCache('cache')
+    cache.put('abc123', 'value')
+    with open(cache._path('abc123'), 'wb') as f:
+        f.write(b'garbage')
+    assert cache.get('abc123') is None
+    assert not os.path.exists(cache._path('abc123'))
+
+
+def test_render_cache_lru_eviction(testing_workdir):
+    cache = render_cache.RenderCache('cache', max_size=3500)
+    for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+        cache.put(key, b'x' * 1000)
+        os.utime(cache._path(key), (i, i))
+    # reading an entry makes it the most recently used one
+    assert cache.get('aa1')
+    cache.put('dd4', b'x' * 1000)
+    assert cache.get('bb2') is None
+    assert cache.get('aa1') is not None
+    assert cache.get('dd4') is not None
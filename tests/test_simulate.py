@@ -0,0 +1,93 @@
+import os
+
+import networkx as nx
+import yaml
+
+from conda_concourse_ci import execute, graph_artifact, simulate
+
+from .utils import test_config_dir
+
+
+def _graph():
+    # c depends on b, which depends on a.  d and e depend on nothing.  f is on another platform.
+    g = nx.DiGraph()
+    for node in ('a', 'b', 'c', 'd', 'e'):
+        g.add_node(node, worker={'label': 'linux'})
+    g.add_node('f', worker={'label': 'win'})
+    g.add_edges_from([('c', 'b'), ('b', 'a')])
+    return g
+
+
+def test_simulate():
+    g = _graph()
+    durations = {'a': 10, 'b': 10, 'c': 10, 'd': 30, 'e': 5, 'f': 100}
+    # one linux worker: jobs run in turn, in the order they became ready
+    result = simulate.simulate(g, durations, {'linux': 1})
+    assert result.makespan == 100
+    assert [result.start[node] for node in 'adebc'] == [0, 10, 40, 45, 55]
+    assert result.utilization('linux') == 65 / 100.0
+    assert result.utilization('win') == 1.0
+    assert result.critical_path == ['f']
+    assert result.lower_bound == 100
+
+    durations['f'] = 1
+    result = simulate.simulate(g, durations, {'linux': 1})
+    assert result.makespan == 65
+    # b waited for d and e
+    assert result.critical_path == ['a', 'b', 'c']
+    assert result.lower_bound == 30
+    # ties go by order
+    result = simulate.simulate(g, durations, {'linux': 1}, order=['d', 'e', 'a', 'b', 'c', 'f'])
+    assert [result.start[node] for node in 'deabc'] == [0, 30, 35, 45, 55]
+
+    assert simulate.simulate(g, durations, {'linux': 2}).makespan == 35
+    durations['d'] = 40
+    result = simulate.simulate(g, durations, {'linux': 5})
+    assert result.makespan == 40
+    assert result.critical_path == ['d']
+    # overhead is added to every job
+    assert simulate.simulate(g, durations, {'linux': 5}, overhead=10).makespan == 60
+    assert 'critical path:' in simulate.format_report(result, g)
+
+
+def test_plan_graph(testing_workdir):
+    plan = {'jobs': [
+        {'name': 'a-1.0-on-linux', 'plan': [{'get': 'rsync-recipes'}]},
+        {'name': 'b-1.0-on-linux', 'plan': [{'get': 'rsync_a-1.0-on-linux',
+                                             'passed': ['a-1.0-on-linux']}]},
+        {'name': 'test-c-1.0-on-linux', 'plan': [{'get': 'rsync_b-1.0-on-linux',
+                                                  'passed': ['b-1.0-on-linux']}]},
+        {'name': 'anaconda_upload', 'plan': [{'get': 'rsync_b-1.0-on-linux',
+                                              'passed': ['b-1.0-on-linux']}]},
+    ]}
+    os.makedirs('output')
+    with open(os.path.join('output', 'plan.yml'), 'w') as f:
+        yaml.dump(plan, f)
+    g = graph_artifact.load_task_graph('output')
+    assert set(g.nodes()) == {'a-1.0-on-linux', 'b-1.0-on-linux', 'test-c-1.0-on-linux'}
+    assert set(g.edges()) == {('b-1.0-on-linux', 'a-1.0-on-linux'),
+                              ('test-c-1.0-on-linux', 'b-1.0-on-linux')}
+    assert g.nodes['a-1.0-on-linux']['worker']['label'] == 'linux'
+
+    with open(os.path.join(test_config_dir, 'build_platforms.d', 'centos5-64.yml')) as f:
+        platform = yaml.safe_load(f)
+    platform['workers'] = 3
+    assert simulate.platform_workers([platform]) == {'centos5-64': 3}
+    assert simulate.platform_workers([platform], {'centos5-64': 5}) == {'centos5-64': 5}
+
+    os.makedirs('stats')
+    with open(os.path.join('stats', 'a-0.9-on-linux_100.json'), 'w') as f:
+        f.write('{"build_a": {"elapsed": 60}}')
+    result = execute.simulate('output', build_stats=['stats'], workers=['linux=2'])
+    # b and the test of c have no stats, and take as long as a
+    assert result.makespan == 180
+    assert result.workers == {'linux': 2}
+
+    # the test job of c wrote its stats as test-c
+    with open(os.path.join('stats', 'test-c-0.9-on-linux_100.json'), 'w') as f:
+        f.write('{"test_c": {"elapsed": 30}}')
+    result = execute.simulate('output', build_stats=['stats'], workers=['linux=2'])
+    job = 'test-c-1.0-on-linux'
+    assert result.end[job] - result.start[job] == 30
+    # b takes the median of a and the test of c
+    assert result.makespan == 60 + 45 + 30
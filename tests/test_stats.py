@@ -0,0 +1,59 @@
+import json
+import os
+
+from conda_concourse_ci import durations, execute, stats
+
+
+def _write_stats(folder, node, when, elapsed, rss, disk=1000):
+    os.makedirs(folder, exist_ok=True)
+    content = {'build_' + node: {'elapsed': elapsed * 0.75, 'cpu_user': elapsed,
+                                 'cpu_sys': 1, 'rss': rss, 'disk': disk},
+               'test_' + node: {'elapsed': elapsed * 0.25, 'cpu_user': 1,
+                                'cpu_sys': 1, 'rss': rss // 2, 'disk': disk}}
+    with open(os.path.join(folder, '{}_{}.json'.format(node, when)), 'w') as f:
+        json.dump(content, f)
+
+
+def test_split_node():
+    assert stats.split_node('python-dateutil-2.8.0-py_3.7-on-centos5-64') == (
+        'python-dateutil', '2.8.0', 'py_3.7', 'centos5-64', False)
+    assert stats.split_node('c3itest-llvm-10.0.1-on-linux') == (
+        'llvm', '10.0.1', '', 'linux', True)
+    assert stats.split_node('test-pkg_a-1.0.0-on-win-32') == (
+        'pkg_a', '1.0.0', '', 'win-32', True)
+    assert stats.split_node('odd') == ('odd', '', '', '', False)
+
+
+def test_ingest_and_query(testing_workdir, capsys):
+    _write_stats('stats', 'llvm-10.0.1-on-linux', 100, 3600, 8 * 1024 ** 3)
+    _write_stats('stats', 'llvm-10.0.1-on-linux', 200, 4000, 6 * 1024 ** 3)
+    _write_stats('stats', 'zlib-1.2.11-on-linux', 100, 60, 100 * 1024 ** 2)
+    _write_stats('stats', 'pandas-1.0.0-py_3.8-on-linux', 100, 1200, 12 * 1024 ** 3)
+    _write_stats('stats', 'c3itest-zlib-1.2.11-on-linux', 100, 10000, 1)
+    with open(os.path.join('stats', 'README'), 'w') as f:
+        f.write('not stats')
+    db = stats.BuildStats('stats.sqlite')
+    assert db.ingest(['stats']) == 5
+    # already known
+    assert db.ingest(['stats']) == 0
+    _write_stats('stats', 'zlib-1.2.11-on-linux', 300, 90, 100 * 1024 ** 2)
+    assert db.ingest(['stats']) == 1
+
+    slowest = db.top('elapsed')
+    assert [row['package'] for row in slowest] == ['llvm', 'pandas', 'zlib']
+    assert slowest[0]['builds'] == 2
+    assert slowest[0]['elapsed'] == (3800, 4000)
+    assert slowest[0]['rss'][1] == 8 * 1024 ** 3
+    assert [row['package'] for row in db.top('rss', limit=2)] == ['pandas', 'llvm']
+    assert db.top('elapsed', include_tests=True)[0]['package'] == 'zlib'
+    assert db.top('elapsed', platform='win-64') == []
+    assert db.durations()['zlib-1.2.11-on-linux'] == 90
+    db.close()
+
+    # a database can stand in for stats files when ordering builds
+    assert durations.load_durations(['stats.sqlite'])['llvm-10.0.1-on-linux'] == 4000
+
+    execute.stats_query('stats.sqlite', limit=1)
+    out = capsys.readouterr().out
+    assert 'slowest recipes:' in out and 'most memory-hungry recipes:' in out
+    assert 'llvm' in out and '1:06:40' in out and 'pandas' in out and '12GB' in out